@@ -0,0 +1,135 @@
+"""Admission control for expensive routes.
+
+Each route group gets a concurrency limit and a bounded wait queue. Waiters are grouped per user and served
+round-robin. A request that finds a free slot always runs; one that would have to wait is only queued while its
+user holds fewer than per_user slots (running + queued) in the group, so a few heavy users cannot take a busy
+group, while a lone user on an idle server is never turned away. When the queue is full, a waiting user is over
+their share, or the wait times out, the request is shed immediately with 503 and Retry-After instead of piling
+up in the threadpool.
+"""
+import asyncio
+from collections import OrderedDict, deque
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from metrics import metrics
+
+ROUTE_GROUPS = {
+    "dashboard": ("/dashboard",),
+    "projects": ("/projects",),
+    "customers": ("/customers",),
+    "exports": ("/reports", "/api/reports", "/api/v1/changes"),
+}
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class RouteLimiter:
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, per_user: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self._per_user = {}           # user -> running + queued requests
+        self._waiters = OrderedDict()  # user -> deque of futures, rotated for round-robin
+
+    def _publish(self):
+        metrics.set_gauge("admission_active", self.active, route=self.name)
+        metrics.set_gauge("admission_queue_depth", self.queued, route=self.name)
+
+    async def acquire(self, user: str):
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self._per_user[user] = self._per_user.get(user, 0) + 1
+            self._publish()
+            return
+        # The group is busy: only now does fairness apply.
+        if self._per_user.get(user, 0) >= self.per_user:
+            raise Overloaded("per_user")
+        if self.queued >= self.max_queue:
+            raise Overloaded("queue_full")
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user, deque()).append(future)
+        self.queued += 1
+        self._per_user[user] = self._per_user.get(user, 0) + 1
+        self._publish()
+        try:
+            await asyncio.wait({future}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if future.done(): self.release(user)  # the slot was handed over just as the client went away
+            else: self._remove(user, future)
+            raise
+        if not future.done():
+            self._remove(user, future)
+            raise Overloaded("timeout")
+
+    def _remove(self, user: str, future: asyncio.Future):
+        future.cancel()
+        waiters = self._waiters.get(user)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            self.queued -= 1
+            if not waiters: del self._waiters[user]
+        self._release_user(user)
+        self._publish()
+
+    def _release_user(self, user: str):
+        remaining = self._per_user.get(user, 0) - 1
+        if remaining > 0: self._per_user[user] = remaining
+        else: self._per_user.pop(user, None)
+
+    def release(self, user: str):
+        self._release_user(user)
+        while self._waiters:
+            next_user, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            self.queued -= 1
+            if waiters: self._waiters.move_to_end(next_user)
+            else: del self._waiters[next_user]
+            if not future.done():
+                future.set_result(None)  # hand our slot straight to the waiter; active stays the same
+                self._publish()
+                return
+        self.active -= 1
+        self._publish()
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, app, limits: dict, per_user: int = 2, queue_timeout: float = 10, retry_after: int = 5):
+        self.app = app
+        self.retry_after = retry_after
+        self.limiters = [
+            (prefixes, RouteLimiter(name, limits[name][0], limits[name][1], per_user, queue_timeout))
+            for name, prefixes in ROUTE_GROUPS.items() if name in limits
+        ]
+
+    def _match(self, path: str):
+        for prefixes, limiter in self.limiters:
+            if any(path == prefix or path.startswith(prefix + "/") for prefix in prefixes):
+                return limiter
+        return None
+
+    async def __call__(self, scope, receive, send):
+        limiter = self._match(scope["path"]) if scope["type"] == "http" else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        user = request.cookies.get("user_id") or (request.client.host if request.client else "anonymous")
+        try:
+            await limiter.acquire(user)
+        except Overloaded as exc:
+            metrics.inc("admission_rejected", route=limiter.name, reason=exc.reason)
+            response = PlainTextResponse("Server is busy, please retry shortly.", status_code=503, headers={"Retry-After": str(self.retry_after)})
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(user)
@@ -0,0 +1,172 @@
+"""Workload analytics over the tasks table.
+
+Task columns are fetched in one pass as raw DB-API rows, converted to NumPy arrays, and every aggregate is
+computed with array operations (bincount / lexsort) instead of per-task Python loops. Fetching a million rows
+dominates the cost, so one load serves every window, and a scheduled job refreshes the cache before the TTL
+expires so requests normally only read it.
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+from sqlalchemy.orm import Session
+from database import read_only
+from models import User
+
+ANALYTICS_WINDOWS = [7, 30, 90]
+CACHE_TTL_SECONDS = 300
+
+_TASK_COLUMNS_SQL = "SELECT assigned_to, status = 'Completed', success_percent, end_date, created_at, completed_at FROM tasks"
+
+
+class TTLCache:
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            self._entries.pop(key, None)
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_report_cache = TTLCache(CACHE_TTL_SECONDS)
+
+
+@read_only
+def load_task_columns(db: Session) -> dict:
+    cursor = db.connection().connection.cursor()  # raw DB-API cursor: plain tuples convert to arrays much faster than Row objects
+    try:
+        cursor.execute(_TASK_COLUMNS_SQL)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    table = np.array(rows, dtype=object).reshape(len(rows), 6)
+    return {
+        "assigned_to": np.where(table[:, 0] == None, -1, table[:, 0]).astype(np.int64),  # noqa: E711 (elementwise)
+        "completed": table[:, 1].astype(bool),
+        "success_percent": table[:, 2].astype(np.float64),  # None becomes NaN
+        "end_date": table[:, 3].astype("datetime64[D]"),
+        "created_at": table[:, 4].astype("datetime64[s]"),
+        "completed_at": table[:, 5].astype("datetime64[s]"),
+    }
+
+
+@read_only
+def _load_users(db: Session):
+    return db.query(User.id, User.username, User.section).all()
+
+
+def _group_stats(group: np.ndarray, n_groups: int, cols: dict, window_start: np.datetime64, today: np.datetime64) -> dict:
+    open_mask = ~cols["completed"]
+    overdue_mask = open_mask & (cols["end_date"] < today)  # NaT compares False
+    completed_in_window = cols["completed"] & (cols["completed_at"] >= window_start)
+    active = open_mask | completed_in_window | (cols["created_at"] >= window_start)
+
+    percent = np.nan_to_num(cols["success_percent"])
+    lead_days = (cols["completed_at"] - cols["created_at"]).astype("timedelta64[s]").astype(np.float64) / 86400.0
+
+    open_count = np.bincount(group, weights=open_mask, minlength=n_groups)
+    overdue_count = np.bincount(group, weights=overdue_mask, minlength=n_groups)
+    active_count = np.bincount(group, weights=active, minlength=n_groups)
+    percent_sum = np.bincount(group, weights=np.where(active, percent, 0.0), minlength=n_groups)
+    done_count = np.bincount(group[completed_in_window], minlength=n_groups)
+    lead_sum = np.bincount(group[completed_in_window], weights=lead_days[completed_in_window], minlength=n_groups)
+
+    # Median lead time: sort completed tasks by (group, lead time) once, then index the middle of each group's run.
+    done_groups = group[completed_in_window]
+    done_lead = lead_days[completed_in_window]
+    order = np.lexsort((done_lead, done_groups))
+    sorted_lead = done_lead[order]
+    starts = np.concatenate(([0], np.cumsum(done_count)[:-1])).astype(np.int64)
+    median = np.full(n_groups, np.nan)
+    has_done = done_count > 0
+    lower = starts + (done_count - 1) // 2
+    upper = starts + done_count // 2
+    median[has_done] = (sorted_lead[lower[has_done]] + sorted_lead[upper[has_done]]) / 2.0
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {
+            "open_tasks": open_count.astype(np.int64),
+            "overdue_tasks": overdue_count.astype(np.int64),
+            "overdue_ratio": np.where(open_count > 0, overdue_count / open_count, 0.0),
+            "avg_success_percent": np.where(active_count > 0, percent_sum / active_count, np.nan),
+            "completed_in_window": done_count.astype(np.int64),
+            "avg_lead_time_days": np.where(has_done, lead_sum / np.maximum(done_count, 1), np.nan),
+            "median_lead_time_days": median,
+        }
+
+
+def _rows(labels: list, stats: dict) -> list:
+    rows = []
+    for index, label in enumerate(labels):
+        row = dict(label)
+        for name, values in stats.items():
+            value = values[index].item()
+            row[name] = None if isinstance(value, float) and np.isnan(value) else (round(value, 2) if isinstance(value, float) else value)
+        rows.append(row)
+    return rows
+
+
+def _build_report(cols: dict, users: list, window_days: int) -> dict:
+    started = time.perf_counter()
+    today = np.datetime64(date.today(), "D")
+    window_start = np.datetime64(datetime.utcnow() - timedelta(days=window_days), "s")
+
+    # Per user: dense group index from the assigned_to ids present in the data.
+    user_ids, user_group = np.unique(cols["assigned_to"], return_inverse=True)
+    user_info = {user.id: user for user in users}
+    user_stats = _group_stats(user_group, len(user_ids), cols, window_start, today)
+    user_labels = [
+        {"user_id": int(uid), "username": user_info[uid].username if uid in user_info else None, "section": user_info[uid].section if uid in user_info else None}
+        for uid in user_ids.tolist()
+    ]
+
+    # Per section: map each user group to a section group, then reuse the per-task user index.
+    sections = sorted({label["section"] or "" for label in user_labels})
+    section_index = {name: i for i, name in enumerate(sections)}
+    user_to_section = np.array([section_index[label["section"] or ""] for label in user_labels], dtype=np.int64)
+    section_group = user_to_section[user_group] if len(user_group) else np.zeros(0, dtype=np.int64)
+    section_stats = _group_stats(section_group, len(sections), cols, window_start, today)
+
+    return {
+        "window_days": window_days,
+        "generated_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "task_count": int(len(cols["assigned_to"])),
+        "compute_seconds": round(time.perf_counter() - started, 4),
+        "by_user": _rows(user_labels, user_stats),
+        "by_section": _rows([{"section": name or None} for name in sections], section_stats),
+    }
+
+
+def compute_workload_reports(db: Session, windows: list = ANALYTICS_WINDOWS) -> dict:
+    """Loads the task columns once and builds a report for each window."""
+    cols = load_task_columns(db)
+    users = _load_users(db)
+    return {window_days: _build_report(cols, users, window_days) for window_days in windows}
+
+
+def refresh_workload_reports(db: Session) -> dict:
+    reports = compute_workload_reports(db)
+    for window_days, report in reports.items():
+        _report_cache.set(window_days, report)
+    return reports
+
+
+def get_workload_report(db: Session, window_days: int = 30) -> dict:
+    report = _report_cache.get(window_days)
+    if report is None:
+        report = refresh_workload_reports(db)[window_days]
+    return report
@@ -0,0 +1,57 @@
+"""Moves old Completed tasks and read notifications into the *_archive tables.
+
+Work is done in small batches, each its own short transaction (copy, delete, commit), with a pause between
+batches so request writers are never locked out for long.
+"""
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert, or_, and_, select
+from sqlalchemy.orm import Session
+from models import Task, Notification, ArchivedTask, ArchivedNotification, add_tombstones, delete_task_dependencies
+
+
+def _shared_columns(source, target):
+    return [column.name for column in source.__table__.columns if column.name in target.__table__.columns]
+
+
+def _move_batch(db: Session, source, target, ids: list):
+    columns = _shared_columns(source, target)
+    db.execute(insert(target.__table__).from_select(columns, select(*[source.__table__.c[name] for name in columns]).where(source.id.in_(ids))))
+    db.query(source).filter(source.id.in_(ids)).delete(synchronize_session=False)
+
+
+def archive_completed_tasks(db: Session, older_than_days: int, batch_size: int = 500, pause_seconds: float = 0.05) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    moved = 0
+    while True:
+        ids = [row[0] for row in db.query(Task.id).filter(
+            Task.status == 'Completed',
+            or_(Task.completed_at < cutoff, and_(Task.completed_at.is_(None), Task.created_at < cutoff)),
+        ).order_by(Task.id).limit(batch_size).all()]
+        if not ids:
+            return moved
+        # Notifications of archived tasks follow them, read or not, so no live row points at a missing task.
+        notification_ids = [row[0] for row in db.query(Notification.id).filter(Notification.task_id.in_(ids)).all()]
+        if notification_ids:
+            _move_batch(db, Notification, ArchivedNotification, notification_ids)
+        add_tombstones(db, "task", ids)  # archived tasks leave the live set that sync clients mirror
+        delete_task_dependencies(db, ids)
+        _move_batch(db, Task, ArchivedTask, ids)
+        db.commit()
+        moved += len(ids)
+        time.sleep(pause_seconds)
+
+
+def archive_read_notifications(db: Session, older_than_days: int, batch_size: int = 500, pause_seconds: float = 0.05) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    moved = 0
+    while True:
+        ids = [row[0] for row in db.query(Notification.id).filter(
+            Notification.is_read == 1, Notification.created_at < cutoff,
+        ).order_by(Notification.id).limit(batch_size).all()]
+        if not ids:
+            return moved
+        _move_batch(db, Notification, ArchivedNotification, ids)
+        db.commit()
+        moved += len(ids)
+        time.sleep(pause_seconds)
@@ -0,0 +1,61 @@
+import hashlib
+import os
+from fastapi.staticfiles import StaticFiles
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+class AssetManifest:
+    """Maps static files to content-hashed names, e.g. css/app.css -> css/app.3f2a9c1b.css"""
+
+    def __init__(self, directory: str, hash_length: int = 8):
+        self.directory = directory
+        self.hash_length = hash_length
+        self._fingerprints = {}  # original path -> fingerprinted path
+        self._originals = {}     # fingerprinted path -> original path
+        self._loaded = False
+
+    def load(self):
+        self._fingerprints.clear()
+        self._originals.clear()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                full_path = os.path.join(root, name)
+                path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+                with open(full_path, "rb") as f:
+                    digest = hashlib.md5(f.read()).hexdigest()[:self.hash_length]
+                stem, ext = os.path.splitext(path)
+                fingerprinted = f"{stem}.{digest}{ext}"
+                self._fingerprints[path] = fingerprinted
+                self._originals[fingerprinted] = path
+        self._loaded = True
+
+    def fingerprint(self, path: str) -> str:
+        if not self._loaded: self.load()
+        return self._fingerprints.get(path.lstrip("/"), path)
+
+    def resolve(self, fingerprinted: str):
+        if not self._loaded: self.load()
+        return self._originals.get(fingerprinted.replace(os.sep, "/"))
+
+
+class FingerprintedStaticFiles(StaticFiles):
+    """StaticFiles that serves hashed names with an immutable Cache-Control and plain names with revalidation."""
+
+    def __init__(self, *, directory: str, manifest: AssetManifest, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.manifest = manifest
+
+    async def get_response(self, path: str, scope):
+        original = self.manifest.resolve(path)
+        response = await super().get_response(original or path, scope)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if original else REVALIDATE_CACHE_CONTROL
+        return response
+
+
+def static_url_helper(manifest: AssetManifest, prefix: str = "/static"):
+    """Returns a template global: {{ static_url('css/app.css') }} -> /static/css/app.<hash>.css"""
+    def static_url(path: str) -> str:
+        return f"{prefix}/{manifest.fingerprint(path)}"
+    return static_url
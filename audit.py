@@ -0,0 +1,136 @@
+"""Write-behind activity log for projects, tasks and customers.
+
+Session events collect field-level diffs during flush and hand them to ActivityLogWriter after the commit
+succeeds. The writer appends them to activity_log in batches from a background thread, so request commits
+never wait on audit inserts. The queue is bounded; if it fills up, new entries are dropped and counted.
+"""
+import json
+import logging
+import queue
+import threading
+from datetime import datetime
+from sqlalchemy import event, inspect, insert
+import database
+from models import ActivityLog, Project, Task, Customer
+
+logger = logging.getLogger(__name__)
+
+AUDITED_MODELS = {Project: "project", Task: "task", Customer: "customer"}
+IGNORED_FIELDS = {"id", "created_at", "updated_at"}
+
+
+def _diff(obj) -> dict:
+    state = inspect(obj)
+    changes = {}
+    for attr in state.mapper.column_attrs:
+        if attr.key in IGNORED_FIELDS: continue
+        history = state.attrs[attr.key].history
+        if not history.has_changes(): continue
+        old = history.deleted[0] if history.deleted else None
+        new = history.added[0] if history.added else None
+        if old != new:
+            changes[attr.key] = [old, new]
+    return changes
+
+
+def _collect(session, flush_context):
+    pending = session.info.setdefault("pending_activity", [])
+    for obj in session.new:
+        if type(obj) in AUDITED_MODELS:
+            pending.append((AUDITED_MODELS[type(obj)], obj.id, "create", _diff(obj)))
+    for obj in session.dirty:
+        if type(obj) in AUDITED_MODELS and session.is_modified(obj, include_collections=False):
+            changes = _diff(obj)
+            if changes:
+                pending.append((AUDITED_MODELS[type(obj)], obj.id, "update", changes))
+    for obj in session.deleted:
+        if type(obj) in AUDITED_MODELS:
+            pending.append((AUDITED_MODELS[type(obj)], obj.id, "delete", {}))
+
+
+def _publish(session):
+    pending = session.info.pop("pending_activity", None)
+    if pending and activity_writer.running:
+        now = datetime.utcnow()
+        actor_id = session.info.get("actor_id")
+        for entity_type, entity_id, action, changes in pending:
+            activity_writer.submit({
+                "entity_type": entity_type, "entity_id": entity_id, "action": action,
+                "changes": json.dumps(changes, ensure_ascii=False, default=str) if changes else None,
+                "user_id": actor_id, "created_at": now,
+            })
+
+
+def _discard(session, previous_transaction=None):
+    session.info.pop("pending_activity", None)
+
+
+class ActivityLogWriter:
+    def __init__(self, max_queue_size: int = 10000, batch_size: int = 200, flush_interval: float = 1.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._stopping = threading.Event()
+        self.dropped = 0
+        self.written = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def submit(self, entry: dict):
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning("Activity log queue full; %d entries dropped so far", self.dropped)
+
+    def _drain(self, block: bool) -> list:
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, batch: list):
+        if not batch: return
+        try:
+            with database.engine.begin() as conn:
+                conn.execute(insert(ActivityLog.__table__), batch)
+            self.written += len(batch)
+        except Exception:
+            logger.exception("Failed to write %d activity log entries", len(batch))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._write(self._drain(block=True))
+
+    def start(self):
+        if self._thread: return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="activity-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread and flushes everything still queued."""
+        if not self._thread: return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        while True:
+            batch = self._drain(block=False)
+            if not batch: break
+            self._write(batch)
+
+
+activity_writer = ActivityLogWriter()
+
+event.listen(database.SessionLocal, "after_flush", _collect)
+event.listen(database.SessionLocal, "after_commit", _publish)
+event.listen(database.SessionLocal, "after_rollback", _discard)
@@ -29,4 +29,5 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
     if not user_id:
         return None
     user = db.query(User).filter(User.id == int(user_id)).first()
+    if user: db.info["actor_id"] = user.id  # attributed to changes in the activity log
     return user
\ No newline at end of file
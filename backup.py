@@ -0,0 +1,208 @@
+"""Online backups of the SQLite database while the app keeps serving.
+
+The default method copies the database with SQLite's online backup API, BACKUP_STEP_PAGES pages at a time.
+The progress callback sleeps BACKUP_STEP_SLEEP after each step (the API's own sleep only applies while the
+database is busy), so the shared lock is only held for one step and writers get in between.
+A write from another connection restarts the copy; after BACKUP_MAX_RESTARTS restarts the rest is copied
+in one step, which writers wait out. On a busy database in WAL mode method="vacuum" is the better fit:
+VACUUM INTO reads one consistent snapshot without blocking writers and also compacts the copy.
+
+Each snapshot is written next to its final name, checked with PRAGMA integrity_check plus a check that every
+application table is present, then optionally gzipped and moved into place. PRAGMA foreign_key_check rows are
+reported as warnings only: the app leaves some orphans in normal use (foreign keys are not enforced), and a
+snapshot with them restores as well as the live database runs. Old
+snapshots beyond `keep` are deleted. verify_backup() runs the same checks on an existing snapshot, so a
+restore can be rehearsed without touching the live database.
+
+    python backup.py [--dest backups] [--keep 7] [--method backup|vacuum] [--no-compress]
+    python backup.py --verify backups/taskflow-20250101-020000.db.gz
+"""
+import argparse
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from sqlalchemy.engine import make_url
+from config import get_settings
+from models import Base
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BACKUP_STEP_PAGES = 256
+BACKUP_STEP_SLEEP = 0.01
+BACKUP_MAX_RESTARTS = 3
+BACKUP_METHODS = ("backup", "vacuum")
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+def sqlite_path(database_url: str) -> str:
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        raise ValueError("Online backups are only supported for file-based SQLite databases")
+    return url.database
+
+
+class _CopyRestarted(Exception):
+    pass
+
+
+def _copy_with_backup_api(source_path: str, target_path: str) -> int:
+    state = {"steps": 0, "remaining": None, "restarts": 0}
+    def progress(status, remaining, total):
+        state["steps"] += 1
+        if state["remaining"] is not None and remaining >= state["remaining"]:  # a write restarted the copy
+            state["restarts"] += 1
+            if state["restarts"] > BACKUP_MAX_RESTARTS: raise _CopyRestarted()
+        state["remaining"] = remaining
+        if remaining: time.sleep(BACKUP_STEP_SLEEP)
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            source.backup(target, pages=BACKUP_STEP_PAGES, progress=progress, sleep=BACKUP_STEP_SLEEP)
+        except _CopyRestarted:
+            # Writes keep invalidating the stepwise copy; finish in a single step, which writers wait out.
+            logger.warning("Backup of %s restarted %d times; copying the rest in one step", source_path, state["restarts"])
+            source.backup(target)
+            state["steps"] += 1
+    finally:
+        target.close()
+        source.close()
+    return state["steps"]
+
+
+def _copy_with_vacuum(source_path: str, target_path: str) -> int:
+    source = sqlite3.connect(source_path)
+    try:
+        source.execute("VACUUM INTO ?", (target_path,))
+    finally:
+        source.close()
+    return 1
+
+
+def check_database(path: str) -> dict:
+    """Integrity checks on an uncompressed database file; never raises for a corrupt file, reports it.
+    Only errors fail the check; foreign key violations come back as warnings."""
+    errors, warnings, tables = [], [], {}
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        integrity = [row[0] for row in connection.execute("PRAGMA integrity_check")]
+        if integrity != ["ok"]:
+            errors.extend(integrity)
+        warnings.extend(f"foreign key: {row[0]} row {row[1]} -> {row[2]}" for row in connection.execute("PRAGMA foreign_key_check"))
+        present = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for name in sorted(Base.metadata.tables):
+            if name not in present:
+                errors.append(f"missing table: {name}")
+            else:
+                tables[name] = connection.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+    except sqlite3.DatabaseError as exc:
+        errors.append(f"{type(exc).__name__}: {exc}")
+    finally:
+        connection.close()
+    return {"ok": not errors, "errors": errors[:20], "warnings": warnings[:20], "warning_count": len(warnings), "tables": tables}
+
+
+def verify_backup(path: str) -> dict:
+    """Restores a snapshot (gzipped or not) to a scratch file and checks it."""
+    if not path.endswith(".gz"):
+        return check_database(path)
+    with tempfile.TemporaryDirectory() as scratch:
+        restored = os.path.join(scratch, "restore.db")
+        with gzip.open(path, "rb") as source, open(restored, "wb") as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK_BYTES)
+        return check_database(restored)
+
+
+def _compress(path: str) -> str:
+    with open(path, "rb") as source, gzip.open(path + ".gz", "wb", compresslevel=6) as target:
+        shutil.copyfileobj(source, target, COPY_CHUNK_BYTES)
+    os.remove(path)
+    return path + ".gz"
+
+
+def rotate_backups(dest_dir: str, prefix: str, keep: int) -> list:
+    snapshots = sorted(name for name in os.listdir(dest_dir) if name.startswith(prefix + "-") and name.endswith((".db", ".db.gz")))
+    removed = snapshots[:-keep] if keep > 0 else []
+    for name in removed:
+        os.remove(os.path.join(dest_dir, name))
+    return removed
+
+
+def backup_database(database_url: str, dest_dir: str, keep: int = 7, compress: bool = True, method: str = "backup") -> dict:
+    """Writes a verified snapshot to dest_dir and returns its path, size, duration and throughput."""
+    if method not in BACKUP_METHODS:
+        raise ValueError(f"method must be one of {BACKUP_METHODS}")
+    source_path = sqlite_path(database_url)
+    os.makedirs(dest_dir, exist_ok=True)
+    prefix = os.path.splitext(os.path.basename(source_path))[0]
+    final_path = os.path.join(dest_dir, f"{prefix}-{datetime.now():%Y%m%d-%H%M%S}.db")
+    partial_path = final_path + ".partial"
+    if os.path.exists(partial_path): os.remove(partial_path)
+
+    started = time.perf_counter()
+    try:
+        steps = (_copy_with_vacuum if method == "vacuum" else _copy_with_backup_api)(source_path, partial_path)
+        copied = time.perf_counter()
+        size = os.path.getsize(partial_path)
+        check = check_database(partial_path)
+        if not check["ok"]:
+            raise RuntimeError(f"Backup failed verification: {'; '.join(check['errors'])}")
+        if check["warning_count"]:
+            logger.warning("Backup of %s has %d foreign key violations, e.g. %s", source_path, check["warning_count"], check["warnings"][0])
+        os.replace(partial_path, final_path)
+        path = _compress(final_path) if compress else final_path
+    except Exception:
+        metrics.inc("db_backups", status="failed")
+        if os.path.exists(partial_path): os.remove(partial_path)
+        raise
+    seconds = time.perf_counter() - started
+    copy_seconds = copied - started
+    result = {
+        "path": path, "method": method, "steps": steps, "database_bytes": size, "stored_bytes": os.path.getsize(path),
+        "copy_seconds": round(copy_seconds, 3), "seconds": round(seconds, 3),
+        "mb_per_second": round(size / 1048576 / copy_seconds, 2) if copy_seconds > 0 else None,
+        "tables": check["tables"], "warnings": check["warnings"], "warning_count": check["warning_count"],
+        "removed": rotate_backups(dest_dir, prefix, keep),
+    }
+    metrics.inc("db_backups", status="succeeded")
+    metrics.set_gauge("db_backup_last_seconds", result["seconds"])
+    metrics.set_gauge("db_backup_last_bytes", result["stored_bytes"])
+    logger.info("Backed up %s to %s: %d bytes in %.2fs (%s MB/s)", source_path, path, size, seconds, result["mb_per_second"])
+    return result
+
+
+def main():
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Online SQLite backup with rotation and verification.")
+    parser.add_argument("--dest", default=settings.backup_dir or "backups")
+    parser.add_argument("--keep", type=int, default=settings.backup_keep)
+    parser.add_argument("--method", choices=BACKUP_METHODS, default=settings.backup_method)
+    parser.add_argument("--no-compress", dest="compress", action="store_false", default=settings.backup_compress)
+    parser.add_argument("--verify", metavar="SNAPSHOT", help="only check an existing snapshot")
+    args = parser.parse_args()
+
+    if args.verify:
+        result = verify_backup(args.verify)
+        print("ok" if result["ok"] else "FAILED")
+        for error in result["errors"]: print(f"  {error}")
+        for warning in result["warnings"]: print(f"  warning: {warning}")
+        if result["warning_count"] > len(result["warnings"]): print(f"  ... {result['warning_count'] - len(result['warnings'])} more warnings")
+        for name, count in result["tables"].items(): print(f"  {name:<28} {count:>10} rows")
+        raise SystemExit(0 if result["ok"] else 1)
+
+    result = backup_database(settings.database_url, args.dest, keep=args.keep, compress=args.compress, method=args.method)
+    print(f"{result['path']}")
+    print(f"  {result['database_bytes']} bytes copied in {result['copy_seconds']}s ({result['mb_per_second']} MB/s, {result['steps']} steps); "
+          f"{result['stored_bytes']} bytes stored; {result['seconds']}s total")
+    if result["warning_count"]: print(f"  {result['warning_count']} foreign key warnings; run --verify on the snapshot to list them")
+    for name in result["removed"]: print(f"  removed {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Drives the main pages from several threads and checks that every pooled connection was returned.
+
+Exits non-zero and prints the acquiring stacks if any connection is still checked out once the load stops.
+Needs the test client dependency (httpx). Run from the project root:
+
+    python benchmarks/connection_leak_benchmark.py [--threads 8] [--requests 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = ["/", "/dashboard", "/projects", "/customers", "/api/autocomplete/projects?q=p", "/api/v1/changes"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="requests per thread")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update(
+        TASKFLOW_DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}", TASKFLOW_DEBUG_CONNECTIONS="1",
+        TASKFLOW_SCHEDULER_ENABLED="0", TASKFLOW_ADMISSION_ENABLED="0",
+    )
+    sys.path.insert(0, ROOT)
+    from fastapi.testclient import TestClient
+    import main as app_module
+    from auth import register_user
+    from connection_monitor import connection_monitor
+    from database import session_scope
+    from metrics import metrics
+
+    with TestClient(app_module.app) as client:
+        with session_scope() as db:
+            register_user(db, "bench", "bench", "boss", "")
+        client.post("/login", data={"username": "bench", "password": "bench"})
+
+        def worker(index):
+            for i in range(args.requests):
+                client.get(PATHS[(index + i) % len(PATHS)], follow_redirects=False)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(worker, range(args.threads)))
+        elapsed = time.perf_counter() - started
+        leaks = connection_monitor.leaks(older_than=0)
+
+    snapshot = metrics.snapshot()
+    total = args.threads * args.requests
+    checkouts = snapshot.get("db_pool_checkouts", 0)
+    wait = snapshot.get("db_pool_wait_seconds_total", 0.0)
+    print(f"{total} requests in {elapsed:.2f}s ({total / elapsed:.0f} req/s)")
+    print(f"pool checkouts {checkouts:.0f}, mean wait {wait / max(checkouts, 1) * 1000:.3f} ms")
+    print(f"connections still checked out: {len(leaks)}")
+    for leak in leaks:
+        print(leak["stack"])
+    sys.exit(1 if leaks else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Measures worker boot time: importing main, building the app and running the lifespan startup/shutdown.
+
+Run from the project root:  python benchmarks/startup_benchmark.py [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import asyncio, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+app = main.create_app()
+t2 = time.perf_counter()
+async def boot():
+    async with main.lifespan(app):
+        t3 = time.perf_counter()
+    return t3
+t3 = asyncio.run(boot())
+print(f"{t1 - t0:.6f} {t2 - t1:.6f} {t3 - t2:.6f}")
+"""
+
+
+def run_once(database_url: str):
+    env = dict(os.environ, TASKFLOW_DATABASE_URL=database_url, TASKFLOW_SCHEDULER_ENABLED="0")
+    output = subprocess.check_output([sys.executable, "-c", CHILD], cwd=ROOT, env=env, text=True)
+    return [float(value) for value in output.split()[-3:]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        run_once(database_url)  # first run creates the schema; exclude it from the numbers
+        samples = [run_once(database_url) for _ in range(args.runs)]
+
+    for index, label in enumerate(["import main", "create_app()", "lifespan startup"]):
+        values = [sample[index] * 1000 for sample in samples]
+        print(f"{label:<18} median {statistics.median(values):8.2f} ms   max {max(values):8.2f} ms")
+    totals = [sum(sample) * 1000 for sample in samples]
+    print(f"{'total':<18} median {statistics.median(totals):8.2f} ms   max {max(totals):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
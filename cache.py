@@ -0,0 +1,56 @@
+"""Server-side cache for rendered list pages (/projects, /customers).
+
+Entries are keyed by route, normalized filters and role, and tagged with the cache_versions of the tables the
+page reads. The models.py helpers bump those versions in the same transaction as the write, so a stale entry
+is simply never matched again. Entries are evicted least-recently-used once their total size exceeds max_bytes.
+"""
+import threading
+from collections import OrderedDict
+from metrics import metrics
+
+
+def normalize_filters(filters: dict) -> tuple:
+    return tuple(sorted((key, value.strip()) for key, value in filters.items() if value and value.strip()))
+
+
+class PageCache:
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()  # key -> (versions, html, size)
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, versions: tuple):
+        route = key[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == versions:
+                self._entries.move_to_end(key)
+                metrics.inc("page_cache_hits", route=route)
+                return entry[1]
+        metrics.inc("page_cache_misses", route=route)
+        return None
+
+    def set(self, key: tuple, versions: tuple, html: str):
+        size = len(html.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old: self.size_bytes -= old[2]
+            self._entries[key] = (versions, html, size)
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted_size
+                metrics.inc("page_cache_evictions")
+            metrics.set_gauge("page_cache_bytes", self.size_bytes)
+            metrics.set_gauge("page_cache_entries", len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+
+page_cache = PageCache()
@@ -0,0 +1,135 @@
+"""Delivery, payment and deadline calendar, as a page, a JSON API and an iCalendar feed.
+
+Every event source is a date column with its own index, so a window is one range scan per source
+(`column >= start AND column < end`), never a scan of the whole table. Project filters (status, expert)
+are applied on top of the scan; task events are limited to the tasks the user may see and, when project
+filters are set, to tasks of matching projects.
+
+The feed is built for calendar clients that poll. Its ETag is derived from the projects cache version
+(bumped by every project write), the tasks table's row count and latest updated_at, and the day, so a poll
+with a matching If-None-Match is answered 304 without loading a single event.
+
+(The module is not called calendar.py so it doesn't shadow the standard library module.)
+"""
+import hashlib
+import secrets
+from datetime import date, datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import Project, Task, User, get_cache_versions, task_visibility
+
+CALENDAR_VIEWS = ("week", "month")
+WEEK_START = 5  # Saturday
+FEED_PAST_DAYS = 30
+FEED_FUTURE_DAYS = 180
+
+# kind -> (model, date column, label); one indexed range scan each
+EVENT_SOURCES = {
+    "delivery": (Project, Project.delivery_date, "تحویل"),
+    "shipment": (Project, Project.shipment_date, "ارسال"),
+    "invoice": (Project, Project.invoice_date, "فاکتور"),
+    "payment": (Project, Project.payment_date, "واریز"),
+    "task_deadline": (Task, Task.end_date, "موعد وظیفه"),
+    "follow_up": (Task, Task.follow_up_date, "پیگیری"),
+}
+
+
+def calendar_window(anchor: date, view: str) -> tuple:
+    """[start, end) of the week (starting Saturday) or the calendar month containing anchor."""
+    if view == "month":
+        start = anchor.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+    else:
+        start = anchor - timedelta(days=(anchor.weekday() - WEEK_START) % 7)
+        end = start + timedelta(days=7)
+    return start, end
+
+
+def get_calendar_events(db: Session, user, start: date, end: date, status: str = None, expert: str = None) -> list:
+    events = []
+    for kind, (model, column, label) in EVENT_SOURCES.items():
+        if model is Project:
+            query = db.query(Project.id, Project.internal_number, Project.description, Project.status, Project.payment_amount, Project.updated_at, column.label("day"))
+        else:
+            query = db.query(Task.id, Task.title, Task.status, Task.project_id, Task.updated_at, column.label("day")).filter(task_visibility(user), Task.status != 'Completed')
+            if status or expert: query = query.join(Project, Task.project_id == Project.id)
+        query = query.filter(column >= start, column < end)
+        if status: query = query.filter(Project.status == status)
+        if expert: query = query.filter(Project.expert.contains(expert))
+        for row in query:
+            if model is Project:
+                event = {"title": f"{label}: {row.internal_number} - {row.description or ''}", "url": f"/project/{row.id}", "status": row.status,
+                         "amount": row.payment_amount if kind == "payment" else None}
+            else:
+                event = {"title": f"{label}: {row.title}", "url": f"/task/{row.id}", "status": row.status, "amount": None}
+            event.update({"uid": f"{kind}-{row.id}", "kind": kind, "date": row.day, "updated_at": row.updated_at})
+            events.append(event)
+    events.sort(key=lambda event: (event["date"], event["kind"], event["uid"]))
+    return events
+
+
+def group_by_day(events: list, start: date, end: date) -> list:
+    days = {start + timedelta(days=offset): [] for offset in range((end - start).days)}
+    for event in events:
+        days[event["date"]].append(event)
+    return list(days.items())
+
+
+def calendar_token(db: Session, user, reset: bool = False) -> str:
+    """The user's feed token, created on first use; reset=True revokes the old feed URL."""
+    if reset or not user.calendar_token:
+        user.calendar_token = secrets.token_urlsafe(24)
+        db.commit()
+    return user.calendar_token
+
+
+def get_user_by_calendar_token(db: Session, token: str):
+    return db.query(User).filter(User.calendar_token == token).first() if token else None
+
+
+def feed_window(today: date = None) -> tuple:
+    today = today or date.today()
+    return today - timedelta(days=FEED_PAST_DAYS), today + timedelta(days=FEED_FUTURE_DAYS)
+
+
+def feed_etag(db: Session, user, status: str = None, expert: str = None) -> str:
+    """A validator that changes whenever the feed could: any project write, any task insert/update/delete, a new day."""
+    task_count, task_updated = db.query(func.count(Task.id), func.max(Task.updated_at)).one()
+    parts = (user.id, user.role, status or "", expert or "", date.today(), get_cache_versions(db, "projects"), task_count, task_updated)
+    return '"' + hashlib.sha1(repr(parts).encode("utf-8")).hexdigest() + '"'
+
+
+def _escape(text: str) -> str:
+    return str(text).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+
+def _fold(line: str) -> str:
+    """RFC 5545 line folding: at most 75 octets per line, continuation lines start with a space."""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75: return line
+    parts, current = [], b""
+    for char in line:
+        piece = char.encode("utf-8")
+        if len(current) + len(piece) > (75 if not parts else 74):
+            parts.append(current.decode("utf-8"))
+            current = b""
+        current += piece
+    parts.append(current.decode("utf-8"))
+    return "\r\n ".join(parts)
+
+
+def render_ical(events: list, base_url: str, calendar_name: str = "TaskFlow") -> str:
+    now = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//TaskFlow//Calendar//FA", "CALSCALE:GREGORIAN", "METHOD:PUBLISH",
+             f"X-WR-CALNAME:{_escape(calendar_name)}"]
+    for event in events:
+        stamp = event["updated_at"].strftime("%Y%m%dT%H%M%SZ") if event["updated_at"] else now
+        description = f"{event['status'] or ''}" + (f" - {event['amount']:,.0f}" if event["amount"] else "")
+        lines += [
+            "BEGIN:VEVENT", f"UID:{event['uid']}@taskflow", f"DTSTAMP:{stamp}",
+            f"DTSTART;VALUE=DATE:{event['date']:%Y%m%d}", f"DTEND;VALUE=DATE:{event['date'] + timedelta(days=1):%Y%m%d}",
+            f"SUMMARY:{_escape(event['title'])}", f"DESCRIPTION:{_escape(description)}", f"URL:{base_url.rstrip('/')}{event['url']}",
+            "TRANSP:TRANSPARENT", "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
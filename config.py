@@ -0,0 +1,87 @@
+import os
+from functools import lru_cache
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_limits(name: str, default: dict) -> dict:
+    """Parses "dashboard=4:16,projects=8:32" into {"dashboard": (4, 16), ...}, merged over the defaults."""
+    limits = dict(default)
+    for item in filter(None, (part.strip() for part in (os.getenv(name) or "").split(","))):
+        route, _, spec = item.partition("=")
+        concurrency, _, queue = spec.partition(":")
+        limits[route.strip()] = (int(concurrency), int(queue or 0))
+    return limits
+
+
+DEFAULT_ADMISSION_LIMITS = {"dashboard": (4, 16), "projects": (8, 32), "customers": (4, 16), "exports": (2, 4)}
+
+
+class Settings:
+    """Application settings, read from TASKFLOW_* environment variables. Keyword overrides win over the environment."""
+
+    def __init__(self, **overrides):
+        self.database_url = os.getenv("TASKFLOW_DATABASE_URL", "sqlite:///./taskflow.db")
+        self.replica_database_url = os.getenv("TASKFLOW_REPLICA_DATABASE_URL") or None
+        self.pool_size = _env_int("TASKFLOW_POOL_SIZE", 5)
+        self.max_overflow = _env_int("TASKFLOW_MAX_OVERFLOW", 10)
+        self.pool_pre_ping = _env_bool("TASKFLOW_POOL_PRE_PING", True)
+        self.pool_recycle = _env_int("TASKFLOW_POOL_RECYCLE", 1800)
+        self.pool_timeout = _env_int("TASKFLOW_POOL_TIMEOUT", 30)
+        self.create_schema = _env_bool("TASKFLOW_CREATE_SCHEMA", True)
+        self.static_dir = os.getenv("TASKFLOW_STATIC_DIR", "static")
+        self.compression_minimum_size = _env_int("TASKFLOW_COMPRESSION_MINIMUM_SIZE", 1024)
+        self.warm_caches = _env_bool("TASKFLOW_WARM_CACHES", True)
+        self.archive_task_age_days = _env_int("TASKFLOW_ARCHIVE_TASK_AGE_DAYS", 365)
+        self.archive_notification_age_days = _env_int("TASKFLOW_ARCHIVE_NOTIFICATION_AGE_DAYS", 30)
+        self.archive_batch_size = _env_int("TASKFLOW_ARCHIVE_BATCH_SIZE", 500)
+        self.scheduler_enabled = _env_bool("TASKFLOW_SCHEDULER_ENABLED", True)
+        self.page_cache_max_bytes = _env_int("TASKFLOW_PAGE_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+        self.admission_enabled = _env_bool("TASKFLOW_ADMISSION_ENABLED", True)
+        self.admission_limits = _env_limits("TASKFLOW_ADMISSION_LIMITS", DEFAULT_ADMISSION_LIMITS)
+        self.admission_per_user = _env_int("TASKFLOW_ADMISSION_PER_USER", 2)
+        self.admission_queue_timeout = _env_int("TASKFLOW_ADMISSION_QUEUE_TIMEOUT", 10)
+        self.admission_retry_after = _env_int("TASKFLOW_ADMISSION_RETRY_AFTER", 5)
+        self.debug_connections = _env_bool("TASKFLOW_DEBUG_CONNECTIONS", False)
+        self.connection_leak_seconds = _env_int("TASKFLOW_CONNECTION_LEAK_SECONDS", 30)
+        self.jobs_enabled = _env_bool("TASKFLOW_JOBS_ENABLED", True)
+        self.job_workers = _env_int("TASKFLOW_JOB_WORKERS", 2)
+        self.job_poll_interval = _env_int("TASKFLOW_JOB_POLL_INTERVAL", 1)
+        self.job_retention_days = _env_int("TASKFLOW_JOB_RETENTION_DAYS", 30)
+        self.profiling_enabled = _env_bool("TASKFLOW_PROFILING_ENABLED", True)
+        self.backup_dir = os.getenv("TASKFLOW_BACKUP_DIR") or None
+        self.backup_keep = _env_int("TASKFLOW_BACKUP_KEEP", 7)
+        self.backup_method = os.getenv("TASKFLOW_BACKUP_METHOD", "backup")
+        self.backup_compress = _env_bool("TASKFLOW_BACKUP_COMPRESS", True)
+        self.report_dir = os.getenv("TASKFLOW_REPORT_DIR", "reports")
+        self.report_workers = _env_int("TASKFLOW_REPORT_WORKERS", min(4, os.cpu_count() or 1))
+        self.report_pdf_font = os.getenv("TASKFLOW_REPORT_PDF_FONT") or None
+        self.base_url = os.getenv("TASKFLOW_BASE_URL", "http://localhost:8000")
+        self.smtp_host = os.getenv("TASKFLOW_SMTP_HOST") or None
+        self.smtp_port = _env_int("TASKFLOW_SMTP_PORT", 25)
+        self.smtp_username = os.getenv("TASKFLOW_SMTP_USERNAME") or None
+        self.smtp_password = os.getenv("TASKFLOW_SMTP_PASSWORD") or None
+        self.smtp_starttls = _env_bool("TASKFLOW_SMTP_STARTTLS", False)
+        self.digest_from = os.getenv("TASKFLOW_DIGEST_FROM", "taskflow@localhost")
+        self.digest_hour = _env_int("TASKFLOW_DIGEST_HOUR", 7)
+        self.digest_batch_size = _env_int("TASKFLOW_DIGEST_BATCH_SIZE", 50)
+        self.digest_rate = _env_int("TASKFLOW_DIGEST_RATE", 10)
+        for key, value in overrides.items():
+            if not hasattr(self, key):
+                raise AttributeError(f"Unknown setting: {key}")
+            setattr(self, key, value)
+
+
+@lru_cache()
+def get_settings() -> Settings:
+    return Settings()
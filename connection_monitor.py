@@ -0,0 +1,87 @@
+"""Pool instrumentation: checked-out connections, pool wait time and leak reports.
+
+Counting is always on and costs two dict operations per checkout. With track_stacks (TASKFLOW_DEBUG_CONNECTIONS)
+every checkout also records the acquiring stack, so report_leaks() can say where a connection that was never
+returned came from.
+"""
+import logging
+import threading
+import time
+import traceback
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _caller_stack(limit: int = 15) -> str:
+    """The acquiring stack without SQLAlchemy's own frames, so the report points at application code."""
+    frames = [frame for frame in traceback.extract_stack()[:-3] if "sqlalchemy" not in frame.filename]
+    return "".join(traceback.format_list(frames[-limit:]))
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a free connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            metrics.inc("db_pool_checkout_failures")
+            raise
+        finally:
+            metrics.inc("db_pool_wait_seconds_total", time.perf_counter() - started)
+            metrics.inc("db_pool_checkouts")
+
+
+class ConnectionMonitor:
+    def __init__(self, track_stacks: bool = False, leak_seconds: float = 30):
+        self.track_stacks = track_stacks
+        self.leak_seconds = leak_seconds
+        self._checked_out = {}  # id(pool entry) -> (engine name, checkout time, stack or None)
+        self._lock = threading.Lock()
+
+    def attach(self, engine, name: str = "primary"):
+        event.listen(engine.pool, "checkout", lambda dbapi_conn, record, proxy: self._checkout(name, record))
+        event.listen(engine.pool, "checkin", lambda dbapi_conn, record: self._checkin(name, record))
+
+    def _checkout(self, name: str, record):
+        stack = _caller_stack() if self.track_stacks else None
+        with self._lock:
+            self._checked_out[id(record)] = (name, time.monotonic(), stack)
+            metrics.set_gauge("db_connections_checked_out", sum(1 for entry in self._checked_out.values() if entry[0] == name), engine=name)
+
+    def _checkin(self, name: str, record):
+        with self._lock:
+            self._checked_out.pop(id(record), None)
+            metrics.set_gauge("db_connections_checked_out", sum(1 for entry in self._checked_out.values() if entry[0] == name), engine=name)
+
+    def checked_out(self) -> int:
+        with self._lock:
+            return len(self._checked_out)
+
+    def leaks(self, older_than: float = None) -> list:
+        """Connections held longer than older_than seconds (leak_seconds by default), oldest first."""
+        threshold = self.leak_seconds if older_than is None else older_than
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._checked_out.values())
+        leaks = [{"engine": name, "held_seconds": round(now - since, 3), "stack": stack} for name, since, stack in entries if now - since >= threshold]
+        return sorted(leaks, key=lambda leak: -leak["held_seconds"])
+
+    def report_leaks(self) -> int:
+        leaks = self.leaks()
+        metrics.set_gauge("db_connection_leaks", len(leaks))
+        for leak in leaks:
+            logger.warning("Connection on %s held for %.1fs%s", leak["engine"], leak["held_seconds"],
+                           ", acquired at:\n" + leak["stack"] if leak["stack"] else "")
+        return len(leaks)
+
+    def reset(self):
+        with self._lock:
+            self._checked_out.clear()
+
+
+connection_monitor = ConnectionMonitor()
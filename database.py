@@ -1,15 +1,106 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from functools import wraps
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from connection_monitor import TimedQueuePool, connection_monitor
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./taskflow.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# Engines are created by init_engine() from the app lifespan, so importing this module never touches the database.
+engine = None
+replica_engine = None
+
+
+class RoutingSession(Session):
+    """Sends reads made inside @read_only helpers to the replica engine; everything else, and all flushes, go to the primary.
+    Inside primary_reads() the replica is not used at all."""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if replica_engine is not None and self.info.get("read_only") and not self.info.get("primary_only") and not self._flushing:
+            return replica_engine
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+SessionLocal = sessionmaker(class_=RoutingSession, autoflush=False, autocommit=False)
 Base = declarative_base()
 
-def get_db():
+def read_only(func):
+    """Marks a helper taking the session as its first argument as safe to serve from the read replica."""
+    @wraps(func)
+    def wrapper(db, *args, **kwargs):
+        previous = db.info.get("read_only", False)
+        db.info["read_only"] = True
+        try:
+            return func(db, *args, **kwargs)
+        finally:
+            db.info["read_only"] = previous
+    return wrapper
+
+@contextmanager
+def primary_reads(db):
+    """Reads every query in the block from the primary, including those made by @read_only helpers; for results
+    that must be at least as new as something just read from the primary."""
+    previous = db.info.get("primary_only", False)
+    db.info["primary_only"] = True
+    try:
+        yield db
+    finally:
+        db.info["primary_only"] = previous
+
+def _create_engine(database_url: str, pool_size: int, max_overflow: int, pool_pre_ping: bool, pool_recycle: int, pool_timeout: int):
+    url = make_url(database_url)
+    options = {"pool_pre_ping": pool_pre_ping}
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+        if url.database in (None, "", ":memory:"):
+            return create_engine(url, **options)  # in-memory SQLite uses a single shared connection, no pool sizing
+    options.update(poolclass=TimedQueuePool, pool_size=pool_size, max_overflow=max_overflow, pool_recycle=pool_recycle, pool_timeout=pool_timeout)
+    return create_engine(url, **options)
+
+def init_engine(database_url: str, replica_url: str = None, pool_size: int = 5, max_overflow: int = 10,
+                pool_pre_ping: bool = True, pool_recycle: int = 1800, pool_timeout: int = 30,
+                track_connections: bool = False, connection_leak_seconds: float = 30):
+    global engine, replica_engine
+    pool_options = dict(pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=pool_pre_ping, pool_recycle=pool_recycle, pool_timeout=pool_timeout)
+    engine = _create_engine(database_url, **pool_options)
+    replica_engine = _create_engine(replica_url, **pool_options) if replica_url else None
+    connection_monitor.track_stacks = track_connections
+    connection_monitor.leak_seconds = connection_leak_seconds
+    connection_monitor.reset()
+    connection_monitor.attach(engine, "primary")
+    if replica_engine is not None: connection_monitor.attach(replica_engine, "replica")
+    SessionLocal.configure(bind=engine)
+    return engine
+
+def dispose_engine():
+    global engine, replica_engine
+    for current in (engine, replica_engine):
+        if current is not None:
+            current.dispose()
+    engine = replica_engine = None
+
+def ensure_schema(create: bool = True):
+    """Creates missing tables, or raises if schema creation is disabled and tables are missing."""
+    existing = set(inspect(engine).get_table_names())
+    missing = [name for name in Base.metadata.tables if name not in existing]
+    if missing and not create:
+        raise RuntimeError(f"Database schema is missing tables: {', '.join(missing)}")
+    if missing:
+        Base.metadata.create_all(bind=engine)
+    return missing
+
+@contextmanager
+def session_scope():
+    """A session that is always closed, returning its connection to the pool; an exception rolls it back first."""
     db = SessionLocal()
     try:
         yield db
+    except BaseException:
+        db.rollback()
+        raise
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_db():
+    with session_scope() as db:
+        yield db
@@ -0,0 +1,231 @@
+"""Daily email digest: each user's overdue tasks, follow-ups due and unread notifications.
+
+build_digests() gathers the digests of all recipients at once: one query for the recipients and one set-based
+query each for overdue tasks (by assignee), due follow-ups (by assigner) and unread notifications, never a
+query per user. Each digest is rendered with the email/digest.* templates. DigestSender delivers them over one
+SMTP connection kept open for the whole run, batch_size digests at a time, waiting between messages so at most
+`rate` messages per second go out; a dropped connection is reopened and the message retried once.
+
+A user gets at most one digest a day. users.digest_sent_on is claimed with a conditional UPDATE before a
+batch is sent, so several app processes running the scheduler don't send twice, and released again for
+messages that fail.
+
+Try it against a local debugging server:
+
+    python -m aiosmtpd -n -l localhost:1025          # pip install aiosmtpd; prints every message it receives
+    TASKFLOW_SMTP_HOST=localhost TASKFLOW_SMTP_PORT=1025 python digest.py
+    python digest.py --dry-run                       # render and print, send nothing
+"""
+import argparse
+import logging
+import smtplib
+import time
+from collections import defaultdict
+from datetime import date
+from email.message import EmailMessage
+from email.utils import formataddr, make_msgid, parseaddr
+from jinja2 import Environment, FileSystemLoader, TemplateError, select_autoescape
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+from config import get_settings
+from database import session_scope
+from models import Notification, Task, User
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SECTION_LIMIT = 50  # items per section; the digest links to the dashboard for the rest
+SMTP_TIMEOUT = 30
+
+_env = Environment(loader=FileSystemLoader("templates"), autoescape=select_autoescape(["html"]))
+
+
+def is_valid_email(address: str) -> bool:
+    """A bare addr-spec such as name@example.com: no display name, whitespace or line breaks to smuggle headers."""
+    return bool(address) and not any(char.isspace() for char in address) and parseaddr(address) == ("", address) \
+        and address.count("@") == 1 and all(address.split("@"))
+
+
+def _recipients(today: date):
+    return select(User.id).where(User.email.isnot(None), User.email != "", or_(User.digest_sent_on == None, User.digest_sent_on < today))  # noqa: E711
+
+
+def build_digests(db: Session, today: date = None) -> list:
+    """One dict per recipient that has anything to report, in user id order."""
+    today = today or date.today()
+    users = db.query(User.id, User.username, User.email, User.digest_sent_on).filter(User.id.in_(_recipients(today))).order_by(User.id).all()
+    if not users: return []
+    recipients = _recipients(today)
+    sections = defaultdict(lambda: {"overdue": [], "follow_ups": [], "notifications": []})
+    open_task = Task.status != 'Completed'
+
+    overdue = db.query(Task.assigned_to, Task.id, Task.title, Task.end_date, Task.success_percent).filter(
+        open_task, Task.end_date < today, Task.assigned_to.in_(recipients)).order_by(Task.end_date, Task.id)
+    for row in overdue:
+        sections[row.assigned_to]["overdue"].append({"id": row.id, "title": row.title, "date": row.end_date, "days": (today - row.end_date).days,
+                                                     "success_percent": row.success_percent or 0})
+    follow_ups = db.query(Task.assigned_by, Task.id, Task.title, Task.follow_up_date, Task.follow_up_message).filter(
+        open_task, Task.follow_up_date <= today, Task.assigned_by.in_(recipients)).order_by(Task.follow_up_date, Task.id)
+    for row in follow_ups:
+        sections[row.assigned_by]["follow_ups"].append({"id": row.id, "title": row.title, "date": row.follow_up_date, "message": row.follow_up_message})
+    notifications = db.query(Notification.user_id, Notification.task_id, Notification.message, Notification.created_at).filter(
+        Notification.is_read == 0, Notification.user_id.in_(recipients)).order_by(Notification.created_at.desc())
+    for row in notifications:
+        sections[row.user_id]["notifications"].append({"task_id": row.task_id, "message": row.message, "created_at": row.created_at})
+
+    digests = []
+    for user in users:
+        if user.id not in sections: continue
+        items = sections[user.id]
+        digests.append({
+            "user_id": user.id, "username": user.username, "email": user.email, "previous_sent_on": user.digest_sent_on, "date": today,
+            "counts": {name: len(rows) for name, rows in items.items()},
+            **{name: rows[:DIGEST_SECTION_LIMIT] for name, rows in items.items()},
+        })
+    return digests
+
+
+def render_digest(digest: dict, sender: str, base_url: str) -> EmailMessage:
+    context = dict(digest, base_url=base_url.rstrip("/"), limit=DIGEST_SECTION_LIMIT)
+    message = EmailMessage()
+    message["Subject"] = f"TaskFlow - خلاصه روز {digest['date']:%Y-%m-%d}: {sum(digest['counts'].values())} مورد"
+    message["From"] = sender
+    message["To"] = formataddr((digest["username"], digest["email"]))
+    message["Message-ID"] = make_msgid(domain=sender.rpartition("@")[2] or None)
+    message["Auto-Submitted"] = "auto-generated"
+    message.set_content(_env.get_template("email/digest.txt").render(context))
+    message.add_alternative(_env.get_template("email/digest.html").render(context), subtype="html")
+    return message
+
+
+class DigestSender:
+    """One reusable SMTP connection with a send rate limit (messages per second, 0 for none)."""
+
+    def __init__(self, host: str, port: int = 25, username: str = None, password: str = None, starttls: bool = False, rate: float = 0):
+        self.host, self.port = host, port
+        self.username, self.password = username, password
+        self.starttls = starttls
+        self.interval = 1.0 / rate if rate else 0.0
+        self.connections = 0
+        self._smtp = None
+        self._next_send = 0.0
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        if self.starttls: smtp.starttls()
+        if self.username: smtp.login(self.username, self.password or "")
+        self._smtp = smtp
+        self.connections += 1
+
+    def send(self, message: EmailMessage):
+        wait = self._next_send - time.monotonic()
+        if wait > 0: time.sleep(wait)
+        for attempt in (1, 2):
+            if self._smtp is None: self._connect()
+            try:
+                self._smtp.send_message(message)
+                break
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if attempt == 2: raise
+        self._next_send = time.monotonic() + self.interval
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            self._smtp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _claim(db: Session, digests: list) -> list:
+    """Marks each user's digest as sent today unless another process already has; returns the ones claimed here."""
+    claimed = []
+    for digest in digests:
+        updated = db.query(User).filter(User.id == digest["user_id"], or_(User.digest_sent_on == None, User.digest_sent_on < digest["date"])).update(  # noqa: E711
+            {User.digest_sent_on: digest["date"]}, synchronize_session=False)
+        if updated: claimed.append(digest)
+    db.commit()
+    return claimed
+
+
+def _release(db: Session, digests: list):
+    for digest in digests:
+        db.query(User).filter(User.id == digest["user_id"]).update({User.digest_sent_on: digest["previous_sent_on"]}, synchronize_session=False)
+    db.commit()
+
+
+def send_digests(db: Session, sender: DigestSender, from_address: str, base_url: str, batch_size: int = 50, today: date = None) -> dict:
+    digests = build_digests(db, today)
+    result = {"digests": len(digests), "sent": 0, "failed": 0, "skipped": 0}
+    try:
+        for start in range(0, len(digests), batch_size):
+            candidates = digests[start:start + batch_size]
+            batch = _claim(db, candidates)
+            result["skipped"] += len(candidates) - len(batch)
+            failed = []
+            for index, digest in enumerate(batch):
+                try:
+                    message = render_digest(digest, from_address, base_url)
+                except (ValueError, TypeError, TemplateError):
+                    # e.g. an address stored before profiles were validated; don't let it stop the others
+                    logger.exception("Digest for user %s could not be rendered", digest["user_id"])
+                    failed.append(digest)
+                    continue
+                try:
+                    sender.send(message)
+                    result["sent"] += 1
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError):
+                    logger.warning("Digest for user %s was refused for %s", digest["user_id"], digest["email"], exc_info=True)
+                    failed.append(digest)
+                except (smtplib.SMTPException, OSError):
+                    # The server is gone: hand the rest of the batch back so a later run picks it up.
+                    failed.extend(batch[index:])
+                    _release(db, failed)
+                    result["failed"] += len(failed)
+                    raise
+            _release(db, failed)
+            result["failed"] += len(failed)
+            logger.info("Digest batch %d: %d sent, %d failed", start // batch_size + 1, len(batch) - len(failed), len(failed))
+    finally:
+        for status in ("sent", "failed", "skipped"):
+            if result[status]: metrics.inc("digests", result[status], status=status)
+    return result
+
+
+def send_daily_digests(settings=None, today: date = None) -> dict:
+    settings = settings or get_settings()
+    if not settings.smtp_host: raise RuntimeError("TASKFLOW_SMTP_HOST is not set")
+    sender = DigestSender(settings.smtp_host, settings.smtp_port, settings.smtp_username, settings.smtp_password,
+                          settings.smtp_starttls, settings.digest_rate)
+    with sender, session_scope() as db:
+        started = time.perf_counter()
+        result = send_digests(db, sender, settings.digest_from, settings.base_url, settings.digest_batch_size, today)
+    result.update(connections=sender.connections, seconds=round(time.perf_counter() - started, 2))
+    metrics.set_gauge("digest_last_seconds", result["seconds"])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send the daily digest emails.")
+    parser.add_argument("--dry-run", action="store_true", help="print the digests instead of sending them")
+    parser.add_argument("--date", type=date.fromisoformat, default=None, help="report as of this day (YYYY-MM-DD)")
+    args = parser.parse_args()
+    settings = get_settings()
+    if args.dry_run:
+        with session_scope() as db:
+            for digest in build_digests(db, args.date):
+                print(render_digest(digest, settings.digest_from, settings.base_url).get_body(("plain",)).get_content())
+        return
+    print(send_daily_digests(settings, args.date))
+
+
+if __name__ == "__main__":
+    main()
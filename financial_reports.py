@@ -0,0 +1,278 @@
+"""Month-end financial reports per customer and per expert, as XLSX (or PDF when reportlab is installed).
+
+For a period [start, end) every project is reduced to:
+  invoiced     payment_amount of projects invoiced in the period
+  collected    payment_amount of projects paid in the period
+  outstanding  payment_amount invoiced before the period end and not paid by then (receivables at period end)
+  days to pay  payment_date - invoice_date of projects paid in the period
+  tonnage      weight_kg of projects delivered in the period
+
+Reports run as background jobs (jobs.py), never inside a request. The project rows are loaded once as plain
+tuples, partitioned by customer and handed to a process pool: each partition is aggregated and its detail
+rows are rendered (XML for the workbook, shaped text for the PDF) in a worker process, so a big month uses
+every core instead of one GIL. The parent merges the per-expert partial sums, which cross customers, and
+writes the file.
+
+Finished files are cached in report_dir under a name made of the period, the format and the projects and
+customers cache versions, so a repeated download is a file read until a project or customer changes.
+"""
+import multiprocessing
+import os
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from models import Project, get_cache_versions
+from metrics import metrics
+
+try:
+    from reportlab.lib import colors  # optional: pip install reportlab
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Table, TableStyle
+    from reportlab.lib.styles import getSampleStyleSheet
+except ImportError:
+    SimpleDocTemplate = None
+
+try:
+    import arabic_reshaper  # optional: pip install arabic-reshaper python-bidi, for Persian text in PDFs
+    from bidi.algorithm import get_display
+except ImportError:
+    arabic_reshaper = None
+
+REPORT_FORMATS = ("xlsx", "pdf") if SimpleDocTemplate is not None else ("xlsx",)
+REPORT_CACHE_KEEP = 48
+PARALLEL_MIN_ROWS = 50000  # each spawned worker spends ~0.7s importing; smaller reports are faster in one process
+PARTITIONS_PER_WORKER = 4
+NO_CUSTOMER = "بدون مشتری"
+NO_EXPERT = "بدون کارشناس"
+
+_ROW_COLUMNS = (
+    Project.id, Project.internal_number, Project.customer_id, Project.customer, Project.expert, Project.payment_amount,
+    Project.invoice_date, Project.payment_date, Project.delivery_date, Project.weight_kg, Project.status,
+)
+SUMMARY_HEADERS = ("پروژه ها", "فاکتور شده", "وصول شده", "مطالبات باز", "تعداد مطالبات باز", "میانگین روز تا وصول", "تناژ تحویلی (تن)")
+DETAIL_HEADERS = ("مشتری", "شماره داخلی", "کارشناس", "وضعیت", "مبلغ", "تاریخ فاکتور", "تاریخ واریز", "روز تا وصول", "تاریخ تحویل", "وزن (کیلوگرم)", "مانده")
+
+
+def report_period(period: str) -> tuple:
+    """'2025-03' -> (date(2025, 3, 1), date(2025, 4, 1))."""
+    start = datetime.strptime(period, "%Y-%m").date()
+    end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+def data_version(db: Session) -> str:
+    return "-".join(str(version) for version in get_cache_versions(db, "projects", "customers"))
+
+
+def report_filename(period: str, fmt: str, version: str) -> str:
+    return f"financial-{period}-v{version}.{fmt}"
+
+
+def cached_report(report_dir: str, period: str, fmt: str, version: str):
+    path = os.path.join(report_dir, report_filename(period, fmt, version))
+    return path if os.path.exists(path) else None
+
+
+def load_report_rows(db: Session, start: date, end: date) -> list:
+    """Projects that touch the period: open receivables at its end, payments in it, deliveries in it."""
+    return [tuple(row) for row in db.query(*_ROW_COLUMNS).filter(or_(
+        and_(Project.invoice_date < end, or_(Project.payment_date == None, Project.payment_date >= start)),  # noqa: E711
+        and_(Project.payment_date >= start, Project.payment_date < end),
+        and_(Project.delivery_date >= start, Project.delivery_date < end),
+    ))]
+
+
+def partition_rows(rows: list, partitions: int) -> list:
+    """Groups rows by customer and spreads the customers over at most `partitions` lists of similar size."""
+    customers = defaultdict(list)
+    for row in rows:
+        customers[row[2] if row[2] is not None else (row[3] or NO_CUSTOMER)].append(row)
+    buckets = [[] for _ in range(max(1, min(partitions, len(customers))))]
+    for group in sorted(customers.values(), key=len, reverse=True):  # largest first onto the smallest bucket
+        min(buckets, key=len).extend(group)
+    return [bucket for bucket in buckets if bucket]
+
+
+def _empty_totals() -> dict:
+    return {"projects": 0, "invoiced": 0.0, "collected": 0.0, "outstanding": 0.0, "outstanding_count": 0,
+            "payment_days": 0, "payments": 0, "weight_kg": 0.0}
+
+
+def _add(totals: dict, other: dict):
+    for key, value in other.items():
+        totals[key] += value
+
+
+def _summary_values(totals: dict) -> tuple:
+    days = round(totals["payment_days"] / totals["payments"], 1) if totals["payments"] else None
+    return (totals["projects"], totals["invoiced"], totals["collected"], totals["outstanding"], totals["outstanding_count"],
+            days, round(totals["weight_kg"] / 1000, 3))
+
+
+def _xlsx_cell(value) -> str:
+    if value is None: return "<c/>"
+    if isinstance(value, (int, float)): return f"<c><v>{value}</v></c>"
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def _xlsx_row(values) -> str:
+    return "<row>" + "".join(_xlsx_cell(value) for value in values) + "</row>"
+
+
+def _pdf_text(value) -> str:
+    text = "" if value is None else f"{value:,.0f}" if isinstance(value, float) else str(value)
+    return get_display(arabic_reshaper.reshape(text)) if arabic_reshaper is not None and text else text
+
+
+def compute_partition(rows: list, start: date, end: date, fmt: str) -> dict:
+    """Aggregates one partition and renders its detail rows. Runs in a worker process: plain data in and out."""
+    customers, experts, details = {}, defaultdict(_empty_totals), {}
+    for row in sorted(rows, key=lambda row: (row[3] or "", row[1] or "")):
+        project_id, number, customer_id, customer, expert, amount, invoiced, paid, delivered, weight, status = row
+        amount, customer, expert = amount or 0.0, customer or NO_CUSTOMER, (expert or "").strip() or NO_EXPERT
+        totals = _empty_totals()
+        totals["projects"] = 1
+        if invoiced and start <= invoiced < end: totals["invoiced"] = amount
+        if paid and start <= paid < end:
+            totals["collected"] = amount
+            if invoiced:
+                totals["payment_days"], totals["payments"] = (paid - invoiced).days, 1
+        outstanding = bool(invoiced and invoiced < end and (not paid or paid >= end))
+        if outstanding: totals["outstanding"], totals["outstanding_count"] = amount, 1
+        if delivered and start <= delivered < end: totals["weight_kg"] = weight or 0.0
+
+        key = customer_id if customer_id is not None else customer
+        entry = customers.setdefault(key, {"name": customer, "totals": _empty_totals()})
+        _add(entry["totals"], totals)
+        _add(experts[expert], totals)
+        values = (customer, number, expert, status, amount, invoiced and invoiced.isoformat(), paid and paid.isoformat(),
+                  (paid - invoiced).days if paid and invoiced else None, delivered and delivered.isoformat(), weight, amount if outstanding else 0.0)
+        if fmt == "pdf": values = tuple(_pdf_text(value) for value in values)
+        else: values = _xlsx_row(values)
+        details.setdefault(key, []).append(values)
+    return {
+        "customers": [{"key": key, "name": entry["name"], "totals": entry["totals"], "detail": details[key]} for key, entry in customers.items()],
+        "experts": dict(experts),
+    }
+
+
+def _compute(rows: list, start: date, end: date, fmt: str, workers: int, progress) -> list:
+    if workers <= 1 or len(rows) < PARALLEL_MIN_ROWS:
+        return [compute_partition(rows, start, end, fmt)]
+    partitions = partition_rows(rows, workers * PARTITIONS_PER_WORKER)
+    results = []
+    # spawn, not fork: the app process runs request and job threads, and a forked child could inherit a held lock
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(compute_partition, partition, start, end, fmt) for partition in partitions]
+        for done, future in enumerate(as_completed(futures), 1):
+            results.append(future.result())
+            progress(10 + done * 80 // len(futures), f"{done}/{len(futures)}")
+    return results
+
+
+def _merge(results: list) -> tuple:
+    customers = sorted((customer for result in results for customer in result["customers"]), key=lambda customer: customer["name"])
+    experts = defaultdict(_empty_totals)
+    for result in results:
+        for name, totals in result["experts"].items():
+            _add(experts[name], totals)
+    return customers, sorted(experts.items())
+
+
+def _write_xlsx(path: str, title: str, customers: list, experts: list):
+    def sheet(header_rows, body_rows) -> str:
+        return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetViews><sheetView rightToLeft="1" workbookViewId="0"/></sheetViews><sheetData>'
+                + "".join(_xlsx_row(row) for row in header_rows) + "".join(body_rows) + "</sheetData></worksheet>")
+    total = _empty_totals()
+    for customer in customers: _add(total, customer["totals"])
+    sheets = {
+        "مشتریان": sheet([(title,), ("مشتری",) + SUMMARY_HEADERS],
+                         [_xlsx_row((customer["name"],) + _summary_values(customer["totals"])) for customer in customers]
+                         + [_xlsx_row(("جمع",) + _summary_values(total))]),
+        "کارشناسان": sheet([(title,), ("کارشناس",) + SUMMARY_HEADERS], [_xlsx_row((name,) + _summary_values(totals)) for name, totals in experts]),
+        "پروژه ها": sheet([DETAIL_HEADERS], [row for customer in customers for row in customer["detail"]]),
+    }
+    content_types = "".join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>' for i in range(1, len(sheets) + 1))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                         '<Default Extension="xml" ContentType="application/xml"/>'
+                         '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                         f"{content_types}</Types>")
+        archive.writestr("_rels/.rels", '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+                         "</Relationships>")
+        archive.writestr("xl/workbook.xml", '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+                         + "".join(f'<sheet name="{escape(name)}" sheetId="{i}" r:id="rId{i}"/>' for i, name in enumerate(sheets, 1))
+                         + "</sheets></workbook>")
+        archive.writestr("xl/_rels/workbook.xml.rels", '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         + "".join(f'<Relationship Id="rId{i}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet{i}.xml"/>' for i in range(1, len(sheets) + 1))
+                         + "</Relationships>")
+        for i, xml in enumerate(sheets.values(), 1):
+            archive.writestr(f"xl/worksheets/sheet{i}.xml", xml)
+
+
+def _write_pdf(path: str, title: str, customers: list, experts: list, font_path: str = None):
+    font = "Helvetica"
+    if font_path:  # a TTF with Persian glyphs, e.g. Vazirmatn
+        pdfmetrics.registerFont(TTFont("ReportFont", font_path))
+        font = "ReportFont"
+    style = TableStyle([("FONTNAME", (0, 0), (-1, -1), font), ("FONTSIZE", (0, 0), (-1, -1), 7),
+                        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey), ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey)])
+    heading = getSampleStyleSheet()["Heading2"].clone("ReportHeading", fontName=font)
+    def table(header, rows):
+        # columns reversed so the table reads right to left
+        return Table([tuple(reversed([_pdf_text(cell) for cell in header]))] + [tuple(reversed(row)) for row in rows], repeatRows=1, style=style)
+    summary = lambda name, totals: tuple(_pdf_text(value) for value in (name,) + _summary_values(totals))
+    story = [Paragraph(_pdf_text(title), heading),
+             table(("مشتری",) + SUMMARY_HEADERS, [summary(customer["name"], customer["totals"]) for customer in customers]),
+             PageBreak(), table(("کارشناس",) + SUMMARY_HEADERS, [summary(name, totals) for name, totals in experts]),
+             PageBreak(), table(DETAIL_HEADERS, [row for customer in customers for row in customer["detail"]])]
+    SimpleDocTemplate(path, pagesize=landscape(A4), title=title).build(story)
+
+
+def _prune(report_dir: str, keep: int = REPORT_CACHE_KEEP):
+    reports = sorted((entry for entry in os.scandir(report_dir) if entry.name.startswith("financial-") and entry.name.endswith((".xlsx", ".pdf"))), key=lambda entry: entry.stat().st_mtime)
+    for entry in reports[:-keep]:
+        os.remove(entry.path)
+
+
+def build_financial_report(db: Session, period: str, fmt: str, report_dir: str, workers: int = 4, font_path: str = None, progress=lambda *args: None) -> dict:
+    if fmt not in REPORT_FORMATS: raise ValueError(f"format must be one of {REPORT_FORMATS}")
+    start, end = report_period(period)
+    version = data_version(db)
+    path = os.path.join(report_dir, report_filename(period, fmt, version))
+    if os.path.exists(path):  # built by an earlier job since this one was queued
+        return {"file": os.path.basename(path), "cached": True}
+
+    started = datetime.utcnow()
+    rows = load_report_rows(db, start, end)
+    progress(10, f"{len(rows)} projects")
+    customers, experts = _merge(_compute(rows, start, end, fmt, workers, progress))
+    progress(90, "writing")
+    os.makedirs(report_dir, exist_ok=True)
+    partial_path = f"{path}.{os.urandom(4).hex()}.partial"
+    title = f"گزارش مالی {period}"
+    try:
+        if fmt == "pdf": _write_pdf(partial_path, title, customers, experts, font_path)
+        else: _write_xlsx(partial_path, title, customers, experts)
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path): os.remove(partial_path)
+    _prune(report_dir)
+    seconds = (datetime.utcnow() - started).total_seconds()
+    metrics.inc("financial_reports", format=fmt)
+    metrics.set_gauge("financial_report_last_seconds", seconds)
+    return {"file": os.path.basename(path), "cached": False, "projects": len(rows), "customers": len(customers), "seconds": round(seconds, 2)}
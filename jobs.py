@@ -0,0 +1,268 @@
+"""Durable background jobs stored in the jobs table.
+
+Routes call enqueue_job() and return at once; JobWorkerPool claims queued rows with a conditional UPDATE (so
+several workers, or several processes, never run the same job) and runs the handler on its own thread pool,
+sized separately from the request threadpool. A failed job is retried with exponential backoff until
+max_attempts, so handlers must be safe to re-run. Jobs left 'running' by a crashed worker are re-queued once
+their lock is older than JOB_LOCK_TIMEOUT; handlers that run long keep the lock fresh by reporting progress.
+
+Handlers registered with atomic=True make all their changes in one transaction, committed at the end, so a
+failed attempt leaves nothing behind and a retry starts from scratch. While that transaction holds SQLite's
+write lock the jobs table can't be updated from another connection, so such handlers report progress with
+persist=False: it is kept in memory and job_status() reads it from there for jobs running in this process.
+job_status() also reports their changes as pending, applying, committed or rolled_back.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from config import get_settings
+from database import session_scope
+from financial_reports import build_financial_report
+from models import BackgroundJob, bulk_update_tasks, bulk_delete_tasks, update_customer, delete_all_units_for_customer, create_customer_unit
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS = {}
+ATOMIC_JOB_KINDS = set()
+JOB_LOCK_TIMEOUT = timedelta(minutes=10)
+JOB_RETRY_BASE_SECONDS = 5
+BULK_JOB_CHUNK_SIZE = 500
+
+
+_live_progress = {}  # job id -> (percent, message) reported with persist=False by jobs running in this process
+_live_progress_lock = threading.Lock()
+
+
+def job_handler(kind: str, atomic: bool = False):
+    """Registers func(db, payload, progress) -> JSON-serializable result for jobs of this kind. An atomic handler
+    commits once, at the end; _run() rolls back everything it did if it raises."""
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        if atomic: ATOMIC_JOB_KINDS.add(kind)
+        return func
+    return register
+
+
+def enqueue_job(db: Session, kind: str, payload: dict, user_id: int = None, max_attempts: int = 3) -> BackgroundJob:
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = BackgroundJob(kind=kind, payload=json.dumps(payload, ensure_ascii=False, default=str), created_by=user_id, max_attempts=max_attempts)
+    db.add(job)
+    db.commit()
+    job_workers.notify()
+    return job
+
+
+def find_active_job(db: Session, kind: str, payload: dict):
+    """A queued or running job of this kind with the same payload, so identical requests can share it."""
+    return db.query(BackgroundJob).filter(
+        BackgroundJob.kind == kind, BackgroundJob.status.in_(('queued', 'running')),
+        BackgroundJob.payload == json.dumps(payload, ensure_ascii=False, default=str),
+    ).order_by(BackgroundJob.id).first()
+
+
+def get_job(db: Session, job_id: int):
+    return db.query(BackgroundJob).filter(BackgroundJob.id == job_id).first()
+
+
+def _changes_state(job: BackgroundJob):
+    """What an atomic job's changes amount to right now; None for other jobs, which may commit as they go."""
+    if job.kind not in ATOMIC_JOB_KINDS: return None
+    if job.status == 'succeeded': return "committed"
+    if job.status == 'running': return "applying"
+    return "rolled_back" if job.attempts else "pending"  # a queued job with attempts behind it is waiting to retry
+
+
+def job_status(job: BackgroundJob) -> dict:
+    progress, message = job.progress, job.progress_message
+    if job.status == 'running':
+        with _live_progress_lock:
+            progress, message = _live_progress.get(job.id, (progress, message))
+    return {
+        "id": job.id, "kind": job.kind, "status": job.status, "changes": _changes_state(job), "progress": progress, "progress_message": message,
+        "attempts": job.attempts, "max_attempts": job.max_attempts, "error": job.error,
+        "result": json.loads(job.result) if job.result else None,
+        "created_at": job.created_at, "started_at": job.started_at, "finished_at": job.finished_at,
+    }
+
+
+def requeue_stale_jobs(db: Session) -> int:
+    count = db.query(BackgroundJob).filter(
+        BackgroundJob.status == 'running', BackgroundJob.locked_at < datetime.utcnow() - JOB_LOCK_TIMEOUT,
+    ).update({BackgroundJob.status: 'queued', BackgroundJob.locked_by: None}, synchronize_session=False)
+    db.commit()
+    return count
+
+
+def prune_finished_jobs(db: Session, older_than_days: int) -> int:
+    count = db.query(BackgroundJob).filter(
+        BackgroundJob.status.in_(('succeeded', 'failed')), BackgroundJob.finished_at < datetime.utcnow() - timedelta(days=older_than_days),
+    ).delete(synchronize_session=False)
+    db.commit()
+    return count
+
+
+def _claim(worker_name: str):
+    """Marks the oldest runnable job as running for this worker and returns it, or None if the queue is empty."""
+    with session_scope() as db:
+        while True:
+            now = datetime.utcnow()
+            candidate = db.query(BackgroundJob.id).filter(BackgroundJob.status == 'queued', BackgroundJob.run_after <= now).order_by(BackgroundJob.id).limit(1).scalar()
+            if candidate is None:
+                return None
+            claimed = db.query(BackgroundJob).filter(BackgroundJob.id == candidate, BackgroundJob.status == 'queued').update({
+                BackgroundJob.status: 'running', BackgroundJob.attempts: BackgroundJob.attempts + 1,
+                BackgroundJob.locked_by: worker_name, BackgroundJob.locked_at: now, BackgroundJob.started_at: now,
+            }, synchronize_session=False)
+            db.commit()
+            if claimed:  # otherwise another worker won the race; try the next one
+                job = db.get(BackgroundJob, candidate)
+                return {"id": job.id, "kind": job.kind, "payload": json.loads(job.payload or "{}"), "attempts": job.attempts,
+                        "max_attempts": job.max_attempts, "created_by": job.created_by}
+
+
+def _update_job(job_id: int, values: dict):
+    with session_scope() as db:
+        db.query(BackgroundJob).filter(BackgroundJob.id == job_id).update(values, synchronize_session=False)
+        db.commit()
+
+
+def _progress_reporter(job_id: int):
+    def progress(percent: int, message: str = None, persist: bool = True):
+        if not persist:
+            with _live_progress_lock:
+                _live_progress[job_id] = (max(0, min(100, int(percent))), message)
+            return
+        try:
+            _update_job(job_id, {BackgroundJob.progress: max(0, min(100, int(percent))), BackgroundJob.progress_message: message,
+                                 BackgroundJob.locked_at: datetime.utcnow()})
+        except OperationalError:
+            logger.debug("Could not record progress for job %s", job_id, exc_info=True)  # e.g. SQLite busy; not worth failing the job
+    return progress
+
+
+def _run(job: dict):
+    handler = JOB_HANDLERS.get(job["kind"])
+    try:
+        if handler is None:
+            raise LookupError(f"No handler for job kind {job['kind']!r}")
+        try:
+            with session_scope() as db:
+                db.info["actor_id"] = job["created_by"]
+                result = handler(db, job["payload"], _progress_reporter(job["id"]))
+        finally:
+            with _live_progress_lock:
+                _live_progress.pop(job["id"], None)
+    except Exception as exc:
+        logger.exception("Job %s (%s) failed on attempt %s", job["id"], job["kind"], job["attempts"])
+        values = {BackgroundJob.error: f"{type(exc).__name__}: {exc}", BackgroundJob.locked_by: None}
+        if handler is not None and job["attempts"] < job["max_attempts"]:
+            delay = JOB_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+            values.update({BackgroundJob.status: 'queued', BackgroundJob.run_after: datetime.utcnow() + timedelta(seconds=delay)})
+        else:
+            values.update({BackgroundJob.status: 'failed', BackgroundJob.finished_at: datetime.utcnow()})
+        _update_job(job["id"], values)
+        return
+    _update_job(job["id"], {
+        BackgroundJob.status: 'succeeded', BackgroundJob.progress: 100, BackgroundJob.error: None, BackgroundJob.locked_by: None,
+        BackgroundJob.result: json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+        BackgroundJob.finished_at: datetime.utcnow(),
+    })
+
+
+class JobWorkerPool:
+    def __init__(self, concurrency: int = 2, poll_interval: float = 1.0):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._executor = None
+        self._tasks = []
+        self._loop = None
+        self._wakeup = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        if self._tasks: return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix="job-worker")
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks = [self._loop.create_task(self._work(f"{prefix}:{i}")) for i in range(self.concurrency)]
+
+    def notify(self):
+        """Wakes idle workers after an enqueue; safe to call from request threads."""
+        if self._loop is not None and self._tasks:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _work(self, name: str):
+        while True:
+            try:
+                job = await self._loop.run_in_executor(self._executor, _claim, name)
+            except Exception:
+                logger.exception("Job worker %s could not claim a job", name)
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._loop.run_in_executor(self._executor, _run, job)
+
+    async def stop(self):
+        """Stops claiming new jobs and waits for the ones already running to finish."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown, True)
+            self._executor = None
+        self._loop = None
+
+
+job_workers = JobWorkerPool()
+
+
+# --- Job handlers ---
+
+@job_handler("bulk_tasks", atomic=True)
+def bulk_tasks_job(db: Session, payload: dict, progress):
+    """All or nothing: chunks keep each statement's IN list short, but the edit is one transaction."""
+    task_ids = payload["task_ids"]
+    for start in range(0, len(task_ids), BULK_JOB_CHUNK_SIZE):
+        chunk = task_ids[start:start + BULK_JOB_CHUNK_SIZE]
+        if payload["action"] == "delete": bulk_delete_tasks(db, chunk)
+        else: bulk_update_tasks(db, chunk, payload["updates"])
+        done = start + len(chunk)
+        progress(done * 99 // len(task_ids), f"{done}/{len(task_ids)}", persist=False)
+    db.commit()
+    return {"tasks": len(task_ids)}
+
+
+@job_handler("save_customer")
+def save_customer_job(db: Session, payload: dict, progress):
+    customer_id, units = payload["customer_id"], payload["units"]
+    update_customer(db, customer_id, payload["data"])
+    delete_all_units_for_customer(db, customer_id)
+    for index, unit_data in enumerate(units, 1):
+        create_customer_unit(db, customer_id, unit_data)
+        progress(index * 100 // len(units), f"{index}/{len(units)}")
+    return {"customer_id": customer_id, "units": len(units)}
+
+
+@job_handler("financial_report")
+def financial_report_job(db: Session, payload: dict, progress):
+    settings = get_settings()
+    return build_financial_report(db, payload["period"], payload["format"], settings.report_dir, settings.report_workers,
+                                  settings.report_pdf_font, progress)
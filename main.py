@@ -1,27 +1,62 @@
-from fastapi import FastAPI, Request, Form, Depends, HTTPException, status, Query
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi import FastAPI, APIRouter, Request, Form, Depends, HTTPException, status, Query
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import RedirectResponse, JSONResponse, PlainTextResponse, Response, FileResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import or_
 from auth import get_db, get_current_user, login_user, register_user
 from models import (
     User, Task, Project, Notification, get_user_tasks, create_task, get_all_tasks, 
-    update_task_fields, delete_task, get_task_by_id, get_all_users, update_user_profile, 
+    update_task_fields, delete_task, get_all_users, update_user_profile, 
     create_project, get_all_projects, get_project_by_id, update_project, delete_project,
-    create_notification, get_unread_notifications, mark_notification_as_read,Customer, CustomerUnit,
+    create_notification, create_notifications, get_unread_notifications, mark_notification_as_read,Customer, CustomerUnit,
     create_customer, get_all_customers, get_customer_by_id, update_customer, delete_customer,
-    create_customer_unit,delete_all_units_for_customer
+    create_customer_unit,delete_all_units_for_customer, ProjectStatusSummary, get_pipeline_summary,
+    search_archived_tasks, get_activity_history, get_cache_versions,
+    get_task_dependencies, add_task_dependency, remove_task_dependency, task_visibility, get_visible_task, count_visible_tasks
 )
-from database import Base, engine
-from datetime import datetime, date
+import database
+from config import Settings, get_settings
+from scheduler import Scheduler
+from migrations import run_migrations
+from audit import AUDITED_MODELS, activity_writer
+from sync import SYNC_PAGE_SIZE, decode_token, get_changes
+from analytics import ANALYTICS_WINDOWS, get_workload_report
+from financial_reports import REPORT_FORMATS, cached_report, data_version, report_period
+from maintenance import register_maintenance_jobs, reconcile_pipeline_summary_job, refresh_autocomplete_job, requeue_stale_jobs_job
+from assets import AssetManifest, FingerprintedStaticFiles, static_url_helper
+from cache import normalize_filters, page_cache
+from admission import AdmissionControlMiddleware
+import search_index
+from metrics import metrics
+from connection_monitor import connection_monitor
+from jobs import enqueue_job, find_active_job, get_job, job_status, job_workers
+from digest import is_valid_email
+from scheduling import get_project_schedule
+from streaming import async_environment, stream_template
+from profiling import ProfilingMiddleware, flame_tree, get_profile
+from calendar_feed import (
+    CALENDAR_VIEWS, EVENT_SOURCES, calendar_token, calendar_window, feed_etag, feed_window, get_calendar_events,
+    get_user_by_calendar_token, group_by_day, render_ical
+)
+from datetime import datetime, date, timedelta
 from typing import Optional
+from urllib.parse import quote, urlsplit
+import json
+import os
+from contextlib import asynccontextmanager
+from functools import partial
+
+try:
+    from brotli_asgi import BrotliMiddleware  # optional: pip install brotli-asgi
+except ImportError:
+    BrotliMiddleware = None
 
 # --- App Setup ---
-app = FastAPI()
-Base.metadata.create_all(bind=engine)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+router = APIRouter()
 templates = Jinja2Templates(directory="templates")
+templates.env.filters["from_json"] = json.loads
+stream_env = async_environment(templates.env)
 
 # --- Constants for Dropdowns ---
 SECTIONS = ["مدیریت", "فروش", "خرید", "دفتر فنی", "دفتر طراحی", "کنترل کیفی", "کنترل پروژه", "تولید", "اداری", "مالی", "مامور خرید"]
@@ -34,16 +69,16 @@ REGISTRATION_STATUSES = ["مشتری جاری", "ثبت و تکمیل مدارک
 
 
 # --- Authentication & Profile Routes ---
-@app.get("/")
-def root(request: Request):
-    if get_current_user(request, db=next(get_db())): return RedirectResponse("/dashboard", status_code=status.HTTP_302_FOUND)
+@router.get("/")
+def root(user: User = Depends(get_current_user)):
+    if user: return RedirectResponse("/dashboard", status_code=status.HTTP_302_FOUND)
     return RedirectResponse("/login", status_code=status.HTTP_302_FOUND)
 
-@app.get("/login")
+@router.get("/login")
 def login_form(request: Request):
     return templates.TemplateResponse("login.html", {"request": request, "user": None, "SECTIONS": SECTIONS})
 
-@app.post("/login")
+@router.post("/login")
 def login(request: Request, username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
     user = login_user(db, username, password)
     if not user:
@@ -52,68 +87,85 @@ def login(request: Request, username: str = Form(...), password: str = Form(...)
     response.set_cookie("user_id", str(user.id), httponly=True)
     return response
 
-@app.get("/register")
+@router.get("/register")
 def register_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request, "register": True, "user": None, "SECTIONS": SECTIONS})
 
-@app.post("/register")
+@router.post("/register")
 def register(request: Request, username: str = Form(...), password: str = Form(...), role: str = Form(...), section: str = Form(...), db: Session = Depends(get_db)):
     if not register_user(db, username, password, role, section):
         return templates.TemplateResponse("login.html", {"request": request, "register": True, "error": "Username already exists", "user": None, "SECTIONS": SECTIONS})
     return RedirectResponse("/login", status_code=status.HTTP_302_FOUND)
 
-@app.get("/logout")
+@router.get("/logout")
 def logout():
     response = RedirectResponse("/login", status_code=status.HTTP_302_FOUND)
     response.delete_cookie("user_id")
     return response
 
-@app.get("/profile")
+@router.get("/profile")
 def profile_page(request: Request, user: User = Depends(get_current_user), success: bool = False):
     if not user: return RedirectResponse("/login")
     return templates.TemplateResponse("profile.html", {"request": request, "user": user, "SECTIONS": SECTIONS, "success": success})
 
-@app.post("/profile")
+@router.post("/profile")
 async def update_profile(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user: return RedirectResponse("/login")
     form = await request.form()
-    updates = {"username": form.get("username"), "section": form.get("section"), "password": form.get("password")}
+    updates = {"username": form.get("username"), "section": form.get("section"), "password": form.get("password"), "email": (form.get("email") or "").strip()}
     if updates["username"] != user.username:
         if db.query(User).filter(User.username == updates["username"]).first():
             return templates.TemplateResponse("profile.html", {"request": request, "user": user, "SECTIONS": SECTIONS, "error": "This username is already taken."})
+    if updates["email"] and not is_valid_email(updates["email"]):
+        return templates.TemplateResponse("profile.html", {"request": request, "user": user, "SECTIONS": SECTIONS, "error": "Enter a valid email address."})
     update_user_profile(db, user.id, updates)
     return RedirectResponse("/profile?success=true", status_code=status.HTTP_302_FOUND)
 
 # --- Notification Routes ---
-@app.post("/notifications/mark-read/{notification_id}")
+@router.post("/notifications/mark-read/{notification_id}")
 def mark_read(notification_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user: return RedirectResponse("/login")
     mark_notification_as_read(db, notification_id, user.id)
     return RedirectResponse(request.headers.get("referer", "/dashboard"), status_code=status.HTTP_302_FOUND)
 
+# --- Cached list pages ---
+def render_cached_content(db: Session, route: str, role: str, filters: dict, tables: tuple, template_name: str, build_context) -> str:
+    """Returns the rendered page body from page_cache, rendering it with build_context() on a miss."""
+    key = (route, role, normalize_filters(filters))
+    versions = get_cache_versions(db, *tables)
+    content = page_cache.get(key, versions)
+    if content is None:
+        # Build from the primary too, or a lagging replica's old rows would be cached under the new version.
+        with database.primary_reads(db):
+            content = templates.get_template(template_name).render(build_context())
+        page_cache.set(key, versions, content)
+    return content
+
 # --- Project Routes ---
-@app.get("/projects")
-def projects_list(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user), status_filter: Optional[str] = Query(None), customer_filter: Optional[str] = Query(None), search_filter: Optional[str] = Query(None), expert_filter: Optional[str] = Query(None)):
+@router.get("/projects")
+def projects_list(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user), status_filter: Optional[str] = Query(None), customer_filter: Optional[str] = Query(None), customer_id: Optional[int] = Query(None), search_filter: Optional[str] = Query(None), expert_filter: Optional[str] = Query(None)):
     if not user: return RedirectResponse("/login")
-    filters = {'status': status_filter, 'customer': customer_filter, 'search': search_filter, 'expert': expert_filter}
-    projects = get_all_projects(db, filters=filters)
-    customers = get_all_customers(db) 
-    if projects: # Check if projects list is not empty before sorting
-        projects.sort(key=lambda project: project.internal_number)
-    return templates.TemplateResponse("projects.html", {"request": request, "user": user, "projects": projects, "PROJECT_STATUSES": PROJECT_STATUSES, "filters": filters, "customers":customers})
-
-@app.get("/project/new")
+    filters = dict(normalize_filters({'status': status_filter, 'customer': customer_filter, 'customer_id': str(customer_id or ''), 'search': search_filter, 'expert': expert_filter}))
+    def build():
+        projects = get_all_projects(db, filters=filters)
+        if projects: # Check if projects list is not empty before sorting
+            projects.sort(key=lambda project: project.internal_number)
+        selected_customer = get_customer_by_id(db, customer_id) if customer_id else None
+        return {"projects": projects, "PROJECT_STATUSES": PROJECT_STATUSES, "filters": filters, "selected_customer": selected_customer}
+    content = render_cached_content(db, "/projects", user.role, filters, ("projects", "customers"), "_projects_content.html", build)
+    return templates.TemplateResponse("projects.html", {"request": request, "user": user, "content": content})
+
+@router.get("/project/new")
 def new_project_form(request: Request,db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user: return RedirectResponse("/login")
-    customers = get_all_customers(db) 
-    return templates.TemplateResponse("project_form.html", {"request": request, "user": user, "PROJECT_STATUSES": PROJECT_STATUSES, "project": None , "customer":customers})
+    return templates.TemplateResponse("project_form.html", {"request": request, "user": user, "PROJECT_STATUSES": PROJECT_STATUSES, "project": None})
 
-@app.post("/project/new")
+@router.post("/project/new")
 async def handle_create_project(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user: return RedirectResponse("/login")
     form = await request.form()
     project_data = {
-        "internal_number": form.get("internal_number"), "customer": form.get("customer"), "request_number": form.get("request_number"),
+        "internal_number": form.get("internal_number"), "customer_id": int(form.get("customer_id")) if form.get("customer_id") else None, "request_number": form.get("request_number"),
         "notification_date": datetime.strptime(form.get("notification_date"), "%Y-%m-%d").date() if form.get("notification_date") else None,
         "delivery_date": datetime.strptime(form.get("delivery_date"), "%Y-%m-%d").date() if form.get("delivery_date") else None,
         "description": form.get("description"), "weight_kg": float(form.get("weight_kg")) if form.get("weight_kg") else None,
@@ -129,20 +181,73 @@ async def handle_create_project(request: Request, db: Session = Depends(get_db),
     create_project(db, project_data)
     return RedirectResponse("/projects", status_code=status.HTTP_302_FOUND)
 
-@app.get("/project/{project_id}")
+@router.get("/project/{project_id}")
 def project_detail(project_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user: return RedirectResponse("/login")
     project = get_project_by_id(db, project_id)
     if not project: raise HTTPException(404, "Project not found")
-    customers = get_all_customers(db)
-    return templates.TemplateResponse("project_detail.html", {"request": request, "user": user, "project": project, "PROJECT_STATUSES": PROJECT_STATUSES, "customer":customers})
-
-@app.post("/project/{project_id}")
+    schedule = get_project_schedule(db, project_id, visible_to=user)
+    return templates.TemplateResponse("project_detail.html", {"request": request, "user": user, "project": project, "schedule": schedule, "PROJECT_STATUSES": PROJECT_STATUSES})
+
+@router.get("/api/projects/{project_id}/schedule")
+def project_schedule_api(project_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    if not user: raise HTTPException(401, "Not authenticated")
+    if not get_project_by_id(db, project_id): raise HTTPException(404, "Project not found")
+    return get_project_schedule(db, project_id, visible_to=user)
+
+# --- Calendar ---
+def _calendar_range(view: str, anchor: Optional[date]):
+    if view not in CALENDAR_VIEWS: raise HTTPException(400, f"view must be one of {CALENDAR_VIEWS}")
+    return calendar_window(anchor or date.today(), view)
+
+@router.get("/calendar")
+def calendar_page(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user), view: str = Query("week"), anchor: Optional[date] = Query(None, alias="date"), status_filter: Optional[str] = Query(None), expert_filter: Optional[str] = Query(None)):
+    if not user: return RedirectResponse("/login")
+    start, end = _calendar_range(view, anchor)
+    events = get_calendar_events(db, user, start, end, status_filter, expert_filter)
+    feed_url = str(request.url_for("calendar_feed", token=calendar_token(db, user)))
+    return templates.TemplateResponse("calendar.html", {
+        "request": request, "user": user, "view": view, "start": start, "end": end, "days": group_by_day(events, start, end),
+        "previous": calendar_window(start - timedelta(days=1), view)[0], "next": end, "today": date.today(),
+        "filters": {"status": status_filter or "", "expert": expert_filter or ""}, "feed_url": feed_url,
+        "EVENT_SOURCES": EVENT_SOURCES, "PROJECT_STATUSES": PROJECT_STATUSES, "CALENDAR_VIEWS": CALENDAR_VIEWS,
+    })
+
+@router.get("/api/calendar")
+def calendar_api(db: Session = Depends(get_db), user: User = Depends(get_current_user), view: str = Query("week"), anchor: Optional[date] = Query(None, alias="date"), status_filter: Optional[str] = Query(None), expert_filter: Optional[str] = Query(None)):
+    if not user: raise HTTPException(401, "Not authenticated")
+    start, end = _calendar_range(view, anchor)
+    events = get_calendar_events(db, user, start, end, status_filter, expert_filter)
+    return {"view": view, "start": start, "end": end, "events": events}
+
+@router.post("/calendar/token/reset")
+def reset_calendar_token(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    if not user: return RedirectResponse("/login")
+    calendar_token(db, user, reset=True)
+    return RedirectResponse("/calendar", status_code=status.HTTP_302_FOUND)
+
+@router.get("/calendar/feed/{token}.ics", name="calendar_feed")
+def calendar_feed(token: str, request: Request, db: Session = Depends(get_db), status_filter: Optional[str] = Query(None), expert_filter: Optional[str] = Query(None)):
+    # Calendar clients can't log in: the unguessable token in the URL stands in for the session cookie.
+    user = get_user_by_calendar_token(db, token)
+    if not user: raise HTTPException(404, "Calendar not found")
+    etag = feed_etag(db, user, status_filter, expert_filter)
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=300"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        metrics.inc("calendar_feed_requests", result="not_modified")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    start, end = feed_window()
+    events = get_calendar_events(db, user, start, end, status_filter, expert_filter)
+    metrics.inc("calendar_feed_requests", result="full")
+    body = render_ical(events, str(request.base_url), f"TaskFlow - {user.username}")
+    return Response(body, media_type="text/calendar; charset=utf-8", headers=headers)
+
+@router.post("/project/{project_id}")
 async def handle_update_project(project_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user: return RedirectResponse("/login")
     form = await request.form()
     project_data = {
-        "internal_number": form.get("internal_number"), "customer": form.get("customer"), "request_number": form.get("request_number"),
+        "internal_number": form.get("internal_number"), "customer_id": int(form.get("customer_id")) if form.get("customer_id") else None, "request_number": form.get("request_number"),
         "notification_date": datetime.strptime(form.get("notification_date"), "%Y-%m-%d").date() if form.get("notification_date") else None,
         "delivery_date": datetime.strptime(form.get("delivery_date"), "%Y-%m-%d").date() if form.get("delivery_date") else None,
         "description": form.get("description"), "weight_kg": float(form.get("weight_kg")) if form.get("weight_kg") else None,
@@ -158,7 +263,7 @@ async def handle_update_project(project_id: int, request: Request, db: Session =
     update_project(db, project_id, project_data)
     return RedirectResponse(f"/project/{project_id}", status_code=status.HTTP_302_FOUND)
 
-@app.post("/project/delete/{project_id}")
+@router.post("/project/delete/{project_id}")
 def handle_delete_project(project_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user or user.role not in ['admin', 'boss']: 
         raise HTTPException(403, "You do not have permission to delete projects.")
@@ -166,7 +271,7 @@ def handle_delete_project(project_id: int, db: Session = Depends(get_db), user:
     return RedirectResponse("/projects", status_code=status.HTTP_302_FOUND)
 
 # --- API for Dynamic User Fetching ---
-@app.get("/api/users-by-section")
+@router.get("/api/users-by-section")
 def users_by_section(section: str, db: Session = Depends(get_db)):
     query = db.query(User)
     if section != "all":
@@ -175,92 +280,264 @@ def users_by_section(section: str, db: Session = Depends(get_db)):
     users = query.order_by(User.username).all()
     return [{"id": user.id, "username": user.username} for user in users]
 
-# --- Task Routes ---
-@app.get("/dashboard")
-def dashboard(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user), search_filter: Optional[str] = Query(None), status_filter: Optional[str] = Query(None), level_filter: Optional[str] = Query(None), type_filter: Optional[str] = Query(None), section_filter: Optional[str] = Query(None), man_filter: Optional[str] = Query(None), leader_filter: Optional[str] = Query(None), project_filter: Optional[str] = Query(None)):
+# --- Autocomplete ---
+@router.get("/api/autocomplete/{kind}")
+def autocomplete(kind: str, q: str = Query(""), limit: int = Query(search_index.AUTOCOMPLETE_LIMIT, ge=1, le=50), db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    if not user: raise HTTPException(401, "Not authenticated")
+    if kind not in search_index.INDEXED_MODELS: raise HTTPException(404, "Unknown index")
+    if kind == "users" and user.role not in ['admin', 'boss']: raise HTTPException(403, "You do not have permission.")
+    return {"results": search_index.search(db, kind, q, limit)}
+
+# --- Activity History ---
+@router.get("/history/{entity_type}/{entity_id}")
+def activity_history(entity_type: str, entity_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    if not user: return RedirectResponse("/login")
+    if entity_type not in AUDITED_MODELS.values(): raise HTTPException(404, "Unknown entity type")
+    if user.role not in ['admin', 'boss'] or (entity_type == "customer" and user.role != 'boss'):
+        raise HTTPException(403, "You do not have permission.")
+    # An admin only reads the history of tasks they can open; a boss also that of deleted tasks.
+    if entity_type == "task" and user.role != 'boss' and not get_visible_task(db, user, entity_id): raise HTTPException(404, "Task not found")
+    entries = get_activity_history(db, entity_type, entity_id)
+    usernames = {u.id: u.username for u in get_all_users(db)}
+    return templates.TemplateResponse("activity_history.html", {"request": request, "user": user, "entity_type": entity_type, "entity_id": entity_id, "entries": entries, "usernames": usernames})
+
+# --- Report Routes ---
+@router.get("/reports/workload")
+def workload_report_page(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user), window: int = Query(30)):
+    if not user: return RedirectResponse("/login")
+    if user.role != 'boss': raise HTTPException(403, "You do not have permission.")
+    if window not in ANALYTICS_WINDOWS: window = 30
+    report = get_workload_report(db, window)
+    return templates.TemplateResponse("workload_report.html", {"request": request, "user": user, "report": report, "ANALYTICS_WINDOWS": ANALYTICS_WINDOWS})
+
+@router.get("/api/reports/workload")
+def workload_report_api(db: Session = Depends(get_db), user: User = Depends(get_current_user), window: int = Query(30)):
+    if not user or user.role != 'boss': raise HTTPException(403, "You do not have permission.")
+    if window not in ANALYTICS_WINDOWS: raise HTTPException(400, f"window must be one of {ANALYTICS_WINDOWS}")
+    return get_workload_report(db, window)
+
+def _financial_report_request(period: Optional[str], fmt: str) -> str:
+    try: report_period(period or "")
+    except ValueError: raise HTTPException(400, "period must look like 2025-03")
+    if fmt not in REPORT_FORMATS: raise HTTPException(400, f"format must be one of {REPORT_FORMATS}")
+    return period
+
+@router.get("/reports/financial")
+def financial_reports_page(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user), period: Optional[str] = Query(None), format: str = Query("xlsx")):
+    if not user: return RedirectResponse("/login")
+    if user.role != 'boss': raise HTTPException(403, "You do not have permission.")
+    report_dir = get_settings().report_dir
+    files = sorted(os.scandir(report_dir), key=lambda entry: entry.name, reverse=True) if os.path.isdir(report_dir) else []
+    files = [{"name": entry.name, "size": entry.stat().st_size} for entry in files if entry.name.startswith("financial-") and entry.name.endswith(REPORT_FORMATS)]
+    last_month = date.today().replace(day=1) - timedelta(days=1)
+    return templates.TemplateResponse("financial_reports.html", {
+        "request": request, "user": user, "period": period or f"{last_month:%Y-%m}", "format": format, "files": files,
+        "version": data_version(db), "REPORT_FORMATS": REPORT_FORMATS,
+    })
+
+@router.post("/reports/financial")
+def generate_financial_report(db: Session = Depends(get_db), user: User = Depends(get_current_user), period: str = Form(...), format: str = Form("xlsx")):
     if not user: return RedirectResponse("/login")
-    tas = get_user_tasks(db, user.id) # You need to implement get_all_user_tasks
+    if user.role != 'boss': raise HTTPException(403, "You do not have permission.")
+    period = _financial_report_request(period, format)
+    download = f"/reports/financial/download?period={period}&format={format}"
+    if cached_report(get_settings().report_dir, period, format, data_version(db)):
+        return RedirectResponse(download, status_code=status.HTTP_302_FOUND)
+    payload = {"period": period, "format": format}
+    job = find_active_job(db, "financial_report", payload) or enqueue_job(db, "financial_report", payload, user.id, max_attempts=1)
+    return RedirectResponse(f"/jobs/{job.id}?next={quote(download)}", status_code=status.HTTP_302_FOUND)
+
+@router.get("/reports/financial/download")
+def download_financial_report(db: Session = Depends(get_db), user: User = Depends(get_current_user), period: Optional[str] = Query(None), format: str = Query("xlsx")):
+    if not user: return RedirectResponse("/login")
+    if user.role != 'boss': raise HTTPException(403, "You do not have permission.")
+    period = _financial_report_request(period, format)
+    path = cached_report(get_settings().report_dir, period, format, data_version(db))
+    # Projects changed since the report was built: send the user back to generate a current one.
+    if not path: return RedirectResponse(f"/reports/financial?period={period}&format={format}", status_code=status.HTTP_302_FOUND)
+    return FileResponse(path, filename=os.path.basename(path))
+
+@router.get("/reports/financial/files/{name}")
+def financial_report_file(name: str, user: User = Depends(get_current_user)):
+    if not user or user.role != 'boss': raise HTTPException(403, "You do not have permission.")
+    path = os.path.join(get_settings().report_dir, os.path.basename(name))
+    if not name.startswith("financial-") or not name.endswith(REPORT_FORMATS) or not os.path.isfile(path): raise HTTPException(404, "Report not found")
+    return FileResponse(path, filename=name)
+
+# --- Background Jobs ---
+def local_path(url: Optional[str], default: str) -> str:
+    """Path and query of url, so redirects built from Referer or ?next= never leave this site."""
+    if not url: return default
+    parts = urlsplit(url)
+    path = parts.path if parts.path.startswith("/") and not parts.path.startswith("//") else default
+    return f"{path}?{parts.query}" if parts.query else path
+
+def _visible_job(db: Session, job_id: int, user: User):
+    job = get_job(db, job_id)
+    if not job: raise HTTPException(404, "Job not found")
+    if user.role != 'boss' and job.created_by != user.id: raise HTTPException(403, "You do not have permission.")
+    return job
+
+@router.get("/jobs/{job_id}")
+def job_status_page(job_id: int, request: Request, next_url: Optional[str] = Query(None, alias="next"), db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    if not user: return RedirectResponse("/login")
+    job = _visible_job(db, job_id, user)
+    next_url = local_path(next_url, "/dashboard")
+    if job.status == "succeeded": return RedirectResponse(next_url, status_code=status.HTTP_302_FOUND)
+    return templates.TemplateResponse("job_status.html", {"request": request, "user": user, "job": job_status(job), "next_url": next_url})
+
+@router.get("/api/jobs/{job_id}")
+def job_status_api(job_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    if not user: raise HTTPException(401, "Not authenticated")
+    return job_status(_visible_job(db, job_id, user))
+
+# --- Metrics ---
+@router.get("/debug/metrics")
+def debug_metrics(user: User = Depends(get_current_user)):
+    if not user or user.role != 'boss': raise HTTPException(403, "You do not have permission.")
+    return metrics.snapshot()
+
+@router.get("/debug/connections")
+def debug_connections(older_than: float = Query(0, ge=0), user: User = Depends(get_current_user)):
+    if not user or user.role != 'boss': raise HTTPException(403, "You do not have permission.")
+    return {"checked_out": connection_monitor.checked_out(), "connections": connection_monitor.leaks(older_than)}
+
+@router.get("/debug/profiles/{profile_id}")
+def debug_profile(profile_id: str, request: Request, format: str = Query("html"), db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    if not user or user.role != 'boss': raise HTTPException(403, "You do not have permission.")
+    found = get_profile(db, profile_id)
+    if not found: raise HTTPException(404, "Profile not found")
+    profile, report = found
+    if format == "json": return report
+    if format == "collapsed":  # for flamegraph.pl / speedscope
+        return PlainTextResponse("".join(f"{stack} {count}\n" for stack, count in report["stacks"].items()))
+    return templates.TemplateResponse("debug_profile.html", {"request": request, "user": user, "profile": profile, "report": report, "tree": flame_tree(report["stacks"])})
+
+# --- Delta Sync API ---
+@router.get("/api/v1/changes")
+def changes_since(since: Optional[str] = Query(None), limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=SYNC_PAGE_SIZE), db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    if not user: raise HTTPException(401, "Not authenticated")
+    try:
+        since_time = decode_token(since)
+    except (ValueError, OverflowError):
+        raise HTTPException(400, "Invalid sync token")
+    return get_changes(db, user, since_time, limit)
 
-    total_tasks = len(tas)
-    completed_tasks_count = 0
-    for task in tas:
-        if task.status == "Completed":
-            completed_tasks_count += 1
-    
+# --- Task Routes ---
+BULK_TASK_ACTIONS = ["reassign", "relevel", "progress", "delete"]
+
+def apply_task_filters(query, filters: dict):
+    """Applies the admin/boss dashboard filters to a query over Task (full rows or Task.id only)."""
+    if filters.get("search"): query = query.filter(Task.title.contains(filters["search"]))
+    if filters.get("status"):
+        if filters["status"] == "Failed": query = query.filter(Task.end_date < date.today(), Task.status != 'Completed')
+        else: query = query.filter(Task.status == filters["status"])
+    if filters.get("level"): query = query.filter(Task.level == filters["level"])
+    if filters.get("man"): query = query.join(User, Task.assigned_to == User.id).filter(User.username.contains(filters["man"]))
+    if filters.get("proj"): query = query.join(Project, Task.project_id == Project.id).filter(Project.description.contains(filters["proj"]))
+    if filters.get("leader"): query = query.join(User, Task.leader_id == User.id).filter(User.username.contains(filters["leader"]))
+    if filters.get("type"): query = query.filter(Task.task_type == filters["type"])
+    # CORRECTED SECTION FILTER LOGIC
+    if filters.get("section"):
+        query = query.join(User, Task.assigned_to == User.id).filter(User.section == filters["section"])
+    return query
+
+def admin_dashboard_context(request: Request, user_id: int, filters: dict, include_archived: bool, db: Session, stream) -> dict:
+    """Context for the streamed admin/boss dashboard, loaded on the stream's own session."""
+    user = db.get(User, user_id)
+    my_tasks = get_user_tasks(db, user.id)
+    query = db.query(Task).options(joinedload(Task.project), joinedload(Task.user), joinedload(Task.admin), joinedload(Task.leader))
+    query = apply_task_filters(query.filter(task_visibility(user, managed_only=True)), filters)
+    context = {
+        "request": request, "user": user, "notifications": db.query(Notification).options(joinedload(Notification.task)).filter_by(user_id=user.id, is_read=0).order_by(Notification.created_at.desc()).all(),
+        "SECTIONS": SECTIONS, "TASK_LEVELS": TASK_LEVELS, "TASK_TYPES": TASK_TYPES, "PROJECT_STATUSES": PROJECT_STATUSES,
+        "total_tasks": len(my_tasks), "completed_tasks_count": sum(1 for task in my_tasks if task.status == "Completed"),
+        "my_tasks": my_tasks, "all_system_tasks": stream.rows(query, Task.id), "filters": filters, "include_archived": include_archived,
+        "pipeline_summary": get_pipeline_summary(db) if user.role == "boss" else None,
+    }
+    if include_archived:
+        context["archived_tasks"] = search_archived_tasks(db, filters["search"], visible_to=user)
+    return context
+
+@router.get("/dashboard")
+def dashboard(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user), search_filter: Optional[str] = Query(None), status_filter: Optional[str] = Query(None), level_filter: Optional[str] = Query(None), type_filter: Optional[str] = Query(None), section_filter: Optional[str] = Query(None), man_filter: Optional[str] = Query(None), leader_filter: Optional[str] = Query(None), project_filter: Optional[str] = Query(None), include_archived: bool = Query(False)):
+    if not user: return RedirectResponse("/login")
+    filters = {"search": search_filter, "status": status_filter, "level": level_filter, "type": type_filter, "section": section_filter, "man":man_filter , "leader":leader_filter , "proj":project_filter}
     if user.role in ['admin', 'boss']:
         today = date.today()
-        tasks_to_follow_up = db.query(Task).filter(Task.follow_up_date <= today, Task.status != 'Completed', Task.assigned_by == user.id).all()
-        for task in tasks_to_follow_up:
-            message = f"Follow up on task: '{task.title}' - {task.follow_up_message}"
-            create_notification(db, user_id=user.id, task_id=task.id, message=message)
-  
+        tasks_to_follow_up = db.query(Task.id, Task.title, Task.follow_up_message).filter(Task.follow_up_date <= today, Task.status != 'Completed', Task.assigned_by == user.id).all()
+        create_notifications(db, [
+            {"user_id": user.id, "task_id": task.id, "message": f"Follow up on task: '{task.title}' - {task.follow_up_message}"}
+            for task in tasks_to_follow_up
+        ])
+        # The system-wide task list can run to thousands of rows: stream it instead of rendering it in one piece.
+        return stream_template(stream_env, "dashboard_admin.html", partial(admin_dashboard_context, request, user.id, filters, include_archived))
+
+    total_tasks, completed_tasks_count = count_visible_tasks(db, user)
+
     notifications = get_unread_notifications(db, user.id)
     base_context = {"request": request, "user": user, "notifications": notifications, "SECTIONS": SECTIONS, "TASK_LEVELS": TASK_LEVELS, "TASK_TYPES": TASK_TYPES, "total_tasks": total_tasks, "completed_tasks_count": completed_tasks_count }
-    filters = {"search": search_filter, "status": status_filter, "level": level_filter, "type": type_filter, "section": section_filter, "man":man_filter , "leader":leader_filter , "proj":project_filter}
-
-    # --- Role-Based Logic ---
-    if user.role == "boss":
-        my_tasks = get_user_tasks(db, user.id)
-        query = db.query(Task).options(joinedload(Task.project))
-    elif user.role == "admin":
-        my_tasks = get_user_tasks(db, user.id)
-        query = db.query(Task).options(joinedload(Task.project)).filter(or_(Task.assigned_by == user.id, Task.leader_id == user.id))
-    else: # User role
-        my_tasks = get_user_tasks(db, user.id)
-        query = db.query(Task).filter(Task.assigned_to == user.id).options(joinedload(Task.project))
-    
-    # --- Apply Filters (for roles that see more than just their own tasks) ---
-    if user.role in ['admin', 'boss']:
-        if search_filter: query = query.filter(Task.title.contains(search_filter))
-        if status_filter:
-            if status_filter == "Failed": query = query.filter(Task.end_date < date.today(), Task.status != 'Completed')
-            else: query = query.filter(Task.status == status_filter)
-        if level_filter: query = query.filter(Task.level == level_filter)
-        if man_filter: query = query.join(User, Task.assigned_to == User.id).filter(User.username.contains(man_filter))
-        if project_filter: query = query.join(Project, Task.project_id == Project.id).filter(Project.description.contains(project_filter))
-        if leader_filter: query = query.join(User, Task.leader_id == User.id).filter(User.username.contains(leader_filter))
-        if type_filter: query = query.filter(Task.task_type == type_filter)
-        # CORRECTED SECTION FILTER LOGIC
-        if section_filter:
-            query = query.join(User, Task.assigned_to == User.id).filter(User.section == section_filter)
-        
-        all_system_tasks = query.order_by(Task.created_at.desc()).all()
-        all_users = get_all_users(db)
-        projects = get_all_projects(db) 
-        base_context.update({"my_tasks": my_tasks, "all_system_tasks": all_system_tasks, "users": all_users, "projects": projects, "filters": filters})
-        return templates.TemplateResponse("dashboard_admin.html", base_context)
-    else: # User role just gets their tasks
-        # Apply filters to the user's own task list
-        if search_filter: query = query.filter(Task.title.contains(search_filter))
-        if status_filter:
-            if status_filter == "Failed": query = query.filter(Task.end_date < date.today(), Task.status != 'Completed')
-            else: query = query.filter(Task.status == status_filter)
-        if level_filter: query = query.filter(Task.level == level_filter)
-        if type_filter: query = query.filter(Task.task_type == type_filter)
-
-        tasks = query.order_by(Task.created_at.desc()).all()
-        base_context.update({"tasks": tasks, "filters": filters})
-        return templates.TemplateResponse("dashboard_user.html", base_context)
-
-
-@app.get("/task/{task_id}")
+    if include_archived:
+        base_context["archived_tasks"] = search_archived_tasks(db, search_filter, visible_to=user)
+    base_context["include_archived"] = include_archived
+
+    # User role just gets their tasks
+    query = db.query(Task).filter(task_visibility(user)).options(joinedload(Task.project))
+    # Apply filters to the user's own task list
+    if search_filter: query = query.filter(Task.title.contains(search_filter))
+    if status_filter:
+        if status_filter == "Failed": query = query.filter(Task.end_date < date.today(), Task.status != 'Completed')
+        else: query = query.filter(Task.status == status_filter)
+    if level_filter: query = query.filter(Task.level == level_filter)
+    if type_filter: query = query.filter(Task.task_type == type_filter)
+
+    tasks = query.order_by(Task.created_at.desc()).all()
+    base_context.update({"tasks": tasks, "filters": filters})
+    return templates.TemplateResponse("dashboard_user.html", base_context)
+
+
+@router.get("/task/{task_id}")
 def task_detail_page(task_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user: return RedirectResponse("/login")
     
-    task = get_task_by_id(db, task_id)
+    # Someone else's task is indistinguishable from a missing one.
+    task = get_visible_task(db, user, task_id)
     if not task: raise HTTPException(404, "Task not found")
-    
-    can_view = False
-    if user.role == 'boss': can_view = True
-    elif user.role == 'admin' and (task.assigned_by == user.id or task.leader_id == user.id or task.assigned_to == user.id): can_view = True
-    elif user.role == 'user' and task.assigned_to == user.id: can_view = True
-    if not can_view: raise HTTPException(403, "You do not have permission to view this task.")
 
     all_users = get_all_users(db) if user.role in ['admin', 'boss'] else None
-    all_projects = get_all_projects(db) if user.role in ['admin', 'boss'] else None
-    return templates.TemplateResponse("task_detail.html", {"request": request, "user": user, "task": task, "users": all_users, "projects": all_projects, "TASK_LEVELS": TASK_LEVELS, "TASK_TYPES": TASK_TYPES})
+    context = {"request": request, "user": user, "task": task, "users": all_users, "TASK_LEVELS": TASK_LEVELS, "TASK_TYPES": TASK_TYPES}
+    if not task.is_archived and task.project_id:
+        context["predecessors"], context["successors"] = get_task_dependencies(db, task_id, visible_to=user)
+        if user.role in ['admin', 'boss']:
+            context["project_tasks"] = db.query(Task.id, Task.title).filter(Task.project_id == task.project_id, Task.id != task_id, task_visibility(user)).order_by(Task.id).all()
+    return templates.TemplateResponse("task_detail.html", context)
+
+def _editable_task(db: Session, task_id: int, user: User) -> Task:
+    if user.role not in ["admin", "boss"]: raise HTTPException(403, "Forbidden")
+    task = get_visible_task(db, user, task_id, include_archived=False)
+    if not task: raise HTTPException(404, "Task not found")
+    return task
 
-@app.post("/task/create")
+@router.post("/task/{task_id}/dependencies")
+def add_dependency(task_id: int, depends_on_id: int = Form(...), db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    if not user: return RedirectResponse("/login")
+    _editable_task(db, task_id, user)
+    if not get_visible_task(db, user, depends_on_id, include_archived=False): raise HTTPException(404, "Task not found")
+    try:
+        add_task_dependency(db, task_id, depends_on_id)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc))
+    return RedirectResponse(f"/task/{task_id}", status_code=status.HTTP_302_FOUND)
+
+@router.post("/task/{task_id}/dependencies/{depends_on_id}/delete")
+def remove_dependency(task_id: int, depends_on_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    if not user: return RedirectResponse("/login")
+    _editable_task(db, task_id, user)
+    if not get_visible_task(db, user, depends_on_id, include_archived=False): raise HTTPException(404, "Task not found")
+    remove_task_dependency(db, task_id, depends_on_id)
+    return RedirectResponse(f"/task/{task_id}", status_code=status.HTTP_302_FOUND)
+
+@router.post("/task/create")
 async def create_new_task(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if user.role not in ["admin", "boss"]: raise HTTPException(403, "Forbidden")
     form = await request.form()
@@ -276,10 +553,10 @@ async def create_new_task(request: Request, db: Session = Depends(get_db), user:
     create_task(db, task_data, user.id)
     return RedirectResponse("/dashboard", status_code=status.HTTP_302_FOUND)
 
-@app.post("/task/update/{task_id}")
+@router.post("/task/update/{task_id}")
 async def update_existing_task(task_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user: return RedirectResponse("/login")
-    
+    if not get_visible_task(db, user, task_id, include_archived=False): raise HTTPException(404, "Task not found")
     form = await request.form()
     updates = {}
     
@@ -303,14 +580,51 @@ async def update_existing_task(task_id: int, request: Request, db: Session = Dep
     update_task_fields(db, task_id, updates)
     return RedirectResponse(f"/task/{task_id}", status_code=status.HTTP_302_FOUND)
 
-@app.post("/task/delete/{task_id}")
+@router.post("/task/bulk")
+async def bulk_task_action(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    if not user: return RedirectResponse("/login")
+    form = await request.form()
+    action = form.get("action")
+    if action not in BULK_TASK_ACTIONS: raise HTTPException(400, "Unknown bulk action")
+    # Same role rules as the single-task routes: only admins and bosses may reassign, re-level or delete.
+    if action != "progress" and user.role not in ["admin", "boss"]: raise HTTPException(403, "Forbidden")
+
+    task_ids = db.query(Task.id).filter(task_visibility(user))
+    selected = [int(task_id) for task_id in form.getlist("task_ids[]") if task_id.isdigit()]
+    if selected: task_ids = task_ids.filter(Task.id.in_(selected))
+    elif form.get("apply_to_filter") and user.role in ["admin", "boss"]:
+        filters = {key: form.get(f"filter_{key}") for key in ["search", "status", "level", "type", "section", "man", "leader", "proj"]}
+        task_ids = apply_task_filters(task_ids, filters)
+    else: raise HTTPException(400, "No tasks selected")
+
+    updates = {}
+    if action == "reassign":
+        if not form.get("assigned_to", "").isdigit(): raise HTTPException(400, "assigned_to is required")
+        updates["assigned_to"] = int(form.get("assigned_to"))
+        if form.get("leader_id"): updates["leader_id"] = int(form.get("leader_id")) if form.get("leader_id").isdigit() else None
+    elif action == "relevel":
+        if form.get("level"): updates["level"] = form.get("level")
+        if form.get("task_type"): updates["task_type"] = form.get("task_type")
+    elif action == "progress":
+        if not form.get("success_percent"): raise HTTPException(400, "success_percent is required")
+        updates["success_percent"] = float(form.get("success_percent"))
+    back = "/dashboard" if action == "delete" else local_path(request.headers.get("referer"), "/dashboard")
+    if action != "delete" and not updates: return RedirectResponse(back, status_code=status.HTTP_302_FOUND)
+    # Resolve the selection now, with this user's scope, and leave the writes to a background job.
+    ids = [row[0] for row in task_ids.all()]
+    if not ids: return RedirectResponse(back, status_code=status.HTTP_302_FOUND)
+    job = enqueue_job(db, "bulk_tasks", {"action": action, "task_ids": ids, "updates": updates}, user.id)
+    return RedirectResponse(f"/jobs/{job.id}?next={quote(back)}", status_code=status.HTTP_302_FOUND)
+
+@router.post("/task/delete/{task_id}")
 def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if user.role not in ["admin", "boss"]: raise HTTPException(403, "Forbidden")
+    _editable_task(db, task_id, user)
     delete_task(db, task_id)
     return RedirectResponse("/dashboard", status_code=status.HTTP_302_FOUND)
 
 # # --- Customer List with Filters ---
-# @app.get("/customers")
+# @router.get("/customers")
 # def customers_list(
 #     request: Request,
 #     db: Session = Depends(get_db),
@@ -340,7 +654,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #     })
 
 # # --- New Customer Form ---
-# @app.get("/customers/new")
+# @router.get("/customers/new")
 # def new_customer_form(request: Request, user: User = Depends(get_current_user)):
 #     if not user or user.role != "boss":
 #         return RedirectResponse("/login")
@@ -353,7 +667,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #     })
 
 # # --- Create Customer POST Handler ---
-# @app.post("/customers/new")
+# @router.post("/customers/new")
 # async def create_new_customer(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
 #     if not user or user.role != "boss":
 #         return RedirectResponse("/login")
@@ -377,7 +691,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #     return RedirectResponse("/customers", status_code=status.HTTP_302_FOUND)
 
 # # --- Customer Detail & Edit Form ---
-# @app.get("/customer/{customer_id}")
+# @router.get("/customer/{customer_id}")
 # def customer_detail(customer_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
 #     if not user or user.role != "boss":
 #         return RedirectResponse("/login")
@@ -398,7 +712,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #     })
 
 # # --- Update Customer POST ---
-# @app.post("/customer/{customer_id}")
+# @router.post("/customer/{customer_id}")
 # async def update_existing_customer(customer_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
 #     if not user or user.role != "boss":
 #         return RedirectResponse("/login")
@@ -422,7 +736,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #     return RedirectResponse(f"/customer/{customer_id}", status_code=status.HTTP_302_FOUND)
 
 # # --- Delete Customer ---
-# @app.post("/customer/delete/{customer_id}")
+# @router.post("/customer/delete/{customer_id}")
 # def delete_existing_customer(customer_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
 #     if not user or user.role != "boss":
 #         raise HTTPException(403, "Forbidden")
@@ -432,7 +746,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 # # --- Customer Units Handling ---
 
 # # Add new unit for customer
-# @app.post("/customer/{customer_id}/unit/new")
+# @router.post("/customer/{customer_id}/unit/new")
 # async def create_new_customer_unit(customer_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
 #     if not user or user.role != "boss":
 #         return RedirectResponse("/login")
@@ -447,7 +761,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #     return RedirectResponse(f"/customer/{customer_id}", status_code=status.HTTP_302_FOUND)
 
 # # Update existing unit
-# @app.post("/customer/unit/{unit_id}/update")
+# @router.post("/customer/unit/{unit_id}/update")
 # async def update_customer_unit_route(unit_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
 #     if not user or user.role != "boss":
 #         return RedirectResponse("/login")
@@ -467,7 +781,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #     return RedirectResponse(f"/customer/{unit.customer_id}", status_code=status.HTTP_302_FOUND)
 
 # # Delete unit
-# @app.post("/customer/unit/{unit_id}/delete")
+# @router.post("/customer/unit/{unit_id}/delete")
 # def delete_customer_unit_route(unit_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
 #     if not user or user.role != "boss":
 #         raise HTTPException(403, "Forbidden")
@@ -479,7 +793,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #     return RedirectResponse(f"/customer/{customer_id}", status_code=status.HTTP_302_FOUND)
 
 # # Add expert to unit
-# @app.post("/customer/unit/{unit_id}/expert/add")
+# @router.post("/customer/unit/{unit_id}/expert/add")
 # async def add_expert(unit_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
 #     if not user or user.role != "boss":
 #         raise HTTPException(403, "Forbidden")
@@ -493,7 +807,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #     return RedirectResponse(f"/customer/{unit.customer_id}", status_code=status.HTTP_302_FOUND)
 
 # # Remove expert from unit
-# @app.post("/customer/unit/expert/{expert_id}/remove")
+# @router.post("/customer/unit/expert/{expert_id}/remove")
 # def remove_expert_route(expert_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
 #     if not user or user.role != "boss":
 #         raise HTTPException(403, "Forbidden")
@@ -507,7 +821,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #     return RedirectResponse("/customers", status_code=status.HTTP_302_FOUND)
 
 # # --- Customer Org Chart Route (placeholder) ---
-# @app.get("/customer/{customer_id}/org-chart")
+# @router.get("/customer/{customer_id}/org-chart")
 # def customer_org_chart(customer_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
 #     if not user or user.role != "boss":
 #         return RedirectResponse("/login")
@@ -524,7 +838,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #         "units": units,
 #     })
 
-# @app.get("/customer/{customer_id}/edit")
+# @router.get("/customer/{customer_id}/edit")
 # async def edit_customer_form(customer_id: int, request: Request, db: Session = Depends(get_db)):
 #     customer = db.query(Customer).filter(Customer.id == customer_id).first()
 #     if not customer:
@@ -536,7 +850,7 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #         "REGISTRATION_STATUSES": REGISTRATION_STATUSES,
 #     })
 
-# @app.post("/customer/{customer_id}/edit")
+# @router.post("/customer/{customer_id}/edit")
 # async def update_customer(customer_id: int, request: Request, db: Session = Depends(get_db)):
 #     form = await request.form()
 #     form = dict(form)
@@ -613,23 +927,25 @@ def remove_task(task_id: int, db: Session = Depends(get_db), user: User = Depend
 #     return RedirectResponse(url=f"/customer/{customer_id}", status_code=303)
 
 # --- Customers Routes ---
-@app.get("/customers")
+@router.get("/customers")
 def Customers_list(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user), search: str = Query(None), product_type: str = Query(None),registration_status: str = Query(None)):
     if not user: return RedirectResponse("/login")
     if user.role not in ['boss'] :
         raise HTTPException(403, "You do not have permission.")
-    filters = {"search": search,"product_type": product_type,"registration_status": registration_status}
-    customers = get_all_customers(db, filters=filters)
-    return templates.TemplateResponse("customer_list.html", {"request": request,"user": user,"customers": customers,"filters": filters,"PRODUCT_TYPES": PRODUCT_TYPES,"REGISTRATION_STATUSES": REGISTRATION_STATUSES})
+    filters = dict(normalize_filters({"search": search,"product_type": product_type,"registration_status": registration_status}))
+    def build():
+        return {"customers": get_all_customers(db, filters=filters),"filters": filters,"PRODUCT_TYPES": PRODUCT_TYPES,"REGISTRATION_STATUSES": REGISTRATION_STATUSES}
+    content = render_cached_content(db, "/customers", user.role, filters, ("customers",), "_customer_list_content.html", build)
+    return templates.TemplateResponse("customer_list.html", {"request": request,"user": user,"content": content})
 
-@app.get("/customer/new")
+@router.get("/customer/new")
 def new_customer_form(request: Request, user: User = Depends(get_current_user)):
     if not user: return RedirectResponse("/login")
     if user.role not in ['boss'] :
         raise HTTPException(403, "You do not have permission.")
     return templates.TemplateResponse("customer_form.html", {"request": request,"customer": None,"PRODUCT_TYPES": PRODUCT_TYPES,"REGISTRATION_STATUSES": REGISTRATION_STATUSES})
 
-@app.post("/customer/new")
+@router.post("/customer/new")
 async def create_new_customer(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user: return RedirectResponse("/login")
     form = await request.form()
@@ -670,21 +986,22 @@ async def create_new_customer(request: Request, db: Session = Depends(get_db), u
         create_customer_unit(db, new_customer.id, unit_data)  # از آیدی مشتری تازه ایجاد شده استفاده کنید
     return RedirectResponse("/customers", status_code=status.HTTP_302_FOUND)
 
-@app.get("/customer/{customer_id}")
+@router.get("/customer/{customer_id}")
 def customer_detail(customer_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user: return RedirectResponse("/login")
     if user.role not in ['boss'] :
         raise HTTPException(403, "You do not have permission.")
-    customer = get_customer_by_id(db, customer_id)
+    customer = get_customer_by_id(db, customer_id, with_projects=True)
     all_users = get_all_users(db)
     if not customer: raise HTTPException(404, "customer not found")
     return templates.TemplateResponse("customer_detail.html", {"request": request,"user": user,"customer": customer,"all_users": all_users,"PRODUCT_TYPES": PRODUCT_TYPES,"REGISTRATION_STATUSES": REGISTRATION_STATUSES})
 
-@app.post("/customer/{customer_id}")
+@router.post("/customer/{customer_id}")
 async def update_existing_customer(customer_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user: return RedirectResponse("/login")
     if user.role not in ['boss'] :
         raise HTTPException(403, "You do not have permission.")
+    if not get_customer_by_id(db, customer_id): raise HTTPException(404, "Customer not found")
     form = await request.form()
     data = {
         "name": form.get("name"),
@@ -717,14 +1034,12 @@ async def update_existing_customer(customer_id: int, request: Request, db: Sessi
             "worker_names": [name.strip() for name in worker_names_list[i].split(",") if name.strip()]
         })
 
-    update_customer(db, customer_id, data)
-    delete_all_units_for_customer(db, customer_id)
-    for unit_data in units_data:
-        create_customer_unit(db, customer_id, unit_data)
-
-    return RedirectResponse(f"/customer/{customer_id}", status_code=status.HTTP_302_FOUND)
+    # Job payloads are stored as plain JSON and kept for days, so the portal password is saved here, not by the job.
+    update_customer(db, customer_id, {"portal_password": data.pop("portal_password")})
+    job = enqueue_job(db, "save_customer", {"customer_id": customer_id, "data": data, "units": units_data}, user.id)
+    return RedirectResponse(f"/jobs/{job.id}?next={quote(f'/customer/{customer_id}')}", status_code=status.HTTP_302_FOUND)
 
-@app.post("/customer/{customer_id}/delete")
+@router.post("/customer/{customer_id}/delete")
 async def delete_customer_route(customer_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     if not user:
         return RedirectResponse("/login")
@@ -734,7 +1049,7 @@ async def delete_customer_route(customer_id: int, user: User = Depends(get_curre
     return RedirectResponse("/customers", status_code=status.HTTP_302_FOUND)
 
 
-@app.get("/customer/{customer_id}/edit")
+@router.get("/customer/{customer_id}/edit")
 def edit_customer_form(customer_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     if not user:
         return RedirectResponse("/login")
@@ -758,53 +1073,58 @@ def edit_customer_form(customer_id: int, request: Request, db: Session = Depends
         }
     )
 
-@app.post("/customer/{customer_id}")
-async def update_existing_customer(customer_id: int, request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    if not user:
-        return RedirectResponse("/login")
-    if user.role not in ['boss']:
-        raise HTTPException(403, "You do not have permission.")
-
-    form = await request.form()
-
-    data = {
-        "name": form.get("name"),
-        "short_name": form.get("short_name"),
-        "product_type": form.get("product_type"),
-        "other_product_description": form.get("other_product_description") if form.get("product_type") == "سایر" else None,
-        "product_description": form.get("product_description"),
-        "website_url": form.get("website_url"),
-        "registration_status": form.get("registration_status"),
-        "portal_username": form.get("portal_username"),
-        "portal_password": form.get("portal_password"),
-        "last_action_description": form.get("last_action_description"),
-        "inquiry_portal": form.get("inquiry_portal"),
-        "address1": form.get("address1"),
-        "address2": form.get("address2")
-    }
 
-    # Collect units data
-    units_data = []
-    unit_numbers = form.getlist("unit_number[]")
-    boss_names = form.getlist("boss_name[]")
-    admin_names = form.getlist("admin_name[]")
-    watcher_names = form.getlist("watcher_name[]")
-    worker_names_list = form.getlist("worker_names[]")
-
-    for i in range(len(unit_numbers)):
-        units_data.append({
-            "unit_number": unit_numbers[i],
-            "boss_name": boss_names[i],
-            "admin_name": admin_names[i],
-            "watcher_name": watcher_names[i],
-            "worker_names": [name.strip() for name in worker_names_list[i].split(",") if name.strip()]
-        })
-
-    update_customer(db, customer_id, data)
-
-    # Delete all previous units and add new ones
-    delete_all_units_for_customer(db, customer_id)
-    for unit_data in units_data:
-        create_customer_unit(db, customer_id, unit_data)
-
-    return RedirectResponse(f"/customer/{customer_id}", status_code=status.HTTP_302_FOUND)
+# --- Application Factory ---
+def warm_caches(app: FastAPI):
+    app.state.asset_manifest.load()
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.get_template(name)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = app.state.settings
+    database.init_engine(
+        settings.database_url, replica_url=settings.replica_database_url,
+        pool_size=settings.pool_size, max_overflow=settings.max_overflow, pool_pre_ping=settings.pool_pre_ping,
+        pool_recycle=settings.pool_recycle, pool_timeout=settings.pool_timeout,
+        track_connections=settings.debug_connections, connection_leak_seconds=settings.connection_leak_seconds,
+    )
+    missing_tables = database.ensure_schema(create=settings.create_schema)
+    run_migrations(database.engine)
+    if ProjectStatusSummary.__tablename__ in missing_tables: reconcile_pipeline_summary_job()
+    if settings.warm_caches: warm_caches(app)
+    refresh_autocomplete_job()
+    activity_writer.start()
+    if settings.jobs_enabled:
+        requeue_stale_jobs_job()
+        job_workers.concurrency, job_workers.poll_interval = settings.job_workers, settings.job_poll_interval
+        job_workers.start()
+    if settings.scheduler_enabled: app.state.scheduler.start()
+    try:
+        yield
+    finally:
+        await app.state.scheduler.stop()
+        await job_workers.stop()
+        activity_writer.stop()
+        database.dispose_engine()
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    settings = settings or get_settings()
+    app = FastAPI(lifespan=lifespan)
+    app.state.settings = settings
+    app.state.scheduler = Scheduler()
+    register_maintenance_jobs(app.state.scheduler, settings)
+    if BrotliMiddleware: app.add_middleware(BrotliMiddleware, minimum_size=settings.compression_minimum_size, gzip_fallback=True)
+    else: app.add_middleware(GZipMiddleware, minimum_size=settings.compression_minimum_size)
+    if settings.profiling_enabled: app.add_middleware(ProfilingMiddleware)
+    if settings.admission_enabled:
+        app.add_middleware(AdmissionControlMiddleware, limits=settings.admission_limits, per_user=settings.admission_per_user,
+                           queue_timeout=settings.admission_queue_timeout, retry_after=settings.admission_retry_after)
+    app.state.asset_manifest = AssetManifest(settings.static_dir)
+    app.mount("/static", FingerprintedStaticFiles(directory=settings.static_dir, manifest=app.state.asset_manifest), name="static")
+    templates.env.globals["static_url"] = static_url_helper(app.state.asset_manifest)
+    page_cache.max_bytes = settings.page_cache_max_bytes
+    app.include_router(router)
+    return app
+
+app = create_app()
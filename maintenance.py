@@ -0,0 +1,70 @@
+"""Scheduled maintenance jobs. Each job opens its own session, since it runs outside any request."""
+from datetime import time, timedelta
+from functools import partial
+from database import session_scope
+from models import reconcile_pipeline_summary
+from analytics import CACHE_TTL_SECONDS, refresh_workload_reports
+from archive import archive_completed_tasks, archive_read_notifications
+from search_index import refresh_indexes
+from connection_monitor import connection_monitor
+from jobs import requeue_stale_jobs, prune_finished_jobs
+from backup import backup_database
+from digest import send_daily_digests
+
+AUTOCOMPLETE_REFRESH_SECONDS = 60
+
+
+def reconcile_pipeline_summary_job():
+    with session_scope() as db:
+        return reconcile_pipeline_summary(db)
+
+
+def refresh_workload_reports_job():
+    with session_scope() as db:
+        refresh_workload_reports(db)
+
+
+def refresh_autocomplete_job():
+    with session_scope() as db:
+        refresh_indexes(db)
+
+
+def requeue_stale_jobs_job():
+    with session_scope() as db:
+        return requeue_stale_jobs(db)
+
+
+def prune_jobs_job(settings):
+    with session_scope() as db:
+        return prune_finished_jobs(db, settings.job_retention_days)
+
+
+def archive_job(settings):
+    with session_scope() as db:
+        tasks = archive_completed_tasks(db, settings.archive_task_age_days, settings.archive_batch_size)
+        notifications = archive_read_notifications(db, settings.archive_notification_age_days, settings.archive_batch_size)
+        return tasks, notifications
+
+
+def backup_job(settings):
+    return backup_database(settings.database_url, settings.backup_dir, keep=settings.backup_keep,
+                           compress=settings.backup_compress, method=settings.backup_method)
+
+
+def digest_job(settings):
+    return send_daily_digests(settings)
+
+
+def register_maintenance_jobs(scheduler, settings):
+    scheduler.add_job("reconcile_pipeline_summary", reconcile_pipeline_summary_job, at=time(2, 0))
+    scheduler.add_job("archive", partial(archive_job, settings), at=time(3, 0))
+    scheduler.add_job("refresh_workload_reports", refresh_workload_reports_job, interval=timedelta(seconds=CACHE_TTL_SECONDS // 2))
+    scheduler.add_job("refresh_autocomplete", refresh_autocomplete_job, interval=timedelta(seconds=AUTOCOMPLETE_REFRESH_SECONDS))
+    scheduler.add_job("requeue_stale_jobs", requeue_stale_jobs_job, interval=timedelta(minutes=5))
+    scheduler.add_job("prune_jobs", partial(prune_jobs_job, settings), at=time(3, 30))
+    if settings.backup_dir:
+        scheduler.add_job("backup", partial(backup_job, settings), at=time(1, 0))
+    if settings.smtp_host:
+        scheduler.add_job("daily_digest", partial(digest_job, settings), at=time(settings.digest_hour, 0))
+    if settings.debug_connections:
+        scheduler.add_job("report_connection_leaks", connection_monitor.report_leaks, interval=timedelta(seconds=settings.connection_leak_seconds))
@@ -0,0 +1,30 @@
+"""In-process counters and gauges, exposed to bosses at /debug/metrics."""
+import threading
+
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._values[_key(name, labels)] = value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(sorted(self._values.items()))
+
+
+metrics = Metrics()
@@ -0,0 +1,189 @@
+"""Lightweight schema migrations for existing databases.
+
+create_all() only creates missing tables, so column and index changes to existing tables are applied here.
+Each migration runs once, in order, and must be idempotent: on a fresh database create_all() has already
+built the current schema and the migration only records itself.
+"""
+from datetime import datetime
+from sqlalchemy import Column, String, DateTime, inspect, text
+from sqlalchemy.schema import CreateTable
+from database import Base
+from models import Notification, Project, Task, ArchivedTask, ArchivedNotification, Customer, TaskDependency, User
+
+MIGRATIONS = []
+
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+    name = Column(String, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+
+def migration(func):
+    MIGRATIONS.append(func)
+    return func
+
+
+def add_column(conn, table: str, column: str, ddl_type: str):
+    if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def rebuild_with_autoincrement(conn, table, floor_table=None):
+    """Recreates a SQLite table from its model so the primary key gets AUTOINCREMENT (SQLite can't add it in place),
+    keeping every row and index, and starts the id sequence above floor_table's largest id as well."""
+    if conn.dialect.name != "sqlite": return
+    sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}).scalar()
+    if "AUTOINCREMENT" not in sql.upper():
+        existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+        columns = ", ".join(column.name for column in table.columns if column.name in existing)
+        ddl = str(CreateTable(table).compile(dialect=conn.dialect)).replace(f"TABLE {table.name} (", f"TABLE {table.name}__rebuild (", 1)
+        conn.execute(text(ddl))
+        conn.execute(text(f"INSERT INTO {table.name}__rebuild ({columns}) SELECT {columns} FROM {table.name}"))
+        conn.execute(text(f"DROP TABLE {table.name}"))
+        conn.execute(text(f"ALTER TABLE {table.name}__rebuild RENAME TO {table.name}"))
+        for index in table.indexes:
+            index.create(conn)
+    sources = [table.name] + ([floor_table.name] if floor_table is not None else [])
+    floor = max(conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {name}")).scalar() for name in sources)
+    current = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = :name"), {"name": table.name}).scalar()
+    if current is None or current < floor:
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": table.name})
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"), {"name": table.name, "seq": floor})
+
+
+def renumber_reused_ids(conn, table: str, archive_table: str, references=()):
+    """Moves live rows whose id an archived row already holds to fresh ids, updating the (table, column) references."""
+    clashes = [row[0] for row in conn.execute(text(f"SELECT id FROM {table} WHERE id IN (SELECT id FROM {archive_table}) ORDER BY id"))]
+    if not clashes: return
+    next_id = max(conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {name}")).scalar() for name in (table, archive_table))
+    for old_id in clashes:
+        next_id += 1
+        conn.execute(text(f"UPDATE {table} SET id = :new WHERE id = :old"), {"new": next_id, "old": old_id})
+        for ref_table, ref_column in references:
+            conn.execute(text(f"UPDATE {ref_table} SET {ref_column} = :new WHERE {ref_column} = :old"), {"new": next_id, "old": old_id})
+
+
+def run_migrations(engine):
+    applied_now = []
+    with engine.begin() as conn:
+        applied = {row[0] for row in conn.execute(text("SELECT name FROM schema_migrations"))}
+        for func in MIGRATIONS:
+            if func.__name__ in applied: continue
+            func(conn)
+            conn.execute(SchemaMigration.__table__.insert().values(name=func.__name__, applied_at=datetime.utcnow()))
+            applied_now.append(func.__name__)
+    return applied_now
+
+
+# --- Migrations ---
+
+@migration
+def add_task_completed_at(conn):
+    add_column(conn, "tasks", "completed_at", "DATETIME")
+
+
+@migration
+def add_unread_notification_unique_index(conn):
+    # Drop duplicate unread rows left by the old check-then-insert, keeping the oldest, before the index can be built.
+    conn.execute(text(
+        "DELETE FROM notifications WHERE is_read = 0 AND id NOT IN ("
+        "SELECT MIN(id) FROM notifications WHERE is_read = 0 GROUP BY user_id, task_id)"
+    ))
+    for index in Notification.__table__.indexes:
+        if index.name == "uq_notifications_unread_user_task":
+            index.create(conn, checkfirst=True)
+
+
+@migration
+def add_updated_at_columns(conn):
+    for model in (Project, Task, Customer):
+        table = model.__table__
+        add_column(conn, table.name, "updated_at", "DATETIME")
+        conn.execute(text(f"UPDATE {table.name} SET updated_at = created_at WHERE updated_at IS NULL"))
+        for index in table.indexes:
+            if "updated_at" in index.columns:
+                index.create(conn, checkfirst=True)
+
+
+@migration
+def add_project_customer_id(conn):
+    add_column(conn, "projects", "customer_id", "INTEGER REFERENCES customers(id)")
+    # Backfill from the free-text name, falling back to short_name; if several customers match, the oldest wins.
+    conn.execute(text(
+        "UPDATE projects SET customer_id = COALESCE("
+        "(SELECT MIN(c.id) FROM customers c WHERE TRIM(c.name) = TRIM(projects.customer)), "
+        "(SELECT MIN(c.id) FROM customers c WHERE TRIM(c.short_name) = TRIM(projects.customer))) "
+        "WHERE customer_id IS NULL AND customer IS NOT NULL"
+    ))
+    for index in Project.__table__.indexes:
+        if "customer_id" in index.columns:
+            index.create(conn, checkfirst=True)
+
+
+@migration
+def add_task_project_id_index(conn):
+    for index in Task.__table__.indexes:
+        if "project_id" in index.columns:
+            index.create(conn, checkfirst=True)
+
+
+@migration
+def add_calendar_date_indexes(conn):
+    date_columns = {"delivery_date", "shipment_date", "invoice_date", "payment_date", "start_date", "end_date", "follow_up_date"}
+    for table in (Project.__table__, Task.__table__):
+        for index in table.indexes:
+            if date_columns.intersection(index.columns.keys()):
+                index.create(conn, checkfirst=True)
+
+
+@migration
+def add_user_calendar_token(conn):
+    add_column(conn, "users", "calendar_token", "VARCHAR")
+    for index in User.__table__.indexes:
+        if "calendar_token" in index.columns:
+            index.create(conn, checkfirst=True)
+
+
+@migration
+def add_user_digest_columns(conn):
+    add_column(conn, "users", "email", "VARCHAR")
+    add_column(conn, "users", "digest_sent_on", "DATE")
+
+
+@migration
+def add_task_visibility_indexes(conn):
+    for table in (Task.__table__, ArchivedTask.__table__):
+        for index in table.indexes:
+            if {"assigned_to", "assigned_by", "leader_id"}.intersection(index.columns.keys()):
+                index.create(conn, checkfirst=True)
+
+
+@migration
+def use_autoincrement_ids(conn):
+    # Without AUTOINCREMENT SQLite reused the ids of archived tasks and notifications, hiding the archived row
+    # behind the new one and failing every later archive run on the duplicate id. Rows that already took an
+    # archived id move to a fresh one first; their activity log can't be told apart from the archived row's and stays.
+    renumber_reused_ids(conn, "notifications", "notifications_archive")
+    renumber_reused_ids(conn, "tasks", "tasks_archive", [("notifications", "task_id"), ("task_dependencies", "task_id"), ("task_dependencies", "depends_on_id")])
+    rebuild_with_autoincrement(conn, Task.__table__, ArchivedTask.__table__)
+    rebuild_with_autoincrement(conn, Notification.__table__, ArchivedNotification.__table__)
+
+
+@migration
+def add_sync_tombstone_scope(conn):
+    for column in ("assigned_to", "assigned_by", "leader_id"):
+        add_column(conn, "sync_tombstones", column, "INTEGER")
+
+
+@migration
+def use_autoincrement_dependency_ids(conn):
+    # A reused edge id left scheduling.py's cache stamp unchanged after removing one edge and adding another.
+    rebuild_with_autoincrement(conn, TaskDependency.__table__)
+
+
+@migration
+def drop_pipeline_summary_overdue_count(conn):
+    # Overdue counts drifted as days passed; get_pipeline_summary() now counts them when reading.
+    if "overdue_count" in {c["name"] for c in inspect(conn).get_columns("project_status_summary")}:
+        conn.execute(text("ALTER TABLE project_status_summary DROP COLUMN overdue_count"))
@@ -1,9 +1,9 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Float, Date
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Float, Date, Index, func, case, or_, text, select, insert, literal, true
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import relationship, Session, joinedload
 from datetime import datetime, date
-from database import Base
+from database import Base, read_only
 from passlib.hash import bcrypt
-from sqlmodel import SQLModel, Field
 from typing import Optional
 
 
@@ -15,6 +15,9 @@ class User(Base):
     password = Column(String)
     role = Column(String)
     section = Column(String, nullable=True) 
+    calendar_token = Column(String, nullable=True, unique=True, index=True)  # secret part of the user's iCalendar feed URL
+    email = Column(String, nullable=True)  # daily digest address; no digest when empty
+    digest_sent_on = Column(Date, nullable=True)
 
 # --- Project Model ---
 class Project(Base):
@@ -24,7 +27,7 @@ class Project(Base):
     customer = Column(String, index=True)
     request_number = Column(String, nullable=True)
     notification_date = Column(Date, nullable=True)
-    delivery_date = Column(Date, nullable=True)
+    delivery_date = Column(Date, nullable=True, index=True)
     description = Column(Text, nullable=False)
     weight_kg = Column(Float, nullable=True)
     expert = Column(String, nullable=True)
@@ -34,15 +37,29 @@ class Project(Base):
     purchasing_status = Column(String, nullable=True)
     production_status = Column(String, nullable=True)
     inspection_status = Column(String, nullable=True)
-    shipment_date = Column(Date, nullable=True)
-    invoice_date = Column(Date, nullable=True)
+    shipment_date = Column(Date, nullable=True, index=True)
+    invoice_date = Column(Date, nullable=True, index=True)
     payment_amount = Column(Float, nullable=True)
-    payment_date = Column(Date, nullable=True)
+    payment_date = Column(Date, nullable=True, index=True)
     status = Column(String, nullable=False, index=True)
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    customer_id = Column(Integer, ForeignKey('customers.id'), nullable=True, index=True)  # `customer` keeps the name for display
+
     tasks = relationship("Task", back_populates="project")
+    customer_record = relationship("Customer", back_populates="projects")
+
+# --- Project Pipeline Summary Model ---
+# One row per project status, kept in step with the projects table by create/update/delete_project.
+# Overdue counts depend on today's date, so they are not stored here; get_pipeline_summary() counts them on read.
+class ProjectStatusSummary(Base):
+    __tablename__ = 'project_status_summary'
+    status = Column(String, primary_key=True)
+    project_count = Column(Integer, nullable=False, default=0)
+    total_weight_kg = Column(Float, nullable=False, default=0.0)
+    total_payment_amount = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 # --- Task Model ---
 class Task(Base):
@@ -54,10 +71,10 @@ class Task(Base):
     level = Column(String, default='Normal')
     
     # Relationships
-    assigned_to = Column(Integer, ForeignKey('users.id'))
-    assigned_by = Column(Integer, ForeignKey('users.id'))
-    leader_id = Column(Integer, ForeignKey('users.id'), nullable=True)
-    project_id = Column(Integer, ForeignKey('projects.id'), nullable=True)
+    assigned_to = Column(Integer, ForeignKey('users.id'), index=True)
+    assigned_by = Column(Integer, ForeignKey('users.id'), index=True)
+    leader_id = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)
+    project_id = Column(Integer, ForeignKey('projects.id'), nullable=True, index=True)
     
     user = relationship("User", foreign_keys=[assigned_to], backref="assigned_tasks")
     admin = relationship("User", foreign_keys=[assigned_by])
@@ -66,16 +83,23 @@ class Task(Base):
 
     status = Column(String, default='To Do', nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
-    start_date = Column(Date, nullable=True)
-    end_date = Column(Date, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    completed_at = Column(DateTime, nullable=True)
+    start_date = Column(Date, nullable=True, index=True)
+    end_date = Column(Date, nullable=True, index=True)
     
-    follow_up_date = Column(Date, nullable=True)
+    follow_up_date = Column(Date, nullable=True, index=True)
     follow_up_message = Column(Text, nullable=True)
     
     success_percent = Column(Float, default=0.0)
     admin_comment = Column(Text, nullable=True)
     user_comment = Column(Text, nullable=True)
 
+    # AUTOINCREMENT: SQLite must never hand out an id again once archive.py has moved its task to tasks_archive.
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    is_archived = False
+
     @property
     def is_failed(self):
         return self.end_date and self.end_date < date.today() and self.status != 'Completed'
@@ -93,6 +117,148 @@ class Notification(Base):
     user = relationship("User", backref="notifications")
     task = relationship("Task")
 
+    # At most one unread notification per (user, task); lets create_notifications insert without checking first.
+    # AUTOINCREMENT for the same reason as tasks: archived notifications keep their ids.
+    __table_args__ = (
+        Index('uq_notifications_unread_user_task', 'user_id', 'task_id', unique=True,
+              sqlite_where=text('is_read = 0'), postgresql_where=text('is_read = 0')),
+        {'sqlite_autoincrement': True},
+    )
+
+# --- Archive Models ---
+# Completed tasks and read notifications are moved here by archive.py so the live tables stay small.
+# Columns mirror Task/Notification; archived rows keep their original ids, which the live tables never reuse.
+class ArchivedTask(Base):
+    __tablename__ = 'tasks_archive'
+    id = Column(Integer, primary_key=True)
+    title = Column(String, index=True)
+    description = Column(Text)
+    task_type = Column(String)
+    level = Column(String)
+    assigned_to = Column(Integer, ForeignKey('users.id'), index=True)
+    assigned_by = Column(Integer, ForeignKey('users.id'), index=True)
+    leader_id = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)
+    project_id = Column(Integer, ForeignKey('projects.id'), nullable=True)
+    status = Column(String, nullable=False)
+    created_at = Column(DateTime)
+    completed_at = Column(DateTime, nullable=True)
+    start_date = Column(Date, nullable=True)
+    end_date = Column(Date, nullable=True)
+    follow_up_date = Column(Date, nullable=True)
+    follow_up_message = Column(Text, nullable=True)
+    success_percent = Column(Float, default=0.0)
+    admin_comment = Column(Text, nullable=True)
+    user_comment = Column(Text, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+    user = relationship("User", foreign_keys=[assigned_to], viewonly=True)
+    admin = relationship("User", foreign_keys=[assigned_by], viewonly=True)
+    leader = relationship("User", foreign_keys=[leader_id], viewonly=True)
+    project = relationship("Project", viewonly=True)
+
+    is_archived = True
+    is_failed = False  # only Completed tasks are archived
+
+class ArchivedNotification(Base):
+    __tablename__ = 'notifications_archive'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    task_id = Column(Integer, nullable=False)
+    message = Column(Text, nullable=False)
+    is_read = Column(Integer, default=0)
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+# --- Activity Log Model ---
+# Append-only field-level change history, written in batches by audit.ActivityLogWriter.
+class ActivityLog(Base):
+    __tablename__ = 'activity_log'
+    id = Column(Integer, primary_key=True)
+    entity_type = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String, nullable=False)  # create / update / delete
+    changes = Column(Text, nullable=True)    # JSON: {field: [old, new]}
+    user_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index('ix_activity_log_entity', 'entity_type', 'entity_id', 'created_at'),)
+
+# --- Task Dependency Model ---
+# task_id cannot start before depends_on_id is finished. Both tasks belong to project_id (kept here so a
+# project's edges load with one indexed query); scheduling.py builds the critical path from these edges.
+class TaskDependency(Base):
+    __tablename__ = 'task_dependencies'
+    id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, ForeignKey('projects.id'), nullable=False, index=True)
+    task_id = Column(Integer, ForeignKey('tasks.id'), nullable=False)
+    depends_on_id = Column(Integer, ForeignKey('tasks.id'), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # AUTOINCREMENT keeps edge ids rising, so scheduling.py's (edge count, max edge id) stamp changes on every add.
+    __table_args__ = (Index('uq_task_dependencies_edge', 'task_id', 'depends_on_id', unique=True), {'sqlite_autoincrement': True})
+
+# --- Background Job Model ---
+# Durable queue for work moved out of request handlers; claimed and run by jobs.JobWorkerPool.
+class BackgroundJob(Base):
+    __tablename__ = 'jobs'
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    payload = Column(Text, nullable=True)  # JSON
+    status = Column(String, nullable=False, default='queued')  # queued / running / succeeded / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    progress = Column(Integer, nullable=False, default=0)  # percent
+    progress_message = Column(String, nullable=True)
+    result = Column(Text, nullable=True)  # JSON
+    error = Column(Text, nullable=True)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime, nullable=True)
+    created_by = Column(Integer, ForeignKey('users.id'), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (Index('ix_jobs_status_run_after', 'status', 'run_after'),)
+
+# --- Request Profile Model ---
+# Reports captured by profiling.ProfilingMiddleware for boss requests that ask for a profile; the newest
+# PROFILE_KEEP are kept. Stored here rather than in memory so any worker can serve /debug/profiles/{id}.
+class RequestProfile(Base):
+    __tablename__ = 'request_profiles'
+    id = Column(String, primary_key=True)  # random hex token
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    method = Column(String, nullable=False)
+    path = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=True)
+    duration_ms = Column(Float, nullable=False)
+    sample_count = Column(Integer, nullable=False, default=0)
+    sql_count = Column(Integer, nullable=False, default=0)
+    sql_ms = Column(Float, nullable=False, default=0.0)
+    report = Column(Text, nullable=False)  # JSON: collapsed stacks and SQL timings
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+# --- Cache Version Model ---
+# Per-table version counters, bumped by the write helpers below; cache.PageCache entries are tagged with them.
+class CacheVersion(Base):
+    __tablename__ = 'cache_versions'
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+# --- Sync Tombstone Model ---
+# Records deletions (and archival) of projects, tasks and customers for the /api/v1/changes delta feed.
+# A task tombstone keeps the assignee, assigner and leader the task had when it left, so it is only sent to
+# users who could see it; reassigning a task also leaves one, carrying the old scope.
+class SyncTombstone(Base):
+    __tablename__ = 'sync_tombstones'
+    id = Column(Integer, primary_key=True)
+    entity_type = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow, index=True)
+    assigned_to = Column(Integer, nullable=True)
+    assigned_by = Column(Integer, nullable=True)
+    leader_id = Column(Integer, nullable=True)
+
 class Customer(Base):
     __tablename__ = 'customers'
     id = Column(Integer, primary_key=True)
@@ -110,6 +276,7 @@ class Customer(Base):
     address1 = Column(String)
     address2 = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     portal_username = Column(String, nullable=True)
     portal_password = Column(String, nullable=True)
     # units = relationship('CustomerUnit', back_populates='customer', cascade="all, delete-orphan")
@@ -160,10 +327,31 @@ class CustomerWorker(Base):
 
 # Add this line to Customer model:
 Customer.units = relationship("CustomerUnit", back_populates="customer", cascade="all, delete-orphan")
+Customer.projects = relationship("Project", back_populates="customer_record", order_by="Project.internal_number")
+
+
+# Project statuses from delivery onwards; a project in any other status past its delivery_date is overdue.
+DELIVERED_PROJECT_STATUSES = ["تحویل شده", "واریز مطالبات", "عودت", "اتمام"]
 
 
 # --- Helper Functions ---
 
+def bump_cache_version(db: Session, table_name: str):
+    updated = db.query(CacheVersion).filter(CacheVersion.table_name == table_name).update({CacheVersion.version: CacheVersion.version + 1}, synchronize_session=False)
+    if not updated:
+        db.add(CacheVersion(table_name=table_name, version=1))
+        db.flush()
+
+def get_cache_versions(db: Session, *table_names: str) -> tuple:
+    # Read from the primary: a lagging replica would hand out an old version and match a stale page.
+    versions = dict(db.query(CacheVersion.table_name, CacheVersion.version).filter(CacheVersion.table_name.in_(table_names)).all())
+    return tuple(versions.get(name, 0) for name in table_names)
+
+def record_activity(db: Session, entries: list):
+    """Queues (entity_type, entity_id, action, changes) entries for changes the session cannot see, such as bulk
+    UPDATE/DELETE statements. audit.py writes them to the activity log once the session commits."""
+    db.info.setdefault("pending_activity", []).extend(entry for entry in entries if entry[2] != "update" or entry[3])
+
 def update_user_profile(db: Session, user_id: int, updates: dict):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
@@ -183,20 +371,35 @@ def update_user_profile(db: Session, user_id: int, updates: dict):
     db.refresh(user)
     return user
 
+def _resolve_customer(db: Session, data: dict):
+    """Copies the customer's name into Project.customer. An empty or unknown customer_id clears both the link and
+    the stored name."""
+    if "customer_id" not in data: return
+    name = db.query(Customer.name).filter(Customer.id == data["customer_id"]).scalar() if data["customer_id"] else None
+    if name is None: data["customer_id"] = None
+    data["customer"] = name
+
 def create_project(db: Session, data: dict):
+    _resolve_customer(db, data)
     new_project = Project(**data)
     db.add(new_project)
+    _apply_pipeline_delta(db, None, _pipeline_row(new_project))
+    bump_cache_version(db, "projects")
     db.commit()
     return new_project
 
+@read_only
 def get_project_by_id(db: Session, project_id: int):
     return db.query(Project).filter(Project.id == project_id).first()
 
+@read_only
 def get_all_projects(db: Session, filters: dict = None):
     query = db.query(Project)
     if filters:
         if filters.get('status'):
             query = query.filter(Project.status == filters['status'])
+        if filters.get('customer_id'):
+            query = query.filter(Project.customer_id == int(filters['customer_id']))
         if filters.get('customer'):
             query = query.filter(Project.customer.contains(filters['customer']))
         if filters.get('search'):
@@ -206,24 +409,131 @@ def get_all_projects(db: Session, filters: dict = None):
     return query.order_by(Project.created_at.desc()).all()
 
 def update_project(db: Session, project_id: int, data: dict):
-    db.query(Project).filter(Project.id == project_id).update(data)
+    project = db.query(Project).filter(Project.id == project_id).first()
+    if project is None: return
+    _resolve_customer(db, data)
+    old_row = _pipeline_row(project)
+    for key, value in data.items():
+        setattr(project, key, value)
+    _apply_pipeline_delta(db, old_row, _pipeline_row(project))
+    bump_cache_version(db, "projects")
     db.commit()
 
 def delete_project(db: Session, project_id: int):
     project = db.query(Project).filter(Project.id == project_id).first()
     if project:
+        _apply_pipeline_delta(db, _pipeline_row(project), None)
         db.delete(project)
+        bump_cache_version(db, "projects")
         db.commit()
 
-def get_task_by_id(db: Session, task_id: int):
-    return db.query(Task).filter(Task.id == task_id).first()
+# --- Project Pipeline Summary Helpers ---
+def _pipeline_row(project: Project) -> dict:
+    return {"status": project.status, "weight_kg": project.weight_kg, "payment_amount": project.payment_amount}
+
+def _apply_pipeline_delta(db: Session, old_row: Optional[dict], new_row: Optional[dict]):
+    """Moves one project's contribution from old_row's status to new_row's, without scanning the projects table.
+
+    Each status row is upserted with INSERT ... ON CONFLICT DO UPDATE, so two requests adding the first project
+    of a new status don't race into an IntegrityError."""
+    dialect = db.get_bind().dialect.name
+    for row, sign in ((old_row, -1), (new_row, 1)):
+        if row is None: continue
+        delta = {
+            "project_count": sign,
+            "total_weight_kg": sign * (row["weight_kg"] or 0.0),
+            "total_payment_amount": sign * (row["payment_amount"] or 0.0),
+        }
+        if dialect in ("sqlite", "postgresql"):
+            insert = (sqlite if dialect == "sqlite" else postgresql).insert(ProjectStatusSummary).values(status=row["status"], updated_at=datetime.utcnow(), **delta)
+            increments = {column: getattr(ProjectStatusSummary, column) + value for column, value in delta.items()}
+            db.execute(insert.on_conflict_do_update(index_elements=["status"], set_=dict(increments, updated_at=insert.excluded.updated_at)))
+            continue
+        updated = db.query(ProjectStatusSummary).filter(ProjectStatusSummary.status == row["status"]).update(
+            {getattr(ProjectStatusSummary, column): getattr(ProjectStatusSummary, column) + value for column, value in delta.items()},
+            synchronize_session=False,
+        )
+        if not updated:
+            db.add(ProjectStatusSummary(status=row["status"], **delta))
+            db.flush()
+
+def reconcile_pipeline_summary(db: Session):
+    """Rebuilds the summary table from a full GROUP BY over projects; run nightly to correct drift."""
+    totals = db.query(
+        Project.status, func.count(Project.id), func.coalesce(func.sum(Project.weight_kg), 0.0),
+        func.coalesce(func.sum(Project.payment_amount), 0.0),
+    ).group_by(Project.status).all()
+    db.query(ProjectStatusSummary).delete(synchronize_session=False)
+    for status, count, weight, payment in totals:
+        db.add(ProjectStatusSummary(status=status, project_count=count, total_weight_kg=weight, total_payment_amount=payment))
+    db.commit()
+    return len(totals)
+
+@read_only
+def get_activity_history(db: Session, entity_type: str, entity_id: int, limit: int = 200):
+    return db.query(ActivityLog).filter(ActivityLog.entity_type == entity_type, ActivityLog.entity_id == entity_id).order_by(ActivityLog.created_at.desc(), ActivityLog.id.desc()).limit(limit).all()
+
+@read_only
+def get_pipeline_summary(db: Session):
+    """{status: {project_count, total_weight_kg, total_payment_amount, overdue_count}}. The totals come from the
+    summary table; overdue_count is counted now, over the indexed delivery_date, since it changes with the date."""
+    overdue = dict(db.query(Project.status, func.count(Project.id)).filter(
+        Project.delivery_date < date.today(), Project.status.notin_(DELIVERED_PROJECT_STATUSES),
+    ).group_by(Project.status).all())
+    return {row.status: {"project_count": row.project_count, "total_weight_kg": row.total_weight_kg, "total_payment_amount": row.total_payment_amount,
+                            "overdue_count": overdue.get(row.status, 0)} for row in db.query(ProjectStatusSummary).all()}
+
+def task_visibility(user: User, model=Task, managed_only: bool = False):
+    """WHERE clause limiting `model` (Task or ArchivedTask) to the tasks `user` may see.
+
+    A boss sees every task, an admin the tasks they assigned, lead or are assigned to, a user the tasks assigned to
+    them. managed_only drops an admin's own assignments, for lists of the tasks they manage. Every list, count,
+    export and single-task lookup filters with this, so the rules live here only and run in SQL.
+    """
+    if user.role == 'boss': return true()
+    if user.role == 'admin':
+        managed = [model.assigned_by == user.id, model.leader_id == user.id]
+        return or_(*managed) if managed_only else or_(model.assigned_to == user.id, *managed)
+    return model.assigned_to == user.id
+
+@read_only
+def get_task_by_id(db: Session, task_id: int, include_archived: bool = True):
+    task = db.query(Task).filter(Task.id == task_id).first()
+    if task is None and include_archived:
+        task = db.query(ArchivedTask).filter(ArchivedTask.id == task_id).first()
+    return task
+
+@read_only
+def get_visible_task(db: Session, user: User, task_id: int, include_archived: bool = True):
+    """The task if `user` may see it, else None. The scope is part of the primary-key lookup, so a task the user may
+    not see costs an index probe and is never loaded."""
+    task = db.query(Task).filter(Task.id == task_id, task_visibility(user)).first()
+    if task is None and include_archived:
+        task = db.query(ArchivedTask).filter(ArchivedTask.id == task_id, task_visibility(user, ArchivedTask)).first()
+    return task
+
+@read_only
+def count_visible_tasks(db: Session, user: User) -> tuple:
+    """(total, completed) over the tasks `user` may see, in one aggregate query."""
+    total, completed = db.query(func.count(Task.id), func.count(case((Task.status == 'Completed', 1)))).filter(task_visibility(user)).one()
+    return total, completed
 
+@read_only
+def search_archived_tasks(db: Session, search: str = None, visible_to: User = None, limit: int = 200):
+    query = db.query(ArchivedTask)
+    if search: query = query.filter(ArchivedTask.title.contains(search))
+    if visible_to is not None: query = query.filter(task_visibility(visible_to, ArchivedTask))
+    return query.order_by(ArchivedTask.completed_at.desc()).limit(limit).all()
+
+@read_only
 def get_all_users(db: Session):
     return db.query(User).order_by(User.username).all()
 
+@read_only
 def get_user_tasks(db: Session, user_id: int):
-    return db.query(Task).filter(Task.assigned_to == user_id).order_by(Task.created_at.desc()).all()
+    return db.query(Task).options(joinedload(Task.admin)).filter(Task.assigned_to == user_id).order_by(Task.created_at.desc()).all()
 
+@read_only
 def get_all_tasks(db: Session):
     return db.query(Task).order_by(Task.created_at.desc()).all()
 
@@ -246,15 +556,21 @@ def create_task(db: Session, data: dict, assigned_by: int):
     db.add(new_task)
     db.commit()
 
+def _status_for_percent(percent: float) -> str:
+    if percent >= 100: return 'Completed'
+    elif percent > 0: return 'In Progress'
+    return 'To Do'
+
 def update_task_fields(db: Session, task_id: int, updates: dict):
     task = db.query(Task).filter(Task.id == task_id).first()
     if not task: return None
 
     if 'success_percent' in updates:
-        percent = updates['success_percent']
-        if percent >= 100: updates['status'] = 'Completed'
-        elif percent > 0: updates['status'] = 'In Progress'
-        else: updates['status'] = 'To Do'
+        updates['status'] = _status_for_percent(updates['success_percent'])
+    if 'status' in updates and (updates['status'] == 'Completed') != (task.status == 'Completed'):
+        updates['completed_at'] = datetime.utcnow() if updates['status'] == 'Completed' else None
+    if 'project_id' in updates and updates['project_id'] != task.project_id:
+        delete_task_dependencies(db, [task_id])  # edges never cross projects
     
     for key, value in updates.items():
         setattr(task, key, value)
@@ -262,19 +578,115 @@ def update_task_fields(db: Session, task_id: int, updates: dict):
     db.refresh(task)
     return task
 
+def bulk_update_tasks(db: Session, task_ids, updates: dict) -> int:
+    """Applies the same updates to many tasks in one UPDATE statement. task_ids may be a list or a SELECT of ids.
+    Does not commit, so a caller working in chunks can make the whole edit one transaction."""
+    values = dict(updates)
+    if 'success_percent' in values:
+        values['status'] = _status_for_percent(values['success_percent'])
+    # Old values of the changed columns, read once in the same transaction, for the activity log.
+    before = db.query(Task.id, *[getattr(Task, key) for key in values]).filter(Task.id.in_(task_ids)).all()
+    record_activity(db, [
+        ("task", row[0], "update", {key: [old, values[key]] for key, old in zip(values, row[1:]) if old != values[key]})
+        for row in before
+    ])
+    reassigned = [row[0] for row in before if any(key in TASK_SCOPE_COLUMNS and old != values[key] for key, old in zip(values, row[1:]))]
+    if reassigned: add_tombstones(db, "task", reassigned)  # lets sync clients that lose the task drop it
+    if 'project_id' in values:
+        column = 1 + list(values).index('project_id')
+        delete_task_dependencies(db, [row[0] for row in before if row[column] != values['project_id']])  # edges never cross projects
+    if 'status' in values:
+        # Keep the original completion time of tasks that were already completed.
+        values['completed_at'] = case((Task.status == 'Completed', Task.completed_at), else_=datetime.utcnow()) if values['status'] == 'Completed' else None
+    return db.query(Task).filter(Task.id.in_(task_ids)).update(values, synchronize_session=False)
+
+def get_task_dependencies(db: Session, task_id: int, visible_to: User = None):
+    """Returns (tasks this one waits for, tasks waiting for this one), limited to those visible_to may see."""
+    scope = task_visibility(visible_to) if visible_to else true()
+    predecessors = db.query(Task).join(TaskDependency, TaskDependency.depends_on_id == Task.id).filter(TaskDependency.task_id == task_id, scope).all()
+    successors = db.query(Task).join(TaskDependency, TaskDependency.task_id == Task.id).filter(TaskDependency.depends_on_id == task_id, scope).all()
+    return predecessors, successors
+
+def add_task_dependency(db: Session, task_id: int, depends_on_id: int) -> TaskDependency:
+    """Raises ValueError if the edge is a self-loop, crosses projects, already exists or would close a cycle."""
+    if task_id == depends_on_id: raise ValueError("A task cannot depend on itself.")
+    task, depends_on = db.get(Task, task_id), db.get(Task, depends_on_id)
+    if task is None or depends_on is None: raise ValueError("Task not found.")
+    if task.project_id is None or task.project_id != depends_on.project_id: raise ValueError("Both tasks must belong to the same project.")
+    successors = {}
+    for pred, succ in db.query(TaskDependency.depends_on_id, TaskDependency.task_id).filter(TaskDependency.project_id == task.project_id):
+        if (pred, succ) == (depends_on_id, task_id): raise ValueError("This dependency already exists.")
+        successors.setdefault(pred, []).append(succ)
+    # The new edge depends_on -> task closes a cycle iff depends_on is already reachable from task.
+    stack, seen = [task_id], {task_id}
+    while stack:
+        for succ in successors.get(stack.pop(), ()):
+            if succ == depends_on_id: raise ValueError("This dependency would create a cycle.")
+            if succ not in seen:
+                seen.add(succ)
+                stack.append(succ)
+    edge = TaskDependency(project_id=task.project_id, task_id=task_id, depends_on_id=depends_on_id)
+    db.add(edge)
+    db.commit()
+    return edge
+
+def remove_task_dependency(db: Session, task_id: int, depends_on_id: int):
+    edge = db.query(TaskDependency).filter(TaskDependency.task_id == task_id, TaskDependency.depends_on_id == depends_on_id).first()
+    if edge:
+        db.delete(edge)
+        db.commit()
+
+def delete_task_dependencies(db: Session, task_ids) -> None:
+    """Drops every edge touching task_ids (a list or a SELECT of ids); called before tasks are deleted or archived."""
+    db.query(TaskDependency).filter(or_(TaskDependency.task_id.in_(task_ids), TaskDependency.depends_on_id.in_(task_ids))).delete(synchronize_session=False)
+
+TASK_SCOPE_COLUMNS = ("assigned_to", "assigned_by", "leader_id")
+
+def add_tombstones(db: Session, entity_type: str, entity_ids) -> None:
+    """Records deletions and reassignments done with bulk statements, before the statement runs; single-row ORM
+    changes are recorded by sync.py's session hook."""
+    model = {"project": Project, "task": Task, "customer": Customer}[entity_type]
+    scope = list(TASK_SCOPE_COLUMNS) if model is Task else []
+    db.execute(insert(SyncTombstone.__table__).from_select(
+        ["entity_type", "entity_id", "deleted_at", *scope],
+        select(literal(entity_type), model.id, literal(datetime.utcnow()), *[getattr(Task, column) for column in scope]).where(model.id.in_(entity_ids)),
+    ))
+
+def bulk_delete_tasks(db: Session, task_ids) -> int:
+    """Deletes tasks with their notifications and dependency edges; like bulk_update_tasks, leaves the commit to the caller."""
+    record_activity(db, [("task", row[0], "delete", {}) for row in db.query(Task.id).filter(Task.id.in_(task_ids)).all()])
+    # Notifications and tombstones go first, while task_ids (possibly a subquery over tasks) still matches the tasks being removed.
+    add_tombstones(db, "task", task_ids)
+    db.query(Notification).filter(Notification.task_id.in_(task_ids)).delete(synchronize_session=False)
+    delete_task_dependencies(db, task_ids)
+    return db.query(Task).filter(Task.id.in_(task_ids)).delete(synchronize_session=False)
+
 def delete_task(db: Session, task_id: int):
     task = db.query(Task).filter(Task.id == task_id).first()
     if task:
+        delete_task_dependencies(db, [task_id])
         db.delete(task)
         db.commit()
 
 def create_notification(db: Session, user_id: int, task_id: int, message: str):
-    exists = db.query(Notification).filter_by(user_id=user_id, task_id=task_id, is_read=0).first()
-    if not exists:
-        notif = Notification(user_id=user_id, task_id=task_id, message=message)
-        db.add(notif)
-        db.commit()
+    create_notifications(db, [{"user_id": user_id, "task_id": task_id, "message": message}])
+
+def create_notifications(db: Session, rows: list) -> None:
+    """Inserts notifications in one statement, skipping any (user_id, task_id) that already has an unread one."""
+    if not rows: return
+    now = datetime.utcnow()
+    values = [{**row, "is_read": 0, "created_at": now} for row in rows]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = (sqlite if dialect == "sqlite" else postgresql).insert(Notification).values(values)
+        db.execute(insert.on_conflict_do_nothing(index_elements=["user_id", "task_id"], index_where=Notification.is_read == 0))
+    else:
+        for row in values:
+            if not db.query(Notification.id).filter_by(user_id=row["user_id"], task_id=row["task_id"], is_read=0).first():
+                db.add(Notification(**row))
+    db.commit()
 
+@read_only
 def get_unread_notifications(db: Session, user_id: int):
     return db.query(Notification).filter_by(user_id=user_id, is_read=0).order_by(Notification.created_at.desc()).all()
 
@@ -301,10 +713,12 @@ def create_customer(db: Session, data: dict):
         address2=data.get('address2')
     )
     db.add(new_customer)
+    bump_cache_version(db, "customers")
     db.commit()
     db.refresh(new_customer)
     return new_customer
 
+@read_only
 def get_all_customers(db: Session, filters: dict = None):
     query = db.query(Customer)
     if filters:
@@ -316,17 +730,31 @@ def get_all_customers(db: Session, filters: dict = None):
             query = query.filter(Customer.registration_status == filters['registration_status'])
     return query.order_by(Customer.created_at.desc()).all()
 
-def get_customer_by_id(db: Session, customer_id: int):
-    return db.query(Customer).filter(Customer.id == customer_id).first()
+@read_only
+def get_customer_by_id(db: Session, customer_id: int, with_projects: bool = False):
+    query = db.query(Customer).filter(Customer.id == customer_id)
+    if with_projects:
+        query = query.options(joinedload(Customer.projects))  # one JOIN on the indexed projects.customer_id
+    return query.first()
 
 def update_customer(db: Session, customer_id: int, data: dict):
-    db.query(Customer).filter(Customer.id == customer_id).update(data)
+    customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    if customer is None: return
+    if data.get("name") and data["name"] != customer.name:
+        for project in customer.projects:  # keep the denormalized name in step (and visible to audit/sync)
+            project.customer = data["name"]
+        bump_cache_version(db, "projects")
+    for key, value in data.items():
+        setattr(customer, key, value)
+    bump_cache_version(db, "customers")
     db.commit()
 
 def delete_customer(db: Session, customer_id: int):
     customer = db.query(Customer).filter(Customer.id == customer_id).first()
     if customer:
-        db.delete(customer)
+        db.delete(customer)  # the ORM clears customer_id on its projects; the name stays
+        bump_cache_version(db, "customers")
+        bump_cache_version(db, "projects")
         db.commit()
 
 # def create_customer_unit(db: Session, customer_id: int, data: dict):
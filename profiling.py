@@ -0,0 +1,203 @@
+"""On-demand profiling of single requests, for bosses.
+
+A boss adds `X-Profile: 1` or `?_profile=1` to a request; ProfilingMiddleware then runs that request with a
+sampling profiler and SQL timing, stores the report in request_profiles and returns its URL in the
+X-Profile-URL response header (the report is shown at /debug/profiles/{id}).
+
+The sampler is a background thread that reads sys._current_frames() every SAMPLE_INTERVAL seconds and counts
+the stacks of the threads this request runs on: the event loop thread, plus each threadpool thread the
+request's contextvars reach (registered the first time it runs a SQL statement there). On a busy worker those
+threads also run other requests' code now and then, so treat small entries with care. Idle stacks (a thread
+waiting on a queue or the selector) are not counted.
+
+When no profile is requested the cost is one header/query check per request and one ContextVar lookup per
+SQL statement.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from database import session_scope
+from models import RequestProfile, User
+
+SAMPLE_INTERVAL = 0.005
+MAX_STACK_DEPTH = 128
+PROFILE_KEEP = 100
+SQL_TEXT_LIMIT = 500
+_IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait"), ("queue.py", "get"), ("thread.py", "_worker")}
+
+_current = ContextVar("request_profile", default=None)
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack_key(frame):
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+        return None
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class RequestProfiler:
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.threads = {threading.get_ident()}
+        self.stacks = Counter()
+        self.samples = 0
+        self.sql = {}  # statement -> [count, total seconds, max seconds]
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in tuple(self.threads):
+                frame = frames.get(thread_id)
+                key = _stack_key(frame) if frame is not None else None
+                if key:
+                    self.stacks[key] += 1
+                    self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def record_sql(self, statement: str, seconds: float):
+        entry = self.sql.setdefault(" ".join(statement.split())[:SQL_TEXT_LIMIT], [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+    def report(self) -> dict:
+        sql = sorted(
+            ({"statement": statement, "count": count, "total_ms": round(total * 1000, 2), "max_ms": round(longest * 1000, 2)}
+             for statement, (count, total, longest) in self.sql.items()),
+            key=lambda row: row["total_ms"], reverse=True,
+        )
+        return {"interval_ms": self.interval * 1000, "stacks": dict(self.stacks.most_common()), "sql": sql}
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profiler = _current.get()
+    if profiler is not None:
+        profiler.threads.add(threading.get_ident())
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profiler = _current.get()
+    if profiler is not None and conn.info.get("profile_query_start"):
+        profiler.record_sql(statement, time.perf_counter() - conn.info["profile_query_start"].pop())
+
+
+def _boss_id(user_id: str):
+    if not user_id or not user_id.isdigit(): return None
+    with session_scope() as db:
+        user = db.get(User, int(user_id))
+        return user.id if user and user.role == 'boss' else None
+
+
+def _save_profile(profile: dict) -> None:
+    with session_scope() as db:
+        db.add(RequestProfile(**profile))
+        db.flush()
+        stale = db.query(RequestProfile.id).order_by(RequestProfile.created_at.desc()).offset(PROFILE_KEEP)
+        db.query(RequestProfile).filter(RequestProfile.id.in_(stale.scalar_subquery())).delete(synchronize_session=False)
+        db.commit()
+
+
+def get_profile(db, profile_id: str):
+    profile = db.query(RequestProfile).filter(RequestProfile.id == profile_id).first()
+    if profile is None: return None
+    return profile, json.loads(profile.report)
+
+
+def flame_tree(stacks: dict, min_fraction: float = 0.005) -> dict:
+    """Folds collapsed stacks into a tree for the flame graph, dropping nodes below min_fraction of all samples.
+
+    Each node has its sample count, its share of all samples (percent) and its share of its parent (width).
+    """
+    root = {"name": "all", "value": 0, "children": {}}
+    for stack, count in stacks.items():
+        root["value"] += count
+        node = root
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"name": name, "value": 0, "children": {}})
+            node["value"] += count
+    total = root["value"] or 1
+    def prune(node, parent_value):
+        children = sorted((child for child in node["children"].values() if child["value"] >= total * min_fraction), key=lambda child: -child["value"])
+        return {
+            "name": node["name"], "value": node["value"], "percent": round(node["value"] * 100 / total, 1),
+            "width": node["value"] * 100 / (parent_value or 1), "children": [prune(child, node["value"]) for child in children],
+        }
+    return prune(root, root["value"])
+
+
+def wants_profile(scope) -> bool:
+    if any(name == b"x-profile" and value in (b"1", b"true") for name, value in scope.get("headers", ())):
+        return True
+    return b"_profile=1" in scope.get("query_string", b"").split(b"&")
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        user_id = await run_in_threadpool(_boss_id, Request(scope).cookies.get("user_id"))
+        if user_id is None:  # not a boss: serve the request normally
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = os.urandom(8).hex()
+        profiler = RequestProfiler()
+        status = {}
+
+        async def send_with_header(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["X-Profile-Id"] = profile_id
+                headers["X-Profile-URL"] = f"/debug/profiles/{profile_id}"
+            await send(message)
+
+        token = _current.set(profiler)
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            profiler.stop()
+            _current.reset(token)
+            duration = time.perf_counter() - started
+            report = profiler.report()
+            path = scope["path"] + (f"?{scope['query_string'].decode('latin-1')}" if scope.get("query_string") else "")
+            await run_in_threadpool(_save_profile, {
+                "id": profile_id, "user_id": user_id, "method": scope["method"], "path": path[:1000], "status_code": status.get("code"),
+                "duration_ms": round(duration * 1000, 2), "sample_count": profiler.samples,
+                "sql_count": sum(row["count"] for row in report["sql"]), "sql_ms": round(sum(row["total_ms"] for row in report["sql"]), 2),
+                "report": json.dumps(report, ensure_ascii=False),
+            })
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from datetime import datetime, time, timedelta
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, name: str, func: Callable, interval: Optional[timedelta] = None, at: Optional[time] = None):
+        if (interval is None) == (at is None):
+            raise ValueError("A job needs exactly one of 'interval' or 'at'")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.at = at
+        self.last_run = None
+        self.last_error = None
+
+    def seconds_until_next_run(self, now: datetime) -> float:
+        if self.interval is not None:
+            return self.interval.total_seconds()
+        next_run = datetime.combine(now.date(), self.at)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+
+class Scheduler:
+    """Runs registered jobs periodically on the event loop; blocking job functions run in a worker thread."""
+
+    def __init__(self):
+        self.jobs = {}
+        self._tasks = []
+
+    def add_job(self, name: str, func: Callable, interval: Optional[timedelta] = None, at: Optional[time] = None):
+        self.jobs[name] = Job(name, func, interval=interval, at=at)
+        return self.jobs[name]
+
+    async def run_job(self, name: str):
+        job = self.jobs[name]
+        try:
+            if asyncio.iscoroutinefunction(job.func):
+                await job.func()
+            else:
+                await asyncio.to_thread(job.func)
+            job.last_error = None
+        except Exception as exc:
+            job.last_error = repr(exc)
+            logger.exception("Scheduled job %s failed", name)
+        job.last_run = datetime.now()
+
+    async def _loop(self, job: Job):
+        while True:
+            await asyncio.sleep(job.seconds_until_next_run(datetime.now()))
+            await self.run_job(job.name)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._loop(job), name=f"job:{job.name}") for job in self.jobs.values()]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
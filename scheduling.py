@@ -0,0 +1,258 @@
+"""Critical-path scheduling over task dependencies, per project.
+
+A project's tasks and task_dependencies edges form a DAG. ProjectSchedule orders it topologically (Kahn) and
+runs one forward pass (earliest start/finish) and one backward pass (latest start/finish against the
+project's delivery_date), so a full build is linear in tasks + edges. Durations are whole days from
+start_date..end_date; an open task still needs the unfinished share of its duration from today on, and a
+completed task is pinned to the day it was completed.
+
+Schedules are cached per project. Each read compares a cheap stamp (task count, latest tasks.updated_at,
+edge count/max id, delivery_date) with the cached one, so writes from any worker are seen; edge ids come from
+AUTOINCREMENT and are never reused, so removing an edge and adding another always changes the stamp. When only
+existing tasks changed, just those tasks are recomputed: the forward pass over them and their descendants,
+the backward pass over them and their ancestors. New or deleted tasks or edges rebuild the schedule.
+Updates and rebuilds run under a per-project lock; the cache-wide lock only guards the LRU itself, so a slow
+build of one project never blocks reads of the others.
+"""
+import heapq
+import math
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import Project, Task, TaskDependency, User, task_visibility
+
+SCHEDULE_CACHE_SIZE = 256
+ONE_DAY = timedelta(days=1)
+
+_TASK_COLUMNS = (Task.id, Task.title, Task.status, Task.start_date, Task.end_date, Task.success_percent, Task.completed_at, Task.updated_at)
+
+
+class _Node:
+    __slots__ = ("id", "title", "start", "duration", "remaining", "done", "finished", "preds", "succs", "es", "ef", "ls", "lf", "slack")
+
+    def __init__(self, row, today: date):
+        self.id, self.title = row.id, row.title
+        self.preds, self.succs = [], []
+        self.set_row(row, today)
+
+    def set_row(self, row, today: date):
+        self.start = row.start_date
+        self.duration = (row.end_date - row.start_date).days + 1 if row.start_date and row.end_date and row.end_date >= row.start_date else 1
+        self.done = row.status == 'Completed'
+        self.finished = row.completed_at.date() if row.completed_at else (row.end_date or today)
+        percent = min(max(row.success_percent or 0.0, 0.0), 100.0)
+        self.remaining = 0 if self.done else max(1, math.ceil(self.duration * (100.0 - percent) / 100.0))
+
+
+class ProjectSchedule:
+    def __init__(self, project_id: int, tasks, edges, delivery_date, today: date):
+        self.project_id = project_id
+        self.delivery_date = delivery_date
+        self.today = today
+        self.nodes = {row.id: _Node(row, today) for row in tasks}
+        for task_id, depends_on_id in edges:
+            if task_id in self.nodes and depends_on_id in self.nodes:
+                self.nodes[task_id].preds.append(depends_on_id)
+                self.nodes[depends_on_id].succs.append(task_id)
+        self.order = self._topological_order()
+        self.position = {node_id: i for i, node_id in enumerate(self.order)}
+        for node_id in self.order:
+            self._forward(self.nodes[node_id])
+        self.deadline = self._deadline()
+        for node_id in reversed(self.order):
+            self._backward(self.nodes[node_id])
+        for node in self.nodes.values():
+            self._slack(node)
+
+    def _topological_order(self) -> list:
+        in_degree = {node_id: len(node.preds) for node_id, node in self.nodes.items()}
+        ready = [node_id for node_id, degree in in_degree.items() if degree == 0]
+        heapq.heapify(ready)  # lowest id first, so the order is stable between builds
+        order = []
+        while ready:
+            node_id = heapq.heappop(ready)
+            order.append(node_id)
+            for succ in self.nodes[node_id].succs:
+                in_degree[succ] -= 1
+                if in_degree[succ] == 0:
+                    heapq.heappush(ready, succ)
+        if len(order) < len(self.nodes):
+            # add_task_dependency rejects cycles, but don't loop on bad data: the nodes of a cycle go last
+            # and the edges that point backwards in this order are ignored.
+            placed = set(order)
+            order.extend(sorted(node_id for node_id in self.nodes if node_id not in placed))
+        return order
+
+    def _preds(self, node):
+        position = self.position[node.id]
+        return (self.nodes[p] for p in node.preds if self.position[p] < position)
+
+    def _succs(self, node):
+        position = self.position[node.id]
+        return (self.nodes[s] for s in node.succs if self.position[s] > position)
+
+    def _forward(self, node):
+        if node.done:
+            node.es, node.ef = min(node.start or node.finished, node.finished), node.finished
+            return
+        es = node.start or self.today
+        for pred in self._preds(node):
+            es = max(es, pred.ef + ONE_DAY)
+        node.es = es
+        node.ef = max(es, self.today) + (node.remaining - 1) * ONE_DAY
+
+    def _deadline(self) -> date:
+        if self.delivery_date: return self.delivery_date
+        return max((node.ef for node in self.nodes.values()), default=self.today)
+
+    def _backward(self, node):
+        if node.done:
+            node.ls, node.lf = node.es, node.ef
+            return
+        lf = self.deadline
+        for succ in self._succs(node):
+            if not succ.done: lf = min(lf, succ.ls - ONE_DAY)
+        node.lf = lf
+        node.ls = lf - (node.remaining - 1) * ONE_DAY
+
+    @staticmethod
+    def _slack(node):
+        node.slack = None if node.done else (node.lf - node.ef).days
+
+    def _closure(self, start_ids, edges) -> list:
+        """start_ids plus everything reachable from them through `edges` (_preds or _succs), in topological order."""
+        seen, stack = set(start_ids), list(start_ids)
+        while stack:
+            for other in edges(self.nodes[stack.pop()]):
+                if other.id not in seen:
+                    seen.add(other.id)
+                    stack.append(other.id)
+        return sorted(seen, key=self.position.__getitem__)
+
+    def update_tasks(self, rows):
+        """Re-reads changed tasks and recomputes only the part of the schedule that depends on them."""
+        changed = []
+        for row in rows:
+            self.nodes[row.id].set_row(row, self.today)
+            self.nodes[row.id].title = row.title
+            changed.append(row.id)
+        if not changed: return
+        forward = self._closure(changed, self._succs)
+        for node_id in forward:
+            self._forward(self.nodes[node_id])
+        deadline = self._deadline()
+        if deadline != self.deadline:
+            self.deadline = deadline
+            backward = self.order
+        else:
+            backward = self._closure(changed, self._preds)
+        for node_id in reversed(backward):
+            self._backward(self.nodes[node_id])
+        for node_id in set(forward).union(backward):
+            self._slack(self.nodes[node_id])
+
+    def set_delivery_date(self, delivery_date):
+        self.delivery_date = delivery_date
+        self.deadline = self._deadline()
+        for node_id in reversed(self.order):
+            self._backward(self.nodes[node_id])
+        for node in self.nodes.values():
+            self._slack(node)
+
+    def to_dict(self) -> dict:
+        open_slack = [node.slack for node in self.nodes.values() if not node.done]
+        critical_slack = min(open_slack, default=None)
+        forecast = max((node.ef for node in self.nodes.values()), default=None)
+        tasks = []
+        for node_id in self.order:
+            node = self.nodes[node_id]
+            tasks.append({
+                "id": node.id, "title": node.title, "completed": node.done, "depends_on": sorted(node.preds),
+                "earliest_start": node.es, "earliest_finish": node.ef, "latest_start": node.ls, "latest_finish": node.lf,
+                "remaining_days": node.remaining, "slack_days": node.slack,
+                "critical": node.slack is not None and node.slack == critical_slack, "late": node.slack is not None and node.slack < 0,
+            })
+        return {
+            "project_id": self.project_id, "delivery_date": self.delivery_date, "forecast_finish": forecast,
+            "late": bool(self.delivery_date and forecast and forecast > self.delivery_date),
+            "critical_path": [task["id"] for task in tasks if task["critical"]], "tasks": tasks,
+        }
+
+
+class ScheduleCache:
+    def __init__(self, max_entries: int = SCHEDULE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # project_id -> (stamp, ProjectSchedule)
+        self._project_locks = {}
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+        self.incremental_updates = 0
+
+    @staticmethod
+    def _stamp(db: Session, project_id: int):
+        task_count, last_update = db.query(func.count(Task.id), func.max(Task.updated_at)).filter(Task.project_id == project_id).one()
+        edge_count, last_edge = db.query(func.count(TaskDependency.id), func.max(TaskDependency.id)).filter(TaskDependency.project_id == project_id).one()
+        return task_count, last_update, edge_count, last_edge
+
+    def _build(self, db: Session, project_id: int, delivery_date, today: date) -> ProjectSchedule:
+        self.rebuilds += 1
+        tasks = db.query(*_TASK_COLUMNS).filter(Task.project_id == project_id).all()
+        edges = db.query(TaskDependency.task_id, TaskDependency.depends_on_id).filter(TaskDependency.project_id == project_id).all()
+        return ProjectSchedule(project_id, tasks, edges, delivery_date, today)
+
+    def _project_lock(self, project_id: int) -> threading.Lock:
+        with self._lock:
+            return self._project_locks.setdefault(project_id, threading.Lock())
+
+    def get(self, db: Session, project_id: int) -> dict:
+        delivery_date = db.query(Project.delivery_date).filter(Project.id == project_id).scalar()
+        stamp, today = self._stamp(db, project_id), date.today()
+        # The project's lock covers the in-place update and the snapshot, so readers never see a half-updated schedule.
+        with self._project_lock(project_id):
+            with self._lock:
+                cached = self._entries.get(project_id)
+            schedule = None
+            if cached and cached[1].today == today:
+                old_stamp, schedule = cached
+                if old_stamp[0] != stamp[0] or old_stamp[2:] != stamp[2:]:
+                    schedule = None  # tasks or edges added/removed: the graph itself changed
+                elif old_stamp[1] != stamp[1]:
+                    changed = db.query(*_TASK_COLUMNS).filter(Task.project_id == project_id, Task.updated_at >= old_stamp[1]).all()
+                    if all(row.id in schedule.nodes for row in changed):
+                        self.incremental_updates += 1
+                        schedule.update_tasks(changed)
+                    else:
+                        schedule = None
+                if schedule is not None and schedule.delivery_date != delivery_date:
+                    schedule.set_delivery_date(delivery_date)
+            if schedule is None:
+                schedule = self._build(db, project_id, delivery_date, today)
+            snapshot = schedule.to_dict()
+            with self._lock:
+                self._entries[project_id] = (stamp, schedule)
+                self._entries.move_to_end(project_id)
+                while len(self._entries) > self.max_entries:
+                    evicted, _ = self._entries.popitem(last=False)
+                    lock = self._project_locks.get(evicted)
+                    if lock is not None and not lock.locked(): del self._project_locks[evicted]
+            return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._project_locks = {pid: lock for pid, lock in self._project_locks.items() if lock.locked()}
+
+
+schedule_cache = ScheduleCache()
+
+
+def get_project_schedule(db: Session, project_id: int, visible_to: User = None) -> dict:
+    """The project's schedule. With visible_to, only the tasks that user may see are listed; the dates and the
+    project forecast are still computed over every task."""
+    schedule = schedule_cache.get(db, project_id)
+    if visible_to is None or visible_to.role == 'boss': return schedule
+    visible = {row[0] for row in db.query(Task.id).filter(Task.project_id == project_id, task_visibility(visible_to))}
+    tasks = [dict(task, depends_on=[i for i in task["depends_on"] if i in visible]) for task in schedule["tasks"] if task["id"] in visible]
+    return dict(schedule, tasks=tasks, critical_path=[i for i in schedule["critical_path"] if i in visible])
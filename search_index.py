@@ -0,0 +1,193 @@
+"""In-memory prefix index behind the autocomplete endpoints.
+
+Each index keeps a sorted list of (normalized term, id) pairs; a lookup bisects to the first term with the
+query as prefix and walks forward until it has `limit` distinct ids, so it never touches the database. Terms
+are the whole normalized field plus each word in it, so "تابلو" finds "پروژه تابلو برق" as well.
+
+Writes committed through this process are applied by session events right after the commit. A scheduled
+job catches up with writes from other workers using updated_at and sync_tombstones (users have neither
+and are simply reloaded; there are few of them).
+"""
+import re
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import database
+from models import Customer, Project, User, SyncTombstone
+from sync import SYNC_OVERLAP
+
+AUTOCOMPLETE_LIMIT = 10
+
+_PERSIAN_TRANSLATION = str.maketrans({
+    "ي": "ی", "ى": "ی", "ئ": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه", "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ؤ": "و",
+    "\u200c": " ", "\u200f": None, "\u200e": None, "\u0640": None,  # ZWNJ, direction marks, tatweel
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic-Indic digits
+})
+_DIACRITICS = re.compile("[\u064b-\u065f\u0670]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text) -> str:
+    """Folds Arabic/Persian letter variants, digits, diacritics, ZWNJ and case so lookups match what users type."""
+    if text is None:
+        return ""
+    text = _DIACRITICS.sub("", str(text).translate(_PERSIAN_TRANSLATION))
+    return _SPACES.sub(" ", text).strip().lower()
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._keys = []   # sorted (term, id)
+        self._terms = {}  # id -> terms indexed for it
+        self._docs = {}   # id -> result payload
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    @staticmethod
+    def _terms_for(texts) -> set:
+        terms = set()
+        for text in texts:
+            value = normalize(text)
+            if value:
+                terms.add(value)
+                terms.update(value.split(" "))
+        return terms
+
+    def load(self, entries):
+        """Replaces the index with (id, texts, doc) entries; one sort instead of an insort per term."""
+        keys, terms_by_id, docs = [], {}, {}
+        for entity_id, texts, doc in entries:
+            terms = self._terms_for(texts)
+            keys.extend((term, entity_id) for term in terms)
+            terms_by_id[entity_id] = terms
+            docs[entity_id] = doc
+        keys.sort()
+        with self._lock:
+            self._keys, self._terms, self._docs = keys, terms_by_id, docs
+
+    def upsert(self, entity_id: int, texts, doc: dict):
+        terms = self._terms_for(texts)
+        with self._lock:
+            self._remove_keys(entity_id)
+            for term in terms:
+                insort(self._keys, (term, entity_id))
+            self._terms[entity_id] = terms
+            self._docs[entity_id] = doc
+
+    def remove(self, entity_id: int):
+        with self._lock:
+            self._remove_keys(entity_id)
+            self._docs.pop(entity_id, None)
+
+    def _remove_keys(self, entity_id: int):
+        for term in self._terms.pop(entity_id, ()):
+            i = bisect_left(self._keys, (term, entity_id))
+            if i < len(self._keys) and self._keys[i] == (term, entity_id):
+                del self._keys[i]
+
+    def search(self, query: str, limit: int = AUTOCOMPLETE_LIMIT) -> list:
+        prefix = normalize(query)
+        results, seen = [], set()
+        with self._lock:
+            i = bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and len(results) < limit:
+                term, entity_id = self._keys[i]
+                if not term.startswith(prefix): break
+                if entity_id not in seen:
+                    seen.add(entity_id)
+                    results.append(self._docs[entity_id])
+                i += 1
+        return results
+
+
+def _project_entry(project):
+    text = f"{project.internal_number} - {project.description or ''}"
+    return project.id, (project.internal_number, project.description), {
+        "id": project.id, "text": text, "internal_number": project.internal_number, "description": project.description,
+    }
+
+
+def _customer_entry(customer):
+    return customer.id, (customer.name, customer.short_name), {
+        "id": customer.id, "text": f"{customer.id} - {customer.name}", "name": customer.name, "short_name": customer.short_name,
+    }
+
+
+def _user_entry(user):
+    return user.id, (user.username,), {"id": user.id, "text": user.username, "username": user.username, "section": user.section}
+
+
+# kind -> (model, columns to load, entry builder)
+INDEXED_MODELS = {
+    "projects": (Project, (Project.id, Project.internal_number, Project.description), _project_entry),
+    "customers": (Customer, (Customer.id, Customer.name, Customer.short_name), _customer_entry),
+    "users": (User, (User.id, User.username, User.section), _user_entry),
+}
+_KIND_BY_MODEL = {model: kind for kind, (model, _, _) in INDEXED_MODELS.items()}
+_TOMBSTONE_TYPES = {"projects": "project", "customers": "customer"}
+
+indexes = {kind: PrefixIndex() for kind in INDEXED_MODELS}
+_watermark = {"since": None}
+
+
+@database.read_only
+def build_indexes(db: Session):
+    started = datetime.utcnow()
+    for kind, (model, columns, entry) in INDEXED_MODELS.items():
+        indexes[kind].load(entry(row) for row in db.query(*columns))
+    _watermark["since"] = started - SYNC_OVERLAP
+
+
+@database.read_only
+def refresh_indexes(db: Session):
+    """Applies rows changed since the last build/refresh, including writes made by other workers."""
+    since = _watermark["since"]
+    if since is None:
+        return build_indexes(db)
+    started = datetime.utcnow()
+    for kind, (model, columns, entry) in INDEXED_MODELS.items():
+        if kind == "users":
+            indexes[kind].load(entry(row) for row in db.query(*columns))
+            continue
+        for row in db.query(*columns).filter(model.updated_at > since):
+            indexes[kind].upsert(*entry(row))
+        deleted = db.query(SyncTombstone.entity_id).filter(SyncTombstone.entity_type == _TOMBSTONE_TYPES[kind], SyncTombstone.deleted_at > since)
+        for (entity_id,) in deleted:
+            indexes[kind].remove(entity_id)
+    _watermark["since"] = started - SYNC_OVERLAP
+
+
+def search(db: Session, kind: str, query: str, limit: int = AUTOCOMPLETE_LIMIT) -> list:
+    if _watermark["since"] is None:
+        build_indexes(db)
+    return indexes[kind].search(query, limit)
+
+
+def _collect(session, flush_context):
+    pending = session.info.setdefault("pending_index", [])
+    for obj in list(session.new) + list(session.dirty):
+        kind = _KIND_BY_MODEL.get(type(obj))
+        if kind: pending.append((kind, "upsert", INDEXED_MODELS[kind][2](obj)))
+    for obj in session.deleted:
+        kind = _KIND_BY_MODEL.get(type(obj))
+        if kind: pending.append((kind, "remove", obj.id))
+
+
+def _apply(session):
+    for kind, action, payload in session.info.pop("pending_index", ()):
+        if action == "upsert": indexes[kind].upsert(*payload)
+        else: indexes[kind].remove(payload)
+
+
+def _discard(session, previous_transaction=None):
+    session.info.pop("pending_index", None)
+
+
+event.listen(database.SessionLocal, "after_flush", _collect)
+event.listen(database.SessionLocal, "after_commit", _apply)
+event.listen(database.SessionLocal, "after_rollback", _discard)
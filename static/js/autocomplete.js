@@ -0,0 +1,20 @@
+// Turns a <select> into a Select2 typeahead fed by /api/autocomplete/<kind>.
+// valueField picks the result field used as the option value (the id by default);
+// options are passed on to Select2 (e.g. allowClear with a placeholder).
+function autocompleteSelect(selector, kind, valueField, options) {
+    $(selector).select2($.extend({
+        ajax: {
+            url: '/api/autocomplete/' + kind,
+            dataType: 'json',
+            delay: 150,
+            data: function (params) { return { q: params.term || '' }; },
+            processResults: function (data) {
+                return {
+                    results: data.results.map(function (item) {
+                        return { id: valueField ? item[valueField] : item.id, text: item.text };
+                    })
+                };
+            }
+        }
+    }, options));
+}
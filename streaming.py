@@ -0,0 +1,68 @@
+"""Streaming HTML responses for long list pages.
+
+TemplateResponse renders a whole page into one string before sending anything, so time-to-first-byte and
+memory grow with the number of rows. stream_template() renders with Jinja's generate_async instead and sends
+the output in STREAM_FLUSH_BYTES pieces. Row lists are passed to the template as TemplateStream.rows(query, *keys):
+an async iterator fetching one batch at a time in the threadpool, so at most one batch of ORM objects is alive
+and the event loop never waits on the database. Each batch is its own short query, read to the end, that
+continues after the previous batch's last key (keyset pagination); a cursor held open for the whole response
+would keep SQLite's read lock and lock writers out while a slow client downloads the page.
+
+The response outlives the request's get_db session, so the page context is built by build_context(db,
+stream) on a session the stream opens itself. Everything the template touches must be loaded there (eager
+loads for relationships used per row), not taken from objects of the request session.
+"""
+from jinja2 import Environment
+from sqlalchemy import tuple_
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+from database import session_scope
+
+STREAM_BATCH_SIZE = 500
+STREAM_FLUSH_BYTES = 16 * 1024
+
+
+def async_environment(env: Environment) -> Environment:
+    """An async-enabled view of env sharing its loader, filters and globals; compiled templates are cached separately."""
+    return env.overlay(enable_async=True, cache_size=400)
+
+
+class TemplateStream:
+    def __init__(self):
+        self._flush = False
+
+    async def rows(self, query, *keys, batch_size: int = STREAM_BATCH_SIZE):
+        """Rows of query (without an ORDER BY) in descending order of keys, NOT NULL columns that end with a unique one.
+        A nullable key would drop its NULL rows after the first batch, since NULL < last is never true."""
+        last = None
+        while True:
+            self._flush = True  # send what is rendered so far instead of holding it while the next batch loads
+            page = query if last is None else query.filter(tuple_(*keys) < tuple_(*last))
+            batch = await run_in_threadpool(page.order_by(*[key.desc() for key in keys]).limit(batch_size).all)
+            for row in batch:
+                yield row
+            if len(batch) < batch_size: return
+            last = [getattr(batch[-1], key.key) for key in keys]
+
+    async def render(self, template, context: dict):
+        buffer, size = [], 0
+        async for chunk in template.generate_async(context):
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_FLUSH_BYTES or self._flush:
+                yield "".join(buffer).encode("utf-8")
+                buffer, size, self._flush = [], 0, False
+        if buffer:
+            yield "".join(buffer).encode("utf-8")
+
+
+def stream_template(env: Environment, template_name: str, build_context, status_code: int = 200) -> StreamingResponse:
+    stream = TemplateStream()
+
+    async def body():
+        with session_scope() as db:
+            context = await run_in_threadpool(build_context, db, stream)
+            async for chunk in stream.render(env.get_template(template_name), context):
+                yield chunk
+
+    return StreamingResponse(body(), status_code=status_code, media_type="text/html; charset=utf-8")
@@ -0,0 +1,105 @@
+"""Delta feed for /api/v1/changes.
+
+Projects, tasks and customers carry an indexed updated_at; deletions leave a SyncTombstone. A client passes
+back the token from its previous response and receives only rows changed since then. Tokens are timestamps
+(microseconds since the epoch), and each new token lags the server clock by SYNC_OVERLAP. Rows committed
+slightly out of timestamp order are therefore sent again rather than missed, so clients must apply rows as
+upserts.
+
+"deleted" lists the ids a client should drop: rows that were deleted or archived, and tasks reassigned out of
+the user's scope. A task's tombstone goes only to users who could see the task before it left, and only while
+they can't see it now.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import and_, event, exists, inspect, or_
+from sqlalchemy.orm import Session
+import database
+from models import Project, Task, Customer, SyncTombstone, User, TASK_SCOPE_COLUMNS, task_visibility
+
+SYNC_OVERLAP = timedelta(seconds=5)
+SYNC_PAGE_SIZE = 500
+EXCLUDED_FIELDS = {"customer": {"portal_password"}}
+_EPOCH = datetime(1970, 1, 1)
+
+SYNC_MODELS = {"project": Project, "task": Task, "customer": Customer}
+
+
+def encode_token(moment: datetime) -> str:
+    return str((moment - _EPOCH) // timedelta(microseconds=1))
+
+
+def decode_token(token: str) -> datetime:
+    """Raises ValueError for anything that is not a token issued by encode_token()."""
+    if not token:
+        return _EPOCH
+    return _EPOCH + timedelta(microseconds=int(token))
+
+
+def _visible_entity_types(user: User) -> list:
+    return ["project", "task", "customer"] if user.role == "boss" else ["project", "task"]
+
+
+def _serialize(entity_type: str, row) -> dict:
+    excluded = EXCLUDED_FIELDS.get(entity_type, set())
+    return {column.name: getattr(row, column.name) for column in row.__table__.columns if column.name not in excluded}
+
+
+@database.read_only
+def get_changes(db: Session, user: User, since: datetime, limit: int = SYNC_PAGE_SIZE) -> dict:
+    until = datetime.utcnow()
+    entity_types = _visible_entity_types(user)
+
+    pages = {}
+    for entity_type in entity_types:
+        model = SYNC_MODELS[entity_type]
+        query = db.query(model).filter(model.updated_at > since, model.updated_at <= until)
+        if model is Task: query = query.filter(task_visibility(user))
+        pages[entity_type] = (query, query.order_by(model.updated_at, model.id).limit(limit + 1).all())
+
+    # If any feed has more than one page, cut every feed at the earliest last-returned timestamp, keeping every
+    # row that shares that timestamp so a bulk update touching many rows at once is never split across pages.
+    truncated = [rows[limit - 1].updated_at for rows in (page for _, page in pages.values()) if len(rows) > limit]
+    has_more = bool(truncated)
+    if has_more: until = min(truncated)
+
+    result = {"has_more": has_more}
+    for entity_type, (query, rows) in pages.items():
+        model = SYNC_MODELS[entity_type]
+        if has_more:
+            rows = [row for row in rows if row.updated_at < until] + query.filter(model.updated_at == until).order_by(model.id).all()
+        result[f"{entity_type}s"] = [_serialize(entity_type, row) for row in rows]
+
+    still_visible = exists().where(Task.id == SyncTombstone.entity_id, task_visibility(user))
+    tombstones = db.query(SyncTombstone).filter(
+        SyncTombstone.deleted_at > since, SyncTombstone.deleted_at <= until, SyncTombstone.entity_type.in_(entity_types),
+        or_(SyncTombstone.entity_type != "task", and_(task_visibility(user, SyncTombstone), ~still_visible)),
+    ).order_by(SyncTombstone.deleted_at).all()
+    result["deleted"] = [{"type": t.entity_type, "id": t.entity_id, "deleted_at": t.deleted_at} for t in tombstones]
+
+    next_since = until if has_more else min(until, datetime.utcnow() - SYNC_OVERLAP)
+    result["token"] = encode_token(max(next_since, since))
+    return result
+
+
+def _previous_scope(task: Task) -> dict:
+    """The task's assignee, assigner and leader as they were loaded, before any pending change."""
+    state = inspect(task)
+    scope = {}
+    for column in TASK_SCOPE_COLUMNS:
+        history = state.attrs[column].history
+        scope[column] = history.deleted[0] if history.deleted else getattr(task, column)
+    return scope
+
+
+def _record_tombstones(session, flush_context, instances):
+    for obj in session.deleted:
+        for entity_type, model in SYNC_MODELS.items():
+            if type(obj) is model:
+                scope = _previous_scope(obj) if model is Task else {}
+                session.add(SyncTombstone(entity_type=entity_type, entity_id=obj.id, **scope))
+    for obj in session.dirty:
+        if type(obj) is Task and any(inspect(obj).attrs[column].history.deleted for column in TASK_SCOPE_COLUMNS):
+            session.add(SyncTombstone(entity_type="task", entity_id=obj.id, **_previous_scope(obj)))
+
+
+event.listen(database.SessionLocal, "before_flush", _record_tombstones)